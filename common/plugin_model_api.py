@@ -113,4 +113,13 @@ class PluginModelListAPI(Resource):
 
     @try_except
     def get(self):
-        return self.__plugin_service.list_models(request)
\ No newline at end of file
+        return self.__plugin_service.list_models(request)
+
+
+class PluginModelStatsAPI(Resource):
+    def __init__(self, plugin_service: PluginService):
+        self.__plugin_service = plugin_service
+
+    @try_except
+    def get(self):
+        return self.__plugin_service.stats(request)
\ No newline at end of file
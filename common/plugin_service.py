@@ -8,14 +8,23 @@ from collections import namedtuple
 import uuid
 
 from common.util.timeutil import get_time_offset, str_to_dt, dt_to_str, get_time_list
-from common.util.meta import insert_meta, get_meta, update_state, get_model_list, clear_state_when_necessary
-from common.util.model import copy_tree_and_zip_and_update_remote, prepare_model
+from common.util.meta import insert_meta, get_meta, update_state, get_model_list, clear_state_when_necessary, meta_cache
+from common.util.model import copy_tree_and_zip_and_update_remote, prepare_model, delete_model
+from common.util.artifactstore import collect_artifacts
+from common.util.modelcache import get_model_cache
+from common.util.modelregistry import create_model_registry
 from common.util.constant import STATUS_SUCCESS, STATUS_FAIL
 from common.util.constant import ModelState
 from common.util.constant import InferenceState
 from common.util.monitor import init_monitor, run_monitor, stop_monitor
+from common.util.storage import init_storage, storage_stats
+from common.util.retryrequests import endpoint_stats
+from common.util.jobscheduler import JobScheduler, QueueFullException, DEFAULT_LANES, LANE_TRAIN, LANE_INFERENCE
+from common.util.jobscheduler import MODE_PROCESS, in_worker_process, worker_threads, get_process_cores
 
-from common.tsanaclient import TSANAClient
+from common.tsanaclient import TSANAClient, DEFAULT_PARALLELISM, SERIES_BATCH_SIZE, PAGE_POINTS
+from common.tsanaclient import METRIC_CACHE_TTL, METRIC_NEGATIVE_CACHE_TTL, metric_cache
+from common.util.seriescache import create_series_cache
 
 import logging
 from telemetry import log
@@ -25,18 +34,12 @@ import yaml
 import atexit
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
-import asyncio
-
-#async infras
-#executor = ProcessPoolExecutor()
-#ThreadPool easy for debug
-executor = ThreadPoolExecutor()
-loop = asyncio.new_event_loop()
-
 #monitor infras
 sched = BackgroundScheduler()
 
+#the plugin service instance of a job worker process
+worker_service = None
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -50,6 +53,26 @@ def load_config(path):
     except Exception:
         return None
 
+def load_scheduler_lanes(config):
+    lanes = {}
+    scheduler_config = getattr(config, 'scheduler', None) or {}
+    for name, default in DEFAULT_LANES.items():
+        lane = dict(default)
+        lane.update(scheduler_config.get(name, None) or {})
+        lanes[name] = lane
+    return lanes
+
+# Initializer of a job worker process, builds a private plugin service instance
+def init_worker_service(service_class):
+    global worker_service
+    worker_service = service_class()
+
+# Run a wrapper of the worker's plugin service, the wrapper and callback are passed by name
+def run_worker_job(wrapper_name, callback_name, *args):
+    wrapper = getattr(worker_service, wrapper_name)
+    callback = getattr(worker_service, callback_name)
+    return wrapper(*args, callback)
+
 
 class PluginService():
 
@@ -60,17 +83,57 @@ class PluginService():
             log.error("No configuration '%s', or the configuration is not in JSON format. " % (config_file))
             exit()
         self.config = config
-        self.tsanaclient = TSANAClient(config.tsana_api_endpoint, config.series_limit)
-
+        self.tsanaclient = TSANAClient(config.tsana_api_endpoint, config.series_limit,
+                                       parallelism=getattr(config, 'tsana_parallelism', DEFAULT_PARALLELISM),
+                                       series_batch_size=getattr(config, 'tsana_series_batch_size', SERIES_BATCH_SIZE),
+                                       page_points=getattr(config, 'tsana_page_points', PAGE_POINTS),
+                                       series_cache=create_series_cache(config),
+                                       metric_cache_ttl=getattr(config, 'metric_cache_ttl', METRIC_CACHE_TTL),
+                                       metric_negative_cache_ttl=getattr(config, 'metric_negative_cache_ttl', METRIC_NEGATIVE_CACHE_TTL))
+
+        # Loaded models of this process, see do_inference of the services
+        self.model_registry = create_model_registry(config)
+
+        if in_worker_process():
+            # A job worker process only runs the wrappers, the API process owns monitor and scheduler
+            # Cores of a train job, the threads the worker process is limited to
+            self.train_cores = worker_threads()
+            return
+
+        # cpu_cores is shared by the API processes of the pod, each schedules its jobs within its share
+        process_cores = get_process_cores((getattr(config, 'scheduler', None) or {}).get('cpu_cores', None))
+        self.scheduler = JobScheduler(load_scheduler_lanes(config), init_worker_service, (type(self),),
+                                      cores=process_cores)
+        # Cores of a train job, the threads of the train lane within the cores a job may take
+        self.train_cores = min(load_scheduler_lanes(config)[LANE_TRAIN]['threads'], self.scheduler.cores.limit)
+
+        init_storage(config)
         init_monitor(config)
         sched.add_job(func=lambda: run_monitor(config), trigger="interval", seconds=10)
+        gc_interval = (getattr(config, 'artifact_store', None) or {}).get('gc_interval', 0)
+        if gc_interval > 0:
+            sched.add_job(func=lambda: collect_artifacts(config), trigger="interval", seconds=gc_interval)
         sched.start()
         atexit.register(lambda: stop_monitor(config))
         atexit.register(lambda: sched.shutdown())
+        atexit.register(lambda: self.scheduler.shutdown(timeout=10))
 
     def do_verify(self, subscription, parameters):
         return STATUS_SUCCESS, ''
 
+    # The metrics of a request, their cached meta is dropped when the request fails to verify
+    def get_metric_ids(self, parameters):
+        return [data['metricId'] for data in parameters.get('seriesSets', []) if 'metricId' in data]
+
+    # Verify a request, a failed verify drops the cached meta and dimensions of its metrics, so a metric
+    # which is created or permitted afterwards is read again by the next request
+    def verify_request(self, subscription, parameters):
+        result, message = self.do_verify(subscription, parameters)
+        if result != STATUS_SUCCESS and 'apiKey' in parameters:
+            for metric_id in self.get_metric_ids(parameters):
+                self.tsanaclient.invalidate_metric(parameters['apiKey'], metric_id)
+        return result, message
+
     def do_train(self, subscription, model_id, model_dir, parameters):
         return STATUS_SUCCESS, ''
 
@@ -98,12 +161,30 @@ class PluginService():
             if callback is not None:
                 callback(subscription, model_id, parameters, ModelState.Failed, timekey, str(e))
         finally:
-            shutil.rmtree(model_dir)
+            shutil.rmtree(model_dir, ignore_errors=True)
         return STATUS_SUCCESS, ''
 
     def get_inference_time_range(self, parameters):
         return []
 
+    # Queue a train / inference wrapper on a lane of the scheduler
+    # Parameters:
+    #   lane: LANE_TRAIN / LANE_INFERENCE
+    #   wrapper: the bound wrapper method, called as wrapper(subscription, model_id, parameters, timekey, callback)
+    #   callback: the bound callback method passed to the wrapper
+    #   on_error: called as on_error(exception) if the job crashed outside of the wrapper
+    def submit_job(self, lane, wrapper, callback, subscription, model_id, parameters, timekey, on_error=None):
+        if self.scheduler.get_mode(lane) == MODE_PROCESS:
+            self.scheduler.submit(lane, run_worker_job, wrapper.__name__, callback.__name__,
+                                  subscription, model_id, parameters, timekey, on_error=on_error)
+        else:
+            self.scheduler.submit(lane, wrapper, subscription, model_id, parameters, timekey, callback, on_error=on_error)
+
+    def train_crashed(self, subscription, model_id, parameters, timekey, error):
+        model_dir = os.path.join(self.config.model_temp_dir, subscription + '_' + model_id + '_' + str(timekey))
+        shutil.rmtree(model_dir, ignore_errors=True)
+        self.train_callback(subscription, model_id, parameters, ModelState.Failed, timekey, 'Training job crashed: ' + str(error))
+
     # inference_window: 30
     # endTime: endtime
     def inference_wrapper(self, subscription, model_id, parameters, timekey, callback): 
@@ -112,9 +193,9 @@ class PluginService():
             results = [{'timestamp': timestamp, 'status': InferenceState.Running.name} for timestamp in self.get_inference_time_range(parameters)]
             self.tsanaclient.save_inference_result(parameters, results)
 
-            prepare_model(self.config, subscription, model_id, timekey, True)
-            prd_dir = os.path.join(self.config.model_temp_dir, subscription + '_' + model_id)
-            result, message = self.do_inference(subscription, model_id, prd_dir, parameters)
+            result, message, prd_dir = prepare_model(self.config, subscription, model_id, timekey)
+            if result == STATUS_SUCCESS:
+                result, message = self.do_inference(subscription, model_id, prd_dir, parameters)
 
             # TODO: Write the result back
             log.info("Inference result here: %s" % result)
@@ -132,27 +213,30 @@ class PluginService():
             return STATUS_FAIL, 'Model is not found! '  
 
         # Train finish, save the model and call callback
+        model_timekey = None
         if model_state == ModelState.Ready:
             result, message = copy_tree_and_zip_and_update_remote(self.config, subscription, model_id, timekey)
             if result != STATUS_SUCCESS:
                 model_state = ModelState.Failed
                 last_error = 'Model storage failed!'
+            else:
+                # the model files are stored and cached under the timekey of the training
+                model_timekey = timekey
 
-        update_state(self.config, subscription, model_id, model_state, None, last_error)
+        update_state(self.config, subscription, model_id, model_state, None, last_error, model_timekey=model_timekey)
         return self.tsanaclient.save_training_result(parameters, model_id, model_state.name, last_error)
 
     def inference_callback(self, subscription, model_id, parameters, timekey, result, last_error=None):
         log.info ("inference callback %s by %s , result = %s" % (model_id, subscription, result))
         if result == STATUS_FAIL: 
-            # Inference failed
-            # Do a model update
-            prepare_model(self.config, subscription, model_id, timekey, True)
+            # Inference failed, the cached model is kept. A model which fails to load is dropped where it is loaded
+            log.error("Inference of %s failed, %s" % (model_id, last_error))
 
     def train(self, request):
         request_body = json.loads(request.data)
         instance_id = request_body['instance']['instanceId']
         subscription = request.headers.get('apim-subscription-id', 'Official')
-        result, message = self.do_verify(subscription, request_body)
+        result, message = self.verify_request(subscription, request_body)
         if result != STATUS_SUCCESS:
             return make_response(jsonify(dict(instanceId=instance_id, modelId='', result=STATUS_FAIL, message='Verify failed! ' + message, modelState=ModelState.Deleted.name)), 400)
 
@@ -170,8 +254,12 @@ class PluginService():
             insert_meta(self.config, subscription, model_id, request_body)
             meta = get_meta(self.config, subscription, model_id)
             timekey = meta['timekey']
-            asyncio.ensure_future(loop.run_in_executor(executor, self.train_wrapper, subscription, model_id, request_body, timekey, self.train_callback))
+            self.submit_job(LANE_TRAIN, self.train_wrapper, self.train_callback, subscription, model_id, request_body, timekey,
+                            on_error=lambda e: self.train_crashed(subscription, model_id, request_body, timekey, e))
             return make_response(jsonify(dict(instanceId=instance_id, modelId=model_id, result=STATUS_SUCCESS, message='Training task created', modelState=ModelState.Training.name)), 201)
+        except QueueFullException as e:
+            update_state(self.config, subscription, model_id, ModelState.Failed, None, str(e))
+            return make_response(jsonify(dict(instanceId=instance_id, modelId=model_id, result=STATUS_FAIL, message='Fail to create new task ' + str(e), modelState=ModelState.Failed.name)), 429)
         except Exception as e: 
             meta = get_meta(self.config, subscription, model_id)
             if meta is not None and meta['timekey'] == timekey: 
@@ -182,7 +270,7 @@ class PluginService():
         request_body = json.loads(request.data)
         instance_id = request_body['instance']['instanceId']
         subscription = request.headers.get('apim-subscription-id', 'Official')
-        result, message = self.do_verify(subscription, request_body)
+        result, message = self.verify_request(subscription, request_body)
         if result != STATUS_SUCCESS:
             return make_response(jsonify(dict(instanceId=instance_id, modelId=model_id, result=STATUS_FAIL, message='Verify failed! ' + message, modelState=ModelState.Failed.name)), 400)
 
@@ -203,8 +291,12 @@ class PluginService():
             return make_response(jsonify(dict(instanceId=instance_id, modelId=model_id, result=STATUS_FAIL, message='Inconsistent series sets or params!', modelState=meta['state'])), 400)
 
         log.info('Create inference task')
-        timekey = meta['timekey']
-        asyncio.ensure_future(loop.run_in_executor(executor, self.inference_wrapper, subscription, model_id, request_body, timekey, self.inference_callback))
+        # timekey of the stored model, models stored before model_timekey fall back to the last update
+        timekey = meta.get('model_timekey', meta['timekey'])
+        try:
+            self.submit_job(LANE_INFERENCE, self.inference_wrapper, self.inference_callback, subscription, model_id, request_body, timekey)
+        except QueueFullException as e:
+            return make_response(jsonify(dict(instanceId=instance_id, modelId=model_id, result=STATUS_FAIL, message='Fail to create new task ' + str(e), modelState=meta['state'])), 429)
         return make_response(jsonify(dict(instanceId=instance_id, modelId=model_id, result=STATUS_SUCCESS, message='Inference task created', modelState=meta['state'])), 201)
 
     def state(self, request, model_id):
@@ -219,6 +311,13 @@ class PluginService():
         except Exception as e:
             return make_response(jsonify(dict(instanceId='', modelId=model_id, result=STATUS_FAIL, message=str(e), modelState=ModelState.Failed.name)), 400)
         
+    def stats(self, request):
+        return make_response(jsonify(dict(scheduler=self.scheduler.stats(), meta_cache=meta_cache.stats(), metric_cache=metric_cache.stats(),
+                                          series_cache=self.tsanaclient.series_cache.stats() if self.tsanaclient.series_cache is not None else None,
+                                          model_cache=get_model_cache(self.config).stats(),
+                                          model_registry=self.model_registry.stats(),
+                                          storage=storage_stats(), endpoints=endpoint_stats())), 200)
+
     def list_models(self, request):
         subscription = request.headers.get('apim-subscription-id', 'Official')
         return make_response(jsonify(get_model_list(self.config, subscription)), 200)
@@ -229,6 +328,9 @@ class PluginService():
             result, message = self.do_delete(subscription, model_id)
             if result == STATUS_SUCCESS:
                 update_state(self.config, subscription, model_id, ModelState.Deleted)
+                get_model_cache(self.config).invalidate(subscription, model_id)
+                self.model_registry.invalidate(subscription, model_id)
+                delete_model(self.config, subscription, model_id)
                 return make_response(jsonify(dict(instanceId='', modelId=model_id, result=STATUS_SUCCESS, message='Model {} has been deleted'.format(model_id), modelState=ModelState.Deleted.name)), 200)
             else:
                 raise Exception(message)
@@ -239,7 +341,7 @@ class PluginService():
         request_body = json.loads(request.data)
         instance_id = request_body['instance']['instanceId']
         subscription = request.headers.get('apim-subscription-id', 'Official')
-        result, message = self.do_verify(subscription, request_body)
+        result, message = self.verify_request(subscription, request_body)
         if result != STATUS_SUCCESS:
             return make_response(jsonify(dict(instanceId=instance_id, modelId='', result=STATUS_FAIL, message='Verify failed! ' + message, modelState=ModelState.Deleted.name)), 400)
         else:
@@ -0,0 +1,194 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+
+from common.util.artifactstore import ArtifactStore, CHUNK_PREFIX, MANIFEST_PREFIX, DATA_PREFIX
+
+DAY = timedelta(days=1)
+
+
+# An in memory AzureBlob with the last modified time of each blob
+class FakeBlob():
+    max_concurrency = 2
+
+    def __init__(self):
+        self.blobs = {}
+        self.times = {}
+        self.uploads = []
+        # called after list_blob_times, as a put_dir running meanwhile
+        self.on_list = None
+
+    def modified(self, blob_name):
+        self.times[blob_name] = datetime.now(timezone.utc)
+
+    def upload_blob(self, container_name, blob_name, data, replace=True):
+        if not replace and blob_name in self.blobs:
+            return
+        self.blobs[blob_name] = data.read() if hasattr(data, 'read') else bytes(data)
+        self.uploads.append(blob_name)
+        self.modified(blob_name)
+
+    def touch_blob(self, container_name, blob_name):
+        if blob_name not in self.blobs:
+            return False
+        self.modified(blob_name)
+        return True
+
+    def exists_blob(self, container_name, blob_name):
+        return blob_name in self.blobs
+
+    def download_blob_bytes(self, container_name, blob_name):
+        if blob_name not in self.blobs:
+            raise ResourceNotFoundError('Blob not found.')
+        return self.blobs[blob_name]
+
+    def list_blob(self, container_name, prefix=None):
+        return [name for name in self.blobs if prefix is None or name.startswith(prefix)]
+
+    def list_blob_times(self, container_name, prefix):
+        result = [(name, self.times[name]) for name in self.list_blob(container_name, prefix)]
+        if self.on_list is not None:
+            on_list, self.on_list = self.on_list, None
+            on_list()
+        return result
+
+    def delete_blob(self, container_name, blob_name, if_unmodified_since=None):
+        if blob_name not in self.blobs:
+            raise ResourceNotFoundError('Blob not found.')
+        if if_unmodified_since is not None and self.times[blob_name] > if_unmodified_since:
+            raise ResourceModifiedError('The condition specified using HTTP conditional header(s) is not met.')
+        del self.blobs[blob_name]
+        del self.times[blob_name]
+
+    def age(self, prefix, delta=DAY * 2):
+        for name in self.list_blob(None, prefix):
+            self.times[name] -= delta
+
+
+class ArtifactStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.blob = FakeBlob()
+        self.store = ArtifactStore(self.blob, 'container', chunk_size=16)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_dir(self, name, files):
+        path = os.path.join(self.temp_dir, name)
+        for file_name, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(path, file_name)), exist_ok=True)
+            with open(os.path.join(path, file_name), 'wb') as f:
+                f.write(content)
+        return path
+
+    def read_dir(self, path):
+        files = {}
+        for root, _, file_names in os.walk(path):
+            for file_name in file_names:
+                with open(os.path.join(root, file_name), 'rb') as f:
+                    files[os.path.relpath(os.path.join(root, file_name), path).replace(os.sep, '/')] = f.read()
+        return files
+
+    def chunks(self):
+        return set(self.blob.list_blob(None, CHUNK_PREFIX))
+
+    def test_round_trip(self):
+        files = {'model.bin': os.urandom(100), 'sub/meta.json': b'{"a": 1}', 'empty': b''}
+        manifest = self.store.put_dir('model', self.make_dir('src', files), properties=dict(timekey='1'))
+
+        loaded = self.store.get_manifest('model')
+        self.assertEqual(loaded, manifest)
+        self.assertEqual(loaded['properties'], dict(timekey='1'))
+        dest = os.path.join(self.temp_dir, 'dest')
+        self.store.get_dir(loaded, dest)
+        self.assertEqual(self.read_dir(dest), files)
+        self.assertIsNone(self.store.get_manifest('other'))
+
+    def test_stored_chunks_are_not_uploaded_again(self):
+        shared = os.urandom(64)
+        self.store.put_dir('m1', self.make_dir('v1', {'a': shared, 'b': os.urandom(16)}))
+        uploaded = len(self.chunks())
+
+        self.blob.uploads = []
+        self.store.put_dir('m2', self.make_dir('v2', {'a': shared, 'b': os.urandom(16)}))
+        # only the chunk of the new file
+        self.assertEqual(len([name for name in self.blob.uploads if name.startswith(CHUNK_PREFIX)]), 1)
+        self.assertEqual(len(self.chunks()), uploaded + 1)
+
+    def test_corrupted_chunk_is_detected(self):
+        manifest = self.store.put_dir('model', self.make_dir('src', {'a': os.urandom(16)}))
+        chunk_name = ArtifactStore.get_chunk_name(manifest['files'][0]['chunks'][0], manifest['compression'])
+        self.blob.blobs[chunk_name] = zlib.compress(b'x' * 16)
+        with self.assertRaises(Exception):
+            self.store.get_dir(manifest, os.path.join(self.temp_dir, 'dest'))
+
+    def test_collect_keeps_referenced_and_recent_chunks(self):
+        self.store.put_dir('kept', self.make_dir('v1', {'a': os.urandom(32)}))
+        self.store.put_dir('deleted', self.make_dir('v2', {'a': os.urandom(32)}))
+        kept = self.chunks()
+        self.store.delete_manifest('deleted')
+        orphans = kept - set(ArtifactStore.get_chunk_name(digest, 'deflated')
+                             for file in self.store.get_manifest('kept')['files'] for digest in file['chunks'])
+
+        # unreferenced, but within the grace
+        self.assertEqual(self.store.collect(grace=DAY.total_seconds()), 0)
+        self.assertEqual(self.chunks(), kept)
+
+        self.blob.age(CHUNK_PREFIX)
+        self.assertEqual(self.store.collect(grace=DAY.total_seconds()), len(orphans))
+        self.assertEqual(self.chunks(), kept - orphans)
+        self.store.get_dir(self.store.get_manifest('kept'), os.path.join(self.temp_dir, 'dest'))
+
+    def test_chunk_touched_during_collect_is_kept(self):
+        data = {'a': os.urandom(32)}
+        self.store.put_dir('old', self.make_dir('v1', data))
+        self.store.delete_manifest('old')
+        self.blob.age(CHUNK_PREFIX)
+
+        # a training of the same files stores its manifest after collect read the manifests
+        self.blob.on_list = lambda: self.store.put_dir('new', self.make_dir('v2', data))
+        self.assertEqual(self.store.collect(grace=DAY.total_seconds()), 0)
+        dest = os.path.join(self.temp_dir, 'dest')
+        self.store.get_dir(self.store.get_manifest('new'), dest)
+        self.assertEqual(self.read_dir(dest), data)
+
+    def test_data_zip(self):
+        files = {'s1.csv': b'timestamp,value\n', 's2.csv': b'timestamp,value\n1,2\n'}
+        blob_name = self.store.put_data_zip('training_data_', self.make_dir('data', files))
+        self.assertTrue(blob_name.startswith(DATA_PREFIX + 'training_data_'))
+        with zipfile.ZipFile(io.BytesIO(self.blob.blobs[blob_name])) as zf:
+            self.assertEqual({name: zf.read(name) for name in zf.namelist()}, files)
+
+        # the same data is touched, not uploaded again
+        self.blob.uploads = []
+        self.assertEqual(self.store.put_data_zip('training_data_', self.make_dir('again', files)), blob_name)
+        self.assertEqual(self.blob.uploads, [])
+
+        self.assertEqual(self.store.collect(grace=DAY.total_seconds()), 0)
+        self.blob.age(DATA_PREFIX)
+        self.assertEqual(self.store.collect(grace=DAY.total_seconds()), 1)
+        self.assertEqual(self.blob.list_blob(None, DATA_PREFIX), [])
+        self.assertEqual(self.blob.list_blob(None, MANIFEST_PREFIX), [])
+
+    def test_data_zip_is_compressed_as_the_chunks(self):
+        files = {'s1.csv': b'timestamp,value\n' * 100}
+        for compression, compress_type in [('stored', zipfile.ZIP_STORED), ('bzip2', zipfile.ZIP_BZIP2),
+                                           ('lzma', zipfile.ZIP_LZMA)]:
+            store = ArtifactStore(self.blob, 'container', compression=compression, level=0)
+            blob_name = store.put_data_zip(compression + '_', self.make_dir(compression, files))
+            with zipfile.ZipFile(io.BytesIO(self.blob.blobs[blob_name])) as zf:
+                self.assertEqual([info.compress_type for info in zf.infolist()], [compress_type])
+                self.assertEqual(zf.read('s1.csv'), files['s1.csv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
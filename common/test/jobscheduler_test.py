@@ -0,0 +1,206 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common.util.jobscheduler import JobScheduler, QueueFullException, MODE_PROCESS, MODE_THREAD
+from common.util.jobscheduler import get_process_cores, set_thread_budget, CoreBudget
+
+
+def lanes(train_mode=MODE_THREAD, train_workers=1, train_queue_size=1):
+    return dict(train=dict(workers=train_workers, queue_size=train_queue_size, mode=train_mode, threads=1),
+                inference=dict(workers=2, queue_size=4, mode=MODE_THREAD, threads=1))
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+# Jobs of process lanes are pickled by name, so they live at module level
+def sleep_job(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def crash_job():
+    os._exit(1)
+
+
+class JobSchedulerTest(unittest.TestCase):
+
+    def test_lanes_are_independent(self):
+        scheduler = JobScheduler(lanes(), cores=8)
+        release = threading.Event()
+        done = threading.Event()
+        try:
+            # the train worker is busy and its queue is full
+            scheduler.submit('train', release.wait)
+            self.assertTrue(wait_until(lambda: scheduler.stats()['train']['running'] == 1))
+            scheduler.submit('train', release.wait)
+            with self.assertRaises(QueueFullException):
+                scheduler.submit('train', release.wait)
+
+            # inference still runs
+            scheduler.submit('inference', done.set)
+            self.assertTrue(done.wait(5))
+
+            stats = scheduler.stats()
+            self.assertEqual(stats['train']['rejected'], 1)
+            self.assertEqual(stats['train']['queue_depth'], 1)
+            self.assertTrue(wait_until(lambda: scheduler.stats()['inference']['completed'] == 1))
+        finally:
+            release.set()
+            scheduler.shutdown(timeout=5)
+
+    def test_train_holding_the_budget_does_not_block_inference(self):
+        scheduler = JobScheduler(lanes(), cores=1)
+        release = threading.Event()
+        done = threading.Event()
+        try:
+            scheduler.submit('train', release.wait)
+            self.assertTrue(wait_until(lambda: scheduler.stats()['train']['running'] == 1))
+            scheduler.submit('inference', done.set)
+            self.assertTrue(done.wait(5))
+            self.assertLess(scheduler.stats()['inference']['max_wait'], 1)
+        finally:
+            release.set()
+            scheduler.shutdown(timeout=5)
+
+    def test_failed_job_calls_on_error(self):
+        scheduler = JobScheduler(lanes(), cores=8)
+        errors = []
+
+        def fail():
+            raise ValueError('bad job')
+
+        try:
+            scheduler.submit('inference', fail, on_error=errors.append)
+            self.assertTrue(wait_until(lambda: scheduler.stats()['inference']['failed'] == 1))
+            self.assertEqual([str(e) for e in errors], ['bad job'])
+        finally:
+            scheduler.shutdown(timeout=5)
+
+    def test_shutdown_with_full_lane_returns(self):
+        scheduler = JobScheduler(lanes(), cores=8)
+        release = threading.Event()
+        ran = []
+        scheduler.submit('train', release.wait)
+        self.assertTrue(wait_until(lambda: scheduler.stats()['train']['running'] == 1))
+        scheduler.submit('train', lambda: ran.append(1))
+
+        # the queue is full and its worker is busy, shutdown must not block on the queue
+        start = time.time()
+        scheduler.shutdown(timeout=0.5)
+        self.assertLess(time.time() - start, 2)
+        with self.assertRaises(QueueFullException):
+            scheduler.submit('inference', lambda: None)
+
+        # the running job finishes, the queued one is dropped
+        release.set()
+        for thread in scheduler.lanes['train'].threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(ran, [])
+
+    def test_shutdown_stops_idle_workers(self):
+        scheduler = JobScheduler(lanes(), cores=8)
+        scheduler.shutdown(timeout=5)
+        for lane in scheduler.lanes.values():
+            for thread in lane.threads:
+                self.assertFalse(thread.is_alive())
+
+    def test_crashed_process_fails_only_its_job(self):
+        scheduler = JobScheduler(lanes(train_mode=MODE_PROCESS, train_workers=2, train_queue_size=4), cores=8)
+        errors = []
+        try:
+            scheduler.submit('train', sleep_job, 3, on_error=errors.append)
+            self.assertTrue(wait_until(lambda: scheduler.stats()['train']['running'] == 1))
+            scheduler.submit('train', crash_job, on_error=errors.append)
+
+            # the slow job in the other slot completes, only the crashed one fails
+            self.assertTrue(wait_until(lambda: scheduler.stats()['train']['completed'] == 1, timeout=60))
+            stats = scheduler.stats()['train']
+            self.assertEqual(stats['failed'], 1)
+            self.assertEqual(stats['crashed'], 1)
+            self.assertEqual(len(errors), 1)
+            self.assertIn('died', str(errors[0]))
+
+            # the crashed slot is restarted
+            scheduler.submit('train', sleep_job, 0)
+            scheduler.submit('train', sleep_job, 0)
+            self.assertTrue(wait_until(lambda: scheduler.stats()['train']['completed'] == 3, timeout=60))
+        finally:
+            scheduler.shutdown(timeout=10)
+
+
+class CoreBudgetTest(unittest.TestCase):
+
+    def acquire_in_thread(self, budget, lane_name, cores):
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(budget.acquire(lane_name, cores)), daemon=True)
+        thread.start()
+        thread.join(0.2)
+        return taken
+
+    def test_a_core_is_kept_for_an_idle_lane(self):
+        budget = CoreBudget(4, ['train', 'inference'])
+        self.assertEqual(budget.limit, 3)
+        self.assertEqual(budget.acquire('train', 8), 3)
+        # train may not take the core of inference
+        self.assertEqual(self.acquire_in_thread(budget, 'train', 1), [])
+        self.assertEqual(budget.acquire('inference', 1), 1)
+        self.assertEqual(budget.stats()['lanes'], dict(train=3, inference=1))
+
+    def test_each_lane_runs_with_fewer_cores_than_lanes(self):
+        budget = CoreBudget(1, ['train', 'inference'])
+        self.assertEqual(budget.acquire('train', 2), 1)
+        self.assertEqual(budget.acquire('inference', 1), 1)
+        taken = self.acquire_in_thread(budget, 'inference', 1)
+        self.assertEqual(taken, [])
+        budget.release('inference', 1)
+        self.assertTrue(wait_until(lambda: taken == [1]))
+
+
+class ProcessCoresTest(unittest.TestCase):
+
+    def test_cores_are_all_of_the_pod_outside_gunicorn(self):
+        with mock.patch.dict(sys.modules), mock.patch.dict(os.environ, {'GUNICORN_WORKER_NUM': '4'}):
+            sys.modules.pop('gunicorn', None)
+            self.assertEqual(get_process_cores(8), 8)
+
+    def test_cores_are_split_between_gunicorn_workers(self):
+        with mock.patch.dict(sys.modules, {'gunicorn': mock.MagicMock()}):
+            with mock.patch.dict(os.environ, {'GUNICORN_WORKER_NUM': '4'}):
+                self.assertEqual(get_process_cores(8), 2)
+                self.assertEqual(get_process_cores(3), 1)
+            with mock.patch.dict(os.environ):
+                os.environ.pop('GUNICORN_WORKER_NUM', None)
+                self.assertEqual(get_process_cores(9), 3)
+
+
+class ThreadBudgetTest(unittest.TestCase):
+
+    def test_tensorflow_is_not_imported(self):
+        with mock.patch.dict(sys.modules), mock.patch.dict(os.environ):
+            sys.modules.pop('tensorflow', None)
+            set_thread_budget(2)
+            self.assertNotIn('tensorflow', sys.modules)
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '2')
+
+    def test_imported_tensorflow_is_configured(self):
+        tf = mock.MagicMock()
+        with mock.patch.dict(sys.modules, {'tensorflow': tf}), mock.patch.dict(os.environ):
+            set_thread_budget(4)
+        tf.config.threading.set_intra_op_parallelism_threads.assert_called_once_with(4)
+        tf.config.threading.set_inter_op_parallelism_threads.assert_called_once_with(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import uuid
+from collections import namedtuple
+from unittest import mock
+
+from azure.common import AzureHttpError
+
+from common.util.constant import ModelState, STATUS_SUCCESS, STATUS_FAIL
+from common.util.meta import insert_meta, get_meta, update_state, meta_cache, UPDATE_RETRY_COUNT
+
+Config = namedtuple('Config', ['az_tsana_meta_table'])
+
+PARAMETERS = dict(groupId='group', seriesSets=[],
+                  instance=dict(appId='app', appName='app', instanceName='inst', instanceId='inst', params={}))
+
+
+# An in memory AzureTable honoring if_match. A concurrent writer changes an entity before each of its
+# next `conflicts` updates
+class FakeTable():
+    def __init__(self):
+        self.entities = {}
+        self.conflicts = 0
+        self.updates = 0
+
+    def write(self, entity):
+        entity = dict(entity)
+        entity['etag'] = uuid.uuid4().hex
+        self.entities[(entity['PartitionKey'], entity['RowKey'])] = entity
+        return entity['etag']
+
+    def insert_or_replace_entity2(self, table_name, entity):
+        return self.write(entity)
+
+    def get_entity(self, table_name, partition_key, row_key):
+        return dict(self.entities[(partition_key, row_key)])
+
+    def update_entity(self, table_name, entity, if_match='*'):
+        self.updates += 1
+        stored = self.entities[(entity['PartitionKey'], entity['RowKey'])]
+        if self.conflicts > 0:
+            self.conflicts -= 1
+            stored = dict(stored, last_error='changed by another request %d' % self.conflicts)
+            self.write(stored)
+            stored = self.entities[(entity['PartitionKey'], entity['RowKey'])]
+        if if_match != '*' and if_match != stored['etag']:
+            raise AzureHttpError('Precondition failed.', 412)
+        return self.write(entity)
+
+
+class UpdateStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Config(az_tsana_meta_table='meta')
+        self.table = FakeTable()
+        self.patch = mock.patch('common.util.meta.get_azure_table', return_value=self.table)
+        self.patch.start()
+        self.model_id = str(uuid.uuid1())
+        insert_meta(self.config, 'sub', self.model_id, PARAMETERS)
+
+    def tearDown(self):
+        self.patch.stop()
+        meta_cache.invalidate(('sub', self.model_id))
+
+    def stored(self):
+        return self.table.get_entity('meta', 'sub', self.model_id)
+
+    def test_update(self):
+        self.assertEqual(update_state(self.config, 'sub', self.model_id, ModelState.Ready, model_timekey=1.5),
+                         (STATUS_SUCCESS, ''))
+        self.assertEqual((self.stored()['state'], self.stored()['model_timekey']), ('Ready', '1.5'))
+        self.assertEqual(get_meta(self.config, 'sub', self.model_id)['etag'], self.stored()['etag'])
+
+    def test_conflict_is_retried_on_the_concurrent_change(self):
+        self.table.conflicts = UPDATE_RETRY_COUNT - 1
+        result, _ = update_state(self.config, 'sub', self.model_id, ModelState.Ready)
+        self.assertEqual(result, STATUS_SUCCESS)
+        self.assertEqual(self.table.updates, UPDATE_RETRY_COUNT)
+        # the change of the other request is kept
+        self.assertEqual(self.stored()['state'], 'Ready')
+        self.assertEqual(self.stored()['last_error'], 'changed by another request 0')
+
+    def test_concurrent_change_is_never_overwritten(self):
+        self.table.conflicts = UPDATE_RETRY_COUNT
+        result, _ = update_state(self.config, 'sub', self.model_id, ModelState.Ready)
+        self.assertEqual(result, STATUS_FAIL)
+        self.assertEqual(self.table.updates, UPDATE_RETRY_COUNT)
+        self.assertEqual(self.stored()['state'], 'Training')
+        self.assertEqual(get_meta(self.config, 'sub', self.model_id), self.stored())
+
+    def test_deleted_model_is_not_updated(self):
+        update_state(self.config, 'sub', self.model_id, ModelState.Deleted)
+        self.assertEqual(update_state(self.config, 'sub', self.model_id, ModelState.Ready)[0], STATUS_FAIL)
+        self.assertEqual(self.stored()['state'], 'Deleted')
+
+
+if __name__ == '__main__':
+    unittest.main()
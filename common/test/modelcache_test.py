@@ -0,0 +1,243 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from collections import namedtuple
+from unittest import mock
+
+from azure.core.exceptions import ResourceNotFoundError
+from flask import Flask, request
+
+from common.plugin_service import PluginService
+from common.util.constant import ModelState, STATUS_SUCCESS
+from common.util.jobscheduler import MODE_THREAD
+from common.util.meta import insert_meta, get_meta
+from common.util.modelcache import ModelCache
+from common.util.modelregistry import ModelRegistry
+
+
+def fill_with(timekey, content='model'):
+    def fill(model_dir):
+        with open(os.path.join(model_dir, 'model.bin'), 'w') as f:
+            f.write(content)
+        return timekey
+    return fill
+
+
+class ModelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_model_is_cached_by_timekey(self):
+        cache = ModelCache(self.root)
+        self.assertIsNone(cache.get('sub', 'm1', '1'))
+        path = cache.put('sub', 'm1', fill_with('1'))
+        self.assertEqual(cache.get('sub', 'm1', '1'), path)
+        self.assertIsNone(cache.get('sub', 'm1', '2'))
+
+        # a new training replaces the files of the older one
+        newer = cache.put('sub', 'm1', fill_with('2'))
+        self.assertEqual(cache.get('sub', 'm1', '2'), newer)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (2, 2))
+
+    def test_invalidate(self):
+        cache = ModelCache(self.root)
+        cache.put('sub', 'm1', fill_with('1'))
+        cache.put('sub', 'm2', fill_with('1'))
+        cache.invalidate('sub', 'm1')
+        self.assertIsNone(cache.get('sub', 'm1', '1'))
+        self.assertIsNotNone(cache.get('sub', 'm2', '1'))
+
+    def test_least_recently_used_is_evicted(self):
+        # a model is 10 bytes
+        cache = ModelCache(self.root, max_bytes=25)
+        first = cache.put('sub', 'm1', fill_with('1', 'x' * 10))
+        cache.put('sub', 'm2', fill_with('1', 'x' * 10))
+        os.utime(first, (1, 1))
+        cache.put('sub', 'm3', fill_with('1', 'x' * 10))
+
+        self.assertIsNone(cache.get('sub', 'm1', '1'))
+        self.assertIsNotNone(cache.get('sub', 'm2', '1'))
+        self.assertIsNotNone(cache.get('sub', 'm3', '1'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_failed_fill_is_not_cached(self):
+        cache = ModelCache(self.root)
+
+        def fail(model_dir):
+            raise Exception('download failed')
+
+        with self.assertRaises(Exception):
+            cache.put('sub', 'm1', fail)
+        self.assertEqual(os.listdir(self.root), [])
+
+
+# An in memory AzureTable of the meta table
+class FakeTable():
+    def __init__(self):
+        self.entities = {}
+
+    def insert_or_replace_entity2(self, table_name, entity):
+        self.entities[(entity['PartitionKey'], entity['RowKey'])] = dict(entity)
+        return uuid.uuid4().hex
+
+    def get_entity(self, table_name, partition_key, row_key):
+        return dict(self.entities[(partition_key, row_key)])
+
+    def update_entity(self, table_name, entity, if_match='*'):
+        return self.insert_or_replace_entity2(table_name, entity)
+
+
+# An in memory AzureBlob counting its calls
+class FakeBlob():
+    max_concurrency = 2
+
+    def __init__(self):
+        self.blobs = {}
+        self.calls = 0
+
+    def upload_blob(self, container_name, blob_name, data, replace=True):
+        self.calls += 1
+        if replace or blob_name not in self.blobs:
+            self.blobs[blob_name] = bytes(data)
+
+    def touch_blob(self, container_name, blob_name):
+        self.calls += 1
+        return blob_name in self.blobs
+
+    def exists_blob(self, container_name, blob_name):
+        self.calls += 1
+        return blob_name in self.blobs
+
+    def download_blob_bytes(self, container_name, blob_name):
+        self.calls += 1
+        if blob_name not in self.blobs:
+            raise ResourceNotFoundError('Blob not found.')
+        return self.blobs[blob_name]
+
+    def download_blob(self, container_name, blob_name, download_file_path):
+        with open(download_file_path, 'wb') as f:
+            f.write(self.download_blob_bytes(container_name, blob_name))
+
+    def delete_blob(self, container_name, blob_name):
+        self.calls += 1
+        self.blobs.pop(blob_name, None)
+
+
+class FakeTSANAClient():
+    def save_training_result(self, parameters, model_id, model_state, message):
+        return STATUS_SUCCESS, ''
+
+    def save_inference_result(self, parameters, result):
+        return STATUS_SUCCESS, ''
+
+
+# Runs the jobs in the caller
+class FakeScheduler():
+    def get_mode(self, lane):
+        return MODE_THREAD
+
+    def submit(self, lane, fn, *args, on_error=None, cores=None):
+        fn(*args)
+
+
+class FakeService(PluginService):
+    def __init__(self, config):
+        self.config = config
+        self.tsanaclient = FakeTSANAClient()
+        self.model_registry = ModelRegistry()
+        self.scheduler = FakeScheduler()
+        self.loads = 0
+        self.model_dirs = []
+
+    def do_inference(self, subscription, model_id, model_dir, parameters):
+        def load(model_dir):
+            self.loads += 1
+            with open(os.path.join(model_dir, 'model.bin')) as f:
+                return f.read()
+
+        self.model_dirs.append(model_dir)
+        self.model_registry.get(subscription, model_id, model_dir, model_dir, load)
+        return STATUS_SUCCESS, ''
+
+
+Config = namedtuple('Config', ['model_temp_dir', 'tsana_app_name', 'az_tsana_meta_table', 'model_cache'])
+
+PARAMETERS = dict(groupId='group', seriesSets=[], apiKey='key',
+                  instance=dict(appId='app', appName='app', instanceName='inst', instanceId='inst', params={}))
+
+
+class TrainThenInferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config = Config(model_temp_dir=self.temp_dir, tsana_app_name='app', az_tsana_meta_table='meta',
+                             model_cache=dict(dir=os.path.join(self.temp_dir, 'model_cache')))
+        self.table = FakeTable()
+        self.blob = FakeBlob()
+        self.patches = [mock.patch('common.util.meta.get_azure_table', return_value=self.table),
+                        mock.patch('common.util.artifactstore.get_azure_blob', return_value=self.blob),
+                        mock.patch('common.util.model.get_azure_blob', return_value=self.blob)]
+        for patch in self.patches:
+            patch.start()
+        self.service = FakeService(self.config)
+        self.app = Flask(__name__)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def train(self, subscription, model_id):
+        insert_meta(self.config, subscription, model_id, PARAMETERS)
+        timekey = get_meta(self.config, subscription, model_id)['timekey']
+        model_dir = os.path.join(self.temp_dir, subscription + '_' + model_id + '_' + str(timekey))
+        os.makedirs(model_dir)
+        with open(os.path.join(model_dir, 'model.bin'), 'w') as f:
+            f.write('trained')
+        self.service.train_callback(subscription, model_id, PARAMETERS, ModelState.Ready, timekey)
+
+    def inference(self, subscription, model_id):
+        with self.app.test_request_context(data=json.dumps(PARAMETERS),
+                                           headers={'apim-subscription-id': subscription}):
+            response = self.service.inference(request, model_id)
+        self.assertEqual(response.status_code, 201)
+
+    def test_repeat_inference_does_not_touch_blob(self):
+        subscription, model_id = 'sub', str(uuid.uuid1())
+        self.train(subscription, model_id)
+        meta = get_meta(self.config, subscription, model_id)
+        self.assertEqual(meta['state'], ModelState.Ready.name)
+
+        # the trained model is moved to the model cache, the first inference finds it there
+        self.blob.calls = 0
+        self.inference(subscription, model_id)
+        self.inference(subscription, model_id)
+        self.assertEqual(self.blob.calls, 0)
+        self.assertEqual(self.service.loads, 1)
+        self.assertEqual(len(set(self.service.model_dirs)), 1)
+
+    def test_inference_downloads_once_on_a_cache_miss(self):
+        subscription, model_id = 'sub', str(uuid.uuid1())
+        self.train(subscription, model_id)
+        shutil.rmtree(self.config.model_cache['dir'])
+        os.makedirs(self.config.model_cache['dir'])
+
+        self.blob.calls = 0
+        self.inference(subscription, model_id)
+        self.assertGreater(self.blob.calls, 0)
+
+        self.blob.calls = 0
+        self.inference(subscription, model_id)
+        self.assertEqual(self.blob.calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
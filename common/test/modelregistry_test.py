@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common.util.modelregistry import ModelRegistry
+
+
+class ModelRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.loads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    # A model dir of size bytes
+    def model_dir(self, name, size=10):
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'model.bin'), 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def load(self, model_dir):
+        self.loads.append(model_dir)
+        return 'model of ' + model_dir
+
+    def test_loaded_model_is_reused(self):
+        registry = ModelRegistry()
+        model_dir = self.model_dir('m1')
+        first = registry.get('sub', 'm1', model_dir, model_dir, self.load)
+        self.assertIs(registry.get('sub', 'm1', model_dir, model_dir, self.load), first)
+        self.assertEqual(self.loads, [model_dir])
+        stats = registry.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['bytes']), (1, 1, 10))
+
+    def test_new_version_is_loaded(self):
+        registry = ModelRegistry()
+        old_dir, new_dir = self.model_dir('m1_1'), self.model_dir('m1_2', size=20)
+        registry.get('sub', 'm1', old_dir, old_dir, self.load)
+        self.assertEqual(registry.get('sub', 'm1', new_dir, new_dir, self.load), 'model of ' + new_dir)
+        self.assertEqual(self.loads, [old_dir, new_dir])
+        # the older version is replaced, not kept beside the new one
+        self.assertEqual((registry.stats()['models'], registry.stats()['bytes']), (1, 20))
+
+    def test_least_recently_used_is_evicted(self):
+        registry = ModelRegistry(max_bytes=25)
+        dirs = [self.model_dir('m%d' % idx) for idx in range(3)]
+        registry.get('sub', 'm0', dirs[0], dirs[0], self.load)
+        registry.get('sub', 'm1', dirs[1], dirs[1], self.load)
+        registry.get('sub', 'm0', dirs[0], dirs[0], self.load)
+        registry.get('sub', 'm2', dirs[2], dirs[2], self.load)
+
+        self.assertEqual(registry.stats()['evictions'], 1)
+        registry.get('sub', 'm0', dirs[0], dirs[0], self.load)
+        registry.get('sub', 'm1', dirs[1], dirs[1], self.load)
+        self.assertEqual(self.loads, dirs[:3] + [dirs[1]])
+
+    def test_model_larger_than_the_registry_is_kept(self):
+        registry = ModelRegistry(max_bytes=5)
+        model_dir = self.model_dir('m1')
+        registry.get('sub', 'm1', model_dir, model_dir, self.load)
+        registry.get('sub', 'm1', model_dir, model_dir, self.load)
+        self.assertEqual(len(self.loads), 1)
+
+    def test_invalidate(self):
+        registry = ModelRegistry()
+        model_dir = self.model_dir('m1')
+        registry.get('sub', 'm1', model_dir, model_dir, self.load)
+        registry.invalidate('sub', 'm1')
+        registry.get('sub', 'm1', model_dir, model_dir, self.load)
+        self.assertEqual(len(self.loads), 2)
+        self.assertEqual(registry.stats()['bytes'], 10)
+
+    def test_failed_load_is_not_registered(self):
+        registry = ModelRegistry()
+        model_dir = self.model_dir('m1')
+
+        def fail(model_dir):
+            raise Exception('bad model')
+
+        with self.assertRaises(Exception):
+            registry.get('sub', 'm1', model_dir, model_dir, fail)
+        self.assertEqual(registry.stats()['models'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import threading
+import unittest
+import uuid
+from unittest import mock
+
+import requests
+
+from common.util.retryrequests import RetryRequests, RetryBudget, CircuitBreaker, CommonException
+from common.util.retryrequests import CircuitOpenException, get_endpoint, FAILURE_THRESHOLD
+
+
+class FakeResponse():
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = b''
+
+
+# A fresh endpoint for every test, endpoints are shared per host
+def new_url():
+    return 'http://%s.test/api' % uuid.uuid4().hex
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def test_retries_are_a_fraction_of_requests(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_tokens_are_capped(self):
+        budget = RetryBudget(ratio=1, max_tokens=2)
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.tokens, 2)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state(), 'closed')
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state(), 'open')
+        self.assertFalse(breaker.allow())
+
+    def test_probe_closes_or_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        # one probe at a time
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state(), 'half-open')
+        self.assertFalse(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state(), 'open')
+
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state(), 'closed')
+        self.assertTrue(breaker.allow())
+
+
+class RetryRequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = new_url()
+        self.endpoint = get_endpoint(self.url)
+        self.client = RetryRequests(3, 1, max_interval=1)
+
+    def send(self, *responses):
+        with mock.patch.object(self.endpoint.session, 'request', side_effect=list(responses)) as request:
+            try:
+                return self.client.get(self.url)
+            finally:
+                self.calls = request.call_count
+
+    def test_retries_server_errors(self):
+        r = self.send(FakeResponse(503), requests.exceptions.ConnectionError('reset'), FakeResponse(200))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.endpoint.retries, 2)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(CommonException) as context:
+            self.send(FakeResponse(404), FakeResponse(200))
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.endpoint.breaker.state(), 'closed')
+
+    def test_throttling_is_retried(self):
+        r = self.send(FakeResponse(429), FakeResponse(200))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.calls, 2)
+
+    def test_retry_budget_limits_retries(self):
+        self.endpoint.budget.tokens = 0
+        with self.assertRaises(CommonException):
+            self.send(FakeResponse(500), FakeResponse(200))
+        # the deposit of this request is less than a retry
+        self.assertEqual(self.calls, 1)
+
+    def test_open_circuit_fails_fast(self):
+        client = RetryRequests(1, 1)
+        with mock.patch.object(self.endpoint.session, 'request', return_value=FakeResponse(500)) as request:
+            for _ in range(FAILURE_THRESHOLD):
+                with self.assertRaises(CommonException):
+                    client.get(self.url)
+            with self.assertRaises(CircuitOpenException):
+                client.get(self.url)
+            self.assertEqual(request.call_count, FAILURE_THRESHOLD)
+        self.assertEqual(self.endpoint.rejected, 1)
+
+    def test_probe_raising_other_exceptions_does_not_block_the_circuit(self):
+        client = RetryRequests(1, 1)
+        self.endpoint.breaker.reset_timeout = 0
+        with mock.patch.object(self.endpoint.session, 'request', return_value=FakeResponse(500)):
+            for _ in range(FAILURE_THRESHOLD):
+                with self.assertRaises(CommonException):
+                    client.get(self.url)
+        self.assertEqual(self.endpoint.breaker.state(), 'open')
+
+        with mock.patch.object(self.endpoint.session, 'request', side_effect=ValueError('bad argument')):
+            with self.assertRaises(ValueError):
+                client.get(self.url)
+        self.assertEqual(self.endpoint.breaker.state(), 'open')
+
+        # the next request probes again and closes the circuit
+        with mock.patch.object(self.endpoint.session, 'request', return_value=FakeResponse(200)):
+            self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertEqual(self.endpoint.breaker.state(), 'closed')
+
+    def test_counters_of_concurrent_requests(self):
+        client = RetryRequests(2, 1, max_interval=1)
+        # client errors are counted as failures, but neither retried nor open the circuit
+        with mock.patch.object(self.endpoint.session, 'request', return_value=FakeResponse(404)):
+            threads = [threading.Thread(target=lambda: [self.send_ignoring_errors(client) for _ in range(50)])
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        stats = self.endpoint.stats()
+        self.assertEqual((stats['requests'], stats['failures'], stats['retries']), (400, 400, 0))
+        self.assertEqual(stats['circuit'], 'closed')
+
+    def send_ignoring_errors(self, client):
+        try:
+            client.get(self.url)
+        except CommonException:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from common.util.constant import TIMESTAMP, VALUE
+from common.util.series import Series
+from common.util.timeutil import str_to_epoch_array
+
+VALUE_LIST = [{TIMESTAMP: '2020-01-01T00:00:00Z', VALUE: 1.5},
+              {TIMESTAMP: '2020-01-02T00:00:00Z', VALUE: None},
+              {TIMESTAMP: '2020-01-03T00:00:00Z', VALUE: 3}]
+
+
+class SeriesTest(unittest.TestCase):
+
+    def test_value_round_trip(self):
+        series = Series('m', 's', dict(a='1'), VALUE_LIST)
+        self.assertEqual(series.timestamps.dtype, np.int64)
+        np.testing.assert_array_equal(series.values, [1.5, np.nan, 3.0])
+        self.assertEqual(series.value, [dict(item, value=None if item[VALUE] is None else float(item[VALUE]))
+                                        for item in VALUE_LIST])
+
+    def test_value_is_a_list(self):
+        series = Series('m', 's', dict(a='1'), VALUE_LIST)
+        self.assertIsInstance(series.value, list)
+        self.assertEqual(json.loads(json.dumps(series.value)), series.value)
+
+        frame = pd.DataFrame(series.value)
+        self.assertEqual(sorted(frame.columns), sorted([TIMESTAMP, VALUE]))
+        self.assertEqual(list(frame[TIMESTAMP]), [item[TIMESTAMP] for item in VALUE_LIST])
+        self.assertEqual(len(Series('m', 's', {}).value), 0)
+
+    def test_from_arrays(self):
+        timestamps = str_to_epoch_array([item[TIMESTAMP] for item in VALUE_LIST])
+        series = Series.from_arrays('m', 's', {}, timestamps, [1.5, np.nan, 3])
+        self.assertEqual(len(series), 3)
+        self.assertEqual(series.value[1], {TIMESTAMP: '2020-01-02T00:00:00Z', VALUE: None})
+        np.testing.assert_array_equal(series.to_pandas().values, series.values)
+        self.assertEqual(list(series.to_frame().columns), [TIMESTAMP, VALUE])
+
+
+if __name__ == '__main__':
+    unittest.main()
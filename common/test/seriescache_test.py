@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from common.util.seriescache import SeriesCache, SeriesCacheEntry
+
+
+def entry(scope, series_id, points, start=0):
+    timestamps = np.arange(start, start + points, dtype=np.int64)
+    return SeriesCacheEntry(scope, series_id, dict(metricId='m', dimension=dict(id=series_id)), start,
+                            start + points, timestamps, timestamps.astype(np.float64) * 2)
+
+
+class SeriesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def test_entries_are_scoped_by_api_key(self):
+        cache = SeriesCache(max_bytes=1024 * 1024)
+        cache.put(entry('key-a', 's1', 10))
+        self.assertIsNotNone(cache.get('key-a', 's1'))
+        self.assertIsNone(cache.get('key-b', 's1'))
+
+    def test_least_recently_used_is_evicted(self):
+        # an entry of 10 points is 160 bytes
+        cache = SeriesCache(max_bytes=400)
+        cache.put(entry('key', 's1', 10))
+        cache.put(entry('key', 's2', 10))
+        cache.get('key', 's1')
+        cache.put(entry('key', 's3', 10))
+
+        self.assertIsNone(cache.get('key', 's2'))
+        self.assertIsNotNone(cache.get('key', 's1'))
+        self.assertIsNotNone(cache.get('key', 's3'))
+        self.assertEqual(cache.stats()['bytes'], 320)
+
+    def test_evicted_entries_are_spilled_and_loaded(self):
+        cache = SeriesCache(max_bytes=200, spill_dir=self.spill_dir, spill_max_bytes=1024 * 1024)
+        first = entry('secret-api-key', 's1', 10, start=5)
+        cache.put(first)
+        cache.put(entry('secret-api-key', 's2', 10))
+
+        self.assertEqual(cache.stats()['spilled'], 1)
+        # the api key is not written to disk
+        for name in os.listdir(self.spill_dir):
+            with open(os.path.join(self.spill_dir, name), 'rb') as f:
+                self.assertNotIn(b'secret-api-key', f.read())
+
+        self.assertIsNone(cache.get('other', 's1'))
+        loaded = cache.get('secret-api-key', 's1')
+        self.assertEqual((loaded.start, loaded.end), (first.start, first.end))
+        self.assertEqual(loaded.id, first.id)
+        np.testing.assert_array_equal(loaded.timestamps, first.timestamps)
+        np.testing.assert_array_equal(loaded.values, first.values)
+        self.assertEqual(cache.stats()['spill_loads'], 1)
+
+    def test_spill_is_bounded(self):
+        cache = SeriesCache(max_bytes=200, spill_dir=self.spill_dir, spill_max_bytes=1)
+        for idx in range(4):
+            cache.put(entry('key', 's%d' % idx, 10))
+        self.assertLessEqual(len(os.listdir(self.spill_dir)), 1)
+
+    def test_slice_copies_the_range(self):
+        e = entry('key', 's1', 10)
+        timestamps, values = e.slice(2, 5)
+        np.testing.assert_array_equal(timestamps, [2, 3, 4])
+        values[0] = -1
+        self.assertEqual(e.values[2], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
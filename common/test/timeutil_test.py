@@ -0,0 +1,64 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from common.util.timeutil import str_to_dt, dt_to_str, dt_to_epoch, epoch_to_dt, get_time_offset, get_time_list
+from common.util.timeutil import str_to_epoch_array, epoch_to_str_array, to_epoch_array, get_time_offset_array
+from common.util.timeutil import get_time_list_array
+
+GRANS = [('Daily', 0), ('Weekly', 0), ('Monthly', 0), ('Yearly', 0), ('Hourly', 0), ('Minutely', 0),
+         ('Secondly', 0), ('Custom', 300)]
+
+# Month ends and a leap day, where Monthly / Yearly clip the day
+STARTS = ['2020-01-31T00:00:00Z', '2020-02-29T13:45:10Z', '2019-12-31T23:59:59Z', '2021-03-15T06:00:00Z']
+
+
+class TimeUtilArrayTest(unittest.TestCase):
+
+    def test_str_to_epoch_array(self):
+        strings = STARTS + ['1970-01-01T00:00:00Z', '2099-12-31T23:59:59Z']
+        np.testing.assert_array_equal(str_to_epoch_array(strings), [dt_to_epoch(str_to_dt(s)) for s in strings])
+
+        # other formats fall back to the scalar parser
+        strings = ['2020-01-31T00:00:00.500Z', '2020-02-29 13:45:10']
+        np.testing.assert_array_equal(str_to_epoch_array(strings), [dt_to_epoch(str_to_dt(s)) for s in strings])
+        self.assertEqual(str_to_epoch_array([]).dtype, np.int64)
+
+    def test_epoch_round_trip(self):
+        epochs = str_to_epoch_array(STARTS)
+        self.assertEqual(epoch_to_str_array(epochs), [dt_to_str(str_to_dt(s)) for s in STARTS])
+        self.assertEqual([epoch_to_dt(e) for e in epochs], [str_to_dt(s) for s in STARTS])
+        np.testing.assert_array_equal(to_epoch_array([str_to_dt(s) for s in STARTS]), epochs)
+
+    def test_get_time_offset_array(self):
+        epochs = str_to_epoch_array(STARTS)
+        for graninfo in GRANS:
+            for offset in [-13, -1, 0, 1, 2, 25]:
+                expected = [dt_to_epoch(get_time_offset(str_to_dt(s), graninfo, offset)) for s in STARTS]
+                np.testing.assert_array_equal(get_time_offset_array(epochs, graninfo, offset), expected,
+                                              err_msg='%s %d' % (graninfo, offset))
+
+    def test_get_time_offset_array_of_offsets(self):
+        offsets = np.arange(-3, 5, dtype=np.int64)
+        for graninfo in GRANS:
+            start = str_to_dt(STARTS[0])
+            expected = [dt_to_epoch(get_time_offset(start, graninfo, int(offset))) for offset in offsets]
+            epochs = np.full(len(offsets), dt_to_epoch(start), dtype=np.int64)
+            np.testing.assert_array_equal(get_time_offset_array(epochs, graninfo, offsets), expected,
+                                          err_msg=str(graninfo))
+
+    def test_get_time_list_array(self):
+        for graninfo in GRANS:
+            for start in STARTS:
+                start_time = str_to_dt(start)
+                for count in [0, 1, 7, 30]:
+                    end_time = get_time_offset(start_time, graninfo, count)
+                    for end in [end_time, end_time + datetime.timedelta(seconds=1)]:
+                        expected = [dt_to_epoch(dt) for dt in get_time_list(start_time, end, graninfo)]
+                        np.testing.assert_array_equal(get_time_list_array(start_time, end, graninfo), expected,
+                                                      err_msg='%s %s %s' % (graninfo, start, end))
+
+
+if __name__ == '__main__':
+    unittest.main()
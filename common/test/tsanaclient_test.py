@@ -0,0 +1,145 @@
+import datetime
+import unittest
+import uuid
+from unittest import mock
+
+import numpy as np
+
+from common.tsanaclient import TSANAClient
+from common.util.seriescache import SeriesCache
+from common.util.timeutil import dt_to_str, str_to_dt, dt_to_epoch
+
+START = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+HOUR = 3600
+
+
+def series_list(count):
+    return [dict(seriesId='s%d' % idx, metricId='m', dimension=dict(idx=str(idx))) for idx in range(count)]
+
+
+def point_value(series_id, dt):
+    return int(series_id[1:]) * 1000 + (dt - START).total_seconds() / HOUR
+
+
+# A fake /metrics/series/data, an hourly point for every series in the range of the request
+class FakeSeriesData():
+    def __init__(self, drop=0):
+        self.requests = []
+        self.drop = drop
+
+    def post(self, api_key, path, data):
+        self.requests.append(data['value'])
+        value = []
+        for s in data['value']:
+            start, end = str_to_dt(s['startTime']), str_to_dt(s['endTime'])
+            points = []
+            dt = start
+            while dt < end:
+                points.append([dt_to_str(dt), point_value(s['seriesId'], dt)])
+                dt += datetime.timedelta(seconds=HOUR)
+            value.append(dict(id=dict(metricId=s['metricId'], dimension=s['dimension']), values=points))
+        return dict(value=value[:len(value) - self.drop])
+
+
+class GetSeriesDataTest(unittest.TestCase):
+
+    def get_series_data(self, fake, series, hours, batch_size, page_points, gran_seconds=HOUR):
+        client = TSANAClient('http://tsana.test', 1000, parallelism=1, series_batch_size=batch_size,
+                             page_points=page_points)
+        with mock.patch.object(client, 'post', side_effect=fake.post):
+            return client.get_series_data('key', series, START, START + datetime.timedelta(hours=hours), gran_seconds)
+
+    def test_pages_by_series_and_points(self):
+        fake = FakeSeriesData()
+        series = series_list(5)
+        result = self.get_series_data(fake, series, hours=10, batch_size=2, page_points=8)
+
+        # batches of 2, 2 and 1 series, 4 / 4 / 8 hours per page
+        self.assertEqual([len(r) for r in fake.requests], [2, 2, 2, 2, 2, 2, 1, 1])
+        for request in fake.requests:
+            span = str_to_dt(request[0]['endTime']) - str_to_dt(request[0]['startTime'])
+            self.assertLessEqual(span.total_seconds() * len(request), 8 * HOUR)
+
+        self.assertEqual(len(result), len(series))
+        for s, (factor_id, epochs, values) in zip(series, result):
+            self.assertEqual(factor_id['dimension'], s['dimension'])
+            self.assertEqual(epochs.dtype, np.int64)
+            self.assertEqual(values.dtype, np.float64)
+            expected = [START + datetime.timedelta(hours=h) for h in range(10)]
+            np.testing.assert_array_equal(epochs, [dt_to_epoch(dt) for dt in expected])
+            np.testing.assert_array_equal(values, [point_value(s['seriesId'], dt) for dt in expected])
+
+    def test_unknown_granularity_pages_by_series_only(self):
+        fake = FakeSeriesData()
+        result = self.get_series_data(fake, series_list(3), hours=10, batch_size=2, page_points=1, gran_seconds=None)
+        self.assertEqual([len(r) for r in fake.requests], [2, 1])
+        self.assertEqual([len(epochs) for _, epochs, _ in result], [10, 10, 10])
+
+    def test_missing_series_is_reported(self):
+        fake = FakeSeriesData(drop=1)
+        with self.assertRaises(Exception) as context:
+            self.get_series_data(fake, series_list(3), hours=2, batch_size=3, page_points=100)
+        self.assertIn('Series s2 is missing', str(context.exception))
+
+
+class SeriesCacheClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSeriesData()
+        self.client = TSANAClient('http://tsana.test', 1000, parallelism=1, series_cache=SeriesCache())
+        self.series = series_list(2)
+
+    def get_columns(self, api_key, start_hour, end_hour):
+        with mock.patch.object(self.client, 'post', side_effect=self.fake.post):
+            self.fake.requests = []
+            return self.client.get_series_columns(api_key, self.series, START + datetime.timedelta(hours=start_hour),
+                                                  START + datetime.timedelta(hours=end_hour), HOUR)
+
+    def assert_hours(self, columns, start_hour, end_hour):
+        for s, (_, epochs, values) in zip(self.series, columns):
+            expected = [START + datetime.timedelta(hours=h) for h in range(start_hour, end_hour)]
+            np.testing.assert_array_equal(epochs, [dt_to_epoch(dt) for dt in expected])
+            np.testing.assert_array_equal(values, [point_value(s['seriesId'], dt) for dt in expected])
+
+    def test_partial_hit_downloads_from_the_last_point(self):
+        self.assert_hours(self.get_columns('key', 0, 10), 0, 10)
+        self.assertEqual(len(self.fake.requests), 1)
+
+        # inside the cached range, no request
+        self.assert_hours(self.get_columns('key', 2, 8), 2, 8)
+        self.assertEqual(self.fake.requests, [])
+
+        # past the cached range, only the last cached point and the new ones are downloaded
+        self.assert_hours(self.get_columns('key', 0, 12), 0, 12)
+        self.assertEqual(len(self.fake.requests), 1)
+        self.assertEqual({s['startTime'] for s in self.fake.requests[0]},
+                         {dt_to_str(START + datetime.timedelta(hours=9))})
+
+        stats = self.client.series_cache.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['partial_hits']), (2, 2, 2))
+
+    def test_other_api_key_misses(self):
+        self.get_columns('key', 0, 10)
+        self.assert_hours(self.get_columns('other', 0, 10), 0, 10)
+        self.assertEqual(len(self.fake.requests), 1)
+        self.assertEqual(self.client.series_cache.stats()['misses'], 4)
+
+
+class MetricCacheTest(unittest.TestCase):
+
+    def test_not_found_is_cached_until_invalidated(self):
+        client = TSANAClient('http://tsana.test', 1000, parallelism=1)
+        metric_id = uuid.uuid4().hex
+        responses = [None, dict(granularityName='Daily')]
+        with mock.patch.object(client, 'get', side_effect=lambda *args, **kwargs: responses.pop(0)) as get:
+            self.assertIsNone(client.get_metric_meta('key', metric_id))
+            self.assertIsNone(client.get_metric_meta('key', metric_id))
+            self.assertEqual(get.call_count, 1)
+
+            client.invalidate_metric('key', metric_id)
+            self.assertEqual(client.get_metric_meta('key', metric_id), dict(granularityName='Daily'))
+            self.assertEqual(get.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,71 @@
+import copy
 import json
 import datetime
 import traceback
 import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
-from common.util.timeutil import get_time_offset, str_to_dt, dt_to_str
+from common.util.timeutil import get_time_offset, str_to_dt, dt_to_str, get_gran_in_seconds
+from common.util.timeutil import str_to_epoch_array, get_time_offset_array, dt_to_epoch, epoch_to_dt
 from common.util.series import Series
-from common.util.retryrequests import RetryRequests
+from common.util.seriescache import SeriesCacheEntry
+from common.util.retryrequests import RetryRequests, CommonException
+from common.util.ttlcache import TTLCache, NOT_FOUND
 from common.util.constant import STATUS_SUCCESS, STATUS_FAIL
 from common.util.constant import InferenceState
 
 from telemetry import log
 
 REQUEST_TIMEOUT_SECONDS = 30
+# Max concurrent requests of one fan-out, e.g. the rank-series lookups of get_timeseries
+DEFAULT_PARALLELISM = 8
+# Max series, and approximate max points, in one /metrics/series/data request
+SERIES_BATCH_SIZE = 100
+PAGE_POINTS = 1000000
+# Seconds to cache metric meta and dimensions, and to remember a metric which is not found or not permitted
+METRIC_CACHE_TTL = 300
+METRIC_NEGATIVE_CACHE_TTL = 30
+# Responses which mean the metric does not exist for the api key
+NOT_FOUND_STATUS = (403, 404)
+
+# Metric meta and dimensions, shared by the clients of a process, keyed by (api key, path)
+metric_cache = TTLCache(METRIC_CACHE_TTL)
+
+
+# Seconds between two points of the queried series, the smallest granularity when series sets differ
+# Return:
+#   seconds, or None if the granularity of any series set is unknown
+def get_gran_seconds(granularityName, granularityAmount, series_sets):
+    if granularityName is not None:
+        return get_gran_in_seconds((granularityName, granularityAmount))
+
+    seconds = None
+    for data in series_sets:
+        if 'metricMeta' not in data:
+            return None
+        gran = get_gran_in_seconds((data['metricMeta']['granularityName'], data['metricMeta']['granularityAmount']))
+        seconds = gran if seconds is None else min(seconds, gran)
+    return seconds
+
 
 
 class TSANAClient(object):
-    def __init__(self, endpoint, series_limit, username=None, password=None, retrycount=3, retryinterval=1000):
+    def __init__(self, endpoint, series_limit, username=None, password=None, retrycount=3, retryinterval=1000,
+                 parallelism=DEFAULT_PARALLELISM, series_batch_size=SERIES_BATCH_SIZE, page_points=PAGE_POINTS,
+                 series_cache=None, metric_cache_ttl=METRIC_CACHE_TTL, metric_negative_cache_ttl=METRIC_NEGATIVE_CACHE_TTL):
         self.endpoint = endpoint
         self.series_limit = series_limit
         self.username = username
         self.password = password
         self.retryrequests = RetryRequests(retrycount, retryinterval)
+        self.parallelism = max(1, parallelism)
+        self.executor = ThreadPoolExecutor(max_workers=self.parallelism) if self.parallelism > 1 else None
+        self.series_batch_size = max(1, series_batch_size)
+        self.page_points = max(1, page_points)
+        self.series_cache = series_cache
+        self.metric_cache_ttl = metric_cache_ttl
+        self.metric_negative_cache_ttl = metric_negative_cache_ttl
 
     def post(self, api_key, path, data):
         url = self.endpoint + path
@@ -62,7 +107,9 @@ class TSANAClient(object):
         except Exception as e:
             raise Exception('TSANA service api "{}" failed, request:{}, {}'.format(path, data, str(e)))
 
-    def get(self, api_key, path):
+    # Parameters:
+    #   not_found: return None instead of raising when the response is one of NOT_FOUND_STATUS
+    def get(self, api_key, path, not_found=False):
         url = self.endpoint + path
         headers = {
             "x-api-key": api_key,
@@ -78,9 +125,42 @@ class TSANAClient(object):
             r = self.retryrequests.get(url=url, headers=headers, auth=auth, timeout=REQUEST_TIMEOUT_SECONDS,
                                        verify=False)
             return r.json()
+        except CommonException as e:
+            if not_found and e.status_code in NOT_FOUND_STATUS:
+                return None
+            raise Exception('TSANA service api "{}" failed, {}'.format(path, str(e)))
         except Exception as e:
             raise Exception('TSANA service api "{}" failed, {}'.format(path, str(e)))
 
+    # Get a metric resource through metric_cache, a metric which is not found or not permitted
+    # is cached as None for metric_negative_cache_ttl seconds
+    # Parameters:
+    #   apiKey: api key for specific user, the cache is scoped by it
+    #   path: path of the resource
+    # Return:
+    #   the response, or None if the metric is not found
+    def get_metric_resource(self, api_key, path):
+        key = (api_key, path)
+        ret = metric_cache.get(key)
+        if ret is not NOT_FOUND:
+            return copy.deepcopy(ret)
+
+        ret = self.get(api_key, path, not_found=True)
+        if ret is None:
+            metric_cache.put(key, None, self.metric_negative_cache_ttl)
+            return None
+
+        metric_cache.put(key, ret, self.metric_cache_ttl)
+        return copy.deepcopy(ret)
+
+    # Drop the cached meta and dimensions of a metric, e.g. after the metric is changed
+    # Parameters:
+    #   apiKey: api key for specific user
+    #   metric_id: a UUID string
+    def invalidate_metric(self, api_key, metric_id):
+        metric_cache.invalidate((api_key, '/metrics/' + metric_id + '/meta'))
+        metric_cache.invalidate((api_key, '/metrics/' + metric_id + '/dimensions'))
+
     # To get the meta of a specific metric from TSANA
     # Parameters:
     #   apiKey: api key for specific user
@@ -88,15 +168,31 @@ class TSANAClient(object):
     # Return:
     #   meta: the meta of the specified metric, or None if there is something wrong. 
     def get_metric_meta(self, api_key, metric_id):
-        return self.get(api_key, '/metrics/' + metric_id + '/meta')
+        return self.get_metric_resource(api_key, '/metrics/' + metric_id + '/meta')
 
     def get_dimesion_values(self, api_key, metric_id, dimension_name):
-        dims = self.get(api_key, '/metrics/' + metric_id + '/dimensions')
-        if 'dimensions' in dims and dimension_name in dims['dimensions']:
+        dims = self.get_metric_resource(api_key, '/metrics/' + metric_id + '/dimensions')
+        if dims is not None and 'dimensions' in dims and dimension_name in dims['dimensions']:
             return dims['dimensions'][dimension_name]
         else:
             return None
 
+    # Query the top series of a series set from TSANA
+    # Parameters:
+    #   apiKey: api key for specific user
+    #   series_set: a series set with metricId and dimensionFilter
+    #   start_str: the start time string
+    #   top: max number of series to return
+    # Return:
+    #   the rank-series result, series are in 'value'
+    def rank_series(self, api_key, series_set, start_str, top):
+        dim = {}
+        for dimkey in series_set['dimensionFilter']:
+            dim[dimkey] = [series_set['dimensionFilter'][dimkey]]
+
+        para = dict(metricId=series_set['metricId'], dimensions=dim, count=top, startTime=start_str)
+        return self.post(api_key, '/metrics/' + series_set['metricId'] + '/rank-series', data=para)
+
     # Query time series from TSANA
     # Parameters: 
     #   apiKey: api key for specific user
@@ -118,17 +214,18 @@ class TSANAClient(object):
         dedup = {}
         series = []
 
-        # Query each series's tag
+        # Query each series's tag, concurrently, the results keep the order of series_sets
         for data in series_sets:
-            dim = {}
             if 'dimensionFilter' not in data:
                 data['dimensionFilter'] = data['filters']
 
-            for dimkey in data['dimensionFilter']:
-                dim[dimkey] = [data['dimensionFilter'][dimkey]]
+        query = lambda data: self.rank_series(api_key, data, start_str, top)
+        if self.executor is not None and len(series_sets) > 1:
+            ranks = list(self.executor.map(query, series_sets))
+        else:
+            ranks = [query(data) for data in series_sets]
 
-            para = dict(metricId=data['metricId'], dimensions=dim, count=top, startTime=start_str)
-            ret = self.post(api_key, '/metrics/' + data['metricId'] + '/rank-series', data=para)
+        for data, ret in zip(series_sets, ranks):
             for s in ret['value']:
                 if s['seriesId'] not in dedup:
                     s['seriesSetId'] = data['seriesSetId']
@@ -139,32 +236,122 @@ class TSANAClient(object):
                     series.append(s)
                     dedup[s['seriesId']] = True
 
-        # Query the data
+        # Query the data, page by page, only the ranges missing from the series cache are downloaded
         multi_series_data = None
         if len(series) > 0:
-            ret = self.post(api_key, '/metrics/series/data', data=dict(value=series))
-            if granularityName is not None:
-                multi_series_data = [
-                    Series(factor['id']['metricId'], series[idx]['seriesSetId'], factor['id']['dimension'],
-                           [dict(timestamp=get_time_offset(str_to_dt(y[0]), (granularityName, granularityAmount),
-                                                           offset)
-                                 , value=y[1])
-                            for y in factor['values']])
-                    for idx, factor in enumerate(ret['value'])
-                ]
-            else:
-                multi_series_data = [
-                    Series(factor['id']['metricId'], series[idx]['seriesSetId'], factor['id']['dimension'],
-                           value=[dict(timestamp=y[0]
-                                       , value=y[1])
-                                  for y in factor['values']])
-                    for idx, factor in enumerate(ret['value'])
-                ]
+            gran_seconds = get_gran_seconds(granularityName, granularityAmount, series_sets)
+            columns = self.get_series_columns(api_key, series, start_time, end_time, gran_seconds)
+            multi_series_data = []
+            for idx in range(len(columns)):
+                # release the columns of a series as soon as it is converted
+                (factor_id, epochs, values), columns[idx] = columns[idx], None
+                if granularityName is not None:
+                    epochs = get_time_offset_array(epochs, (granularityName, granularityAmount), offset)
+                multi_series_data.append(Series.from_arrays(factor_id['metricId'], series[idx]['seriesSetId'], factor_id['dimension'],
+                                                            epochs, values))
         else:
             log.info("Series is empty")
 
         return multi_series_data
 
+    # Get the raw data points of series in [start_time, end_time), through the series cache if any.
+    # A cached range is served as is up to its last point, the last point and anything after it are
+    # downloaded again, so a point written after it was cached is picked up
+    # Parameters:
+    #   apiKey: api key for specific user
+    #   series: Array of series returned by rank_series
+    #   start_time: inclusive, the first timestamp to be query
+    #   end_time: exclusive
+    #   gran_seconds: seconds between two points, None to page by series only
+    # Return:
+    #   A array of (id, epochs, values), one for each series in the same order, epochs are UTC epoch nanoseconds
+    def get_series_columns(self, api_key, series, start_time, end_time, gran_seconds):
+        if self.series_cache is None:
+            return self.get_series_data(api_key, series, start_time, end_time, gran_seconds)
+
+        start, end = dt_to_epoch(start_time), dt_to_epoch(end_time)
+        columns = [None] * len(series)
+        entries = [None] * len(series)
+        # series to download, grouped by the time to download from
+        missing = {}
+        for idx, s in enumerate(series):
+            entry = self.series_cache.get(api_key, s['seriesId'])
+            if entry is None or not entry.start <= start <= entry.end:
+                self.series_cache.record()
+                missing.setdefault(start, []).append(idx)
+                continue
+
+            last = entry.timestamps[-1] if len(entry.timestamps) > 0 else entry.start
+            if end <= last:
+                self.series_cache.record(hit=True)
+                columns[idx] = (entry.id,) + entry.slice(start, end)
+            else:
+                self.series_cache.record(partial=True)
+                entries[idx] = entry
+                missing.setdefault(max(start, int(last)), []).append(idx)
+
+        for fetch_start, indices in missing.items():
+            buffers = self.get_series_data(api_key, [series[idx] for idx in indices], epoch_to_dt(fetch_start), end_time, gran_seconds)
+            for idx, (factor_id, epochs, values) in zip(indices, buffers):
+                entry = entries[idx]
+                if entry is None:
+                    entry = SeriesCacheEntry(api_key, series[idx]['seriesId'], factor_id, start, end, epochs, values)
+                else:
+                    keep = np.searchsorted(entry.timestamps, fetch_start)
+                    entry = SeriesCacheEntry(entry.scope, entry.series_id, factor_id, entry.start, max(end, entry.end),
+                                             np.concatenate([entry.timestamps[:keep], epochs]),
+                                             np.concatenate([entry.values[:keep], values]))
+                self.series_cache.put(entry)
+                columns[idx] = (factor_id,) + entry.slice(start, end)
+
+        return columns
+
+    # Download the data points of series, in pages of at most series_batch_size series and about
+    # page_points points, so neither a request nor a response grows with the number of series or the history.
+    # Every page is converted to arrays as it arrives, and the pages of a series are concatenated at the end
+    # Parameters:
+    #   apiKey: api key for specific user
+    #   series: Array of series returned by rank_series
+    #   start_time: inclusive, the first timestamp to be query
+    #   end_time: exclusive
+    #   gran_seconds: seconds between two points, None to page by series only
+    # Return:
+    #   A array of (id, epochs, values), one for each series in the same order, epochs are UTC epoch nanoseconds
+    def get_series_data(self, api_key, series, start_time, end_time, gran_seconds):
+        # (id, epochs of each page, values of each page) of every series
+        buffers = [None] * len(series)
+        for batch_start in range(0, len(series), self.series_batch_size):
+            batch = series[batch_start: batch_start + self.series_batch_size]
+            if gran_seconds is None:
+                page_span = end_time - start_time
+            else:
+                page_span = datetime.timedelta(seconds=max(1, self.page_points // len(batch)) * gran_seconds)
+
+            page_start = start_time
+            while True:
+                page_end = min(page_start + page_span, end_time)
+                body = [dict(s, startTime=dt_to_str(page_start), endTime=dt_to_str(page_end)) for s in batch]
+                ret = self.post(api_key, '/metrics/series/data', data=dict(value=body))
+                if len(ret['value']) != len(batch):
+                    if len(ret['value']) < len(batch):
+                        raise Exception('Series {} is missing from the response of /metrics/series/data, {} of {} series returned.'
+                                        .format(batch[len(ret['value'])]['seriesId'], len(ret['value']), len(batch)))
+                    raise Exception('/metrics/series/data returned {} series for {} requested.'.format(len(ret['value']), len(batch)))
+
+                for idx, factor in enumerate(ret['value']):
+                    if buffers[batch_start + idx] is None:
+                        buffers[batch_start + idx] = (factor['id'], [], [])
+                    _, epochs, values = buffers[batch_start + idx]
+                    epochs.append(str_to_epoch_array([y[0] for y in factor['values']]))
+                    values.append(np.array([y[1] for y in factor['values']], dtype=np.float64))
+                # drop the page before the next one is downloaded
+                ret = None
+                page_start = page_end
+                if page_start >= end_time:
+                    break
+
+        return [(factor_id, np.concatenate(epochs), np.concatenate(values)) for factor_id, epochs, values in buffers]
+
     # Save a training result back to TSANA
     # Parameters: 
     #   parameters: a dict object which should includes
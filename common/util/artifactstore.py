@@ -0,0 +1,238 @@
+import bz2
+import hashlib
+import json
+import lzma
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+
+from .storage import get_azure_blob
+from .zipstream import ZipStream, COMPRESSIONS
+
+from telemetry import log
+
+CHUNK_PREFIX = 'chunks/'
+MANIFEST_PREFIX = 'manifests/'
+DATA_PREFIX = 'data/'
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# Unreferenced chunks younger than this may belong to an upload in progress, they are kept
+DEFAULT_GC_GRACE = 24 * 60 * 60
+DEFAULT_LEVEL = 6
+
+# The codecs of the chunks, named as the model_package compressions
+CODECS = {
+    'stored': (lambda data, level: data, lambda data: data),
+    'deflated': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'bzip2': (lambda data, level: bz2.compress(data, max(1, level)), bz2.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+}
+
+
+# Hash of the files in a directory, their relative paths and contents
+# Return: a sha256 hex digest, the same for directories of the same files
+def hash_dir(src_dir):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            full_file_name = os.path.join(root, file_name)
+            digest.update(os.path.relpath(full_file_name, src_dir).replace(os.sep, '/').encode('utf-8') + b'\0')
+            with open(full_file_name, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# A content addressed store of directories in AzureBlob. Files are split into chunks named by the
+# sha256 of their content, and a manifest names the chunks of each file, so a chunk shared by
+# directories, or by trainings of a model, is uploaded and stored once. Chunks no manifest refers to
+# are removed by collect, and so are data zips which are not used any more
+# Parameters:
+#   azure_blob: an AzureBlob, its max_concurrency chunks are transferred at once
+#   container_name: the container of chunks and manifests
+#   chunk_size: bytes of a chunk before compression
+#   compression: a name of CODECS, chunks are compressed with it
+#   level: the compression level
+class ArtifactStore():
+    def __init__(self, azure_blob, container_name, chunk_size=DEFAULT_CHUNK_SIZE, compression='deflated',
+                 level=DEFAULT_LEVEL):
+        if compression not in CODECS:
+            raise Exception('Compression {} is not supported, use one of {}.'.format(compression,
+                                                                                     list(CODECS.keys())))
+        self.azure_blob = azure_blob
+        self.container_name = container_name
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.level = level
+
+    @staticmethod
+    def get_chunk_name(digest, compression):
+        return CHUNK_PREFIX + digest + '.' + compression
+
+    def __put_chunk(self, path, offset):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(self.chunk_size)
+        digest = hashlib.sha256(data).hexdigest()
+        chunk_name = ArtifactStore.get_chunk_name(digest, self.compression)
+        # an existing chunk is touched, so collect keeps it for the manifest written after it
+        if self.azure_blob.touch_blob(self.container_name, chunk_name):
+            return digest, 0
+        compressed = CODECS[self.compression][0](data, self.level)
+        self.azure_blob.upload_blob(self.container_name, chunk_name, compressed, replace=False)
+        return digest, len(compressed)
+
+    # Upload the files of src_dir, and the manifest naming their chunks
+    # Parameters:
+    #   name: the name of the manifest
+    #   src_dir: the directory to upload
+    #   properties: optional, a dict saved in the manifest
+    # Return:
+    #   the manifest
+    def put_dir(self, name, src_dir, properties=None):
+        start = time.time()
+        files = []
+        tasks = []
+        for root, dirs, file_names in os.walk(src_dir):
+            dirs.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(root, file_name)
+                size = os.path.getsize(path)
+                files.append(dict(path=os.path.relpath(path, src_dir).replace(os.sep, '/'), size=size))
+                tasks.append([(path, offset) for offset in range(0, size, self.chunk_size)])
+
+        with ThreadPoolExecutor(max_workers=self.azure_blob.max_concurrency) as executor:
+            futures = [[executor.submit(self.__put_chunk, path, offset) for path, offset in file_tasks]
+                       for file_tasks in tasks]
+            uploaded = 0
+            for file, file_futures in zip(files, futures):
+                results = [future.result() for future in file_futures]
+                file['chunks'] = [digest for digest, _ in results]
+                uploaded += sum(1 for _, size in results if size > 0)
+
+        manifest = dict(name=name, chunk_size=self.chunk_size, compression=self.compression, files=files,
+                        properties=properties or {}, created=time.time())
+        self.azure_blob.upload_blob(self.container_name, MANIFEST_PREFIX + name,
+                                    json.dumps(manifest).encode('utf-8'))
+        log.info("Artifact %s stored in %.2fs, %d of %d chunks uploaded" % (name, time.time() - start, uploaded,
+                                                                           sum(len(x) for x in tasks)))
+        return manifest
+
+    # Return: the manifest, None if there is no manifest of name
+    def get_manifest(self, name):
+        if not self.azure_blob.exists_blob(self.container_name, MANIFEST_PREFIX + name):
+            return None
+        return json.loads(self.azure_blob.download_blob_bytes(self.container_name, MANIFEST_PREFIX + name))
+
+    def __get_chunk(self, digest, compression, targets):
+        data = CODECS[compression][1](
+            self.azure_blob.download_blob_bytes(self.container_name, ArtifactStore.get_chunk_name(digest, compression)))
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise Exception('Chunk {} is corrupted.'.format(digest))
+        for path, offset in targets:
+            with open(path, 'r+b') as f:
+                f.seek(offset)
+                f.write(data)
+
+    # Download the files of a manifest to dest_dir, each distinct chunk once
+    def get_dir(self, manifest, dest_dir):
+        targets = {}
+        for file in manifest['files']:
+            path = os.path.join(dest_dir, *file['path'].split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.truncate(file['size'])
+            for idx, digest in enumerate(file['chunks']):
+                targets.setdefault(digest, []).append((path, idx * manifest['chunk_size']))
+
+        with ThreadPoolExecutor(max_workers=self.azure_blob.max_concurrency) as executor:
+            futures = [executor.submit(self.__get_chunk, digest, manifest['compression'], chunk_targets)
+                       for digest, chunk_targets in targets.items()]
+            for future in futures:
+                future.result()
+
+    def delete_manifest(self, name):
+        if self.azure_blob.exists_blob(self.container_name, MANIFEST_PREFIX + name):
+            self.azure_blob.delete_blob(self.container_name, MANIFEST_PREFIX + name)
+
+    # Upload the files of src_dir as a single zip named by the hash of the files, for a reader of one zip,
+    # e.g. MAGA. The zip of the same files is touched instead of uploaded again. Data zips are used
+    # by the request uploading them only, collect removes them once not touched for its grace seconds
+    # Parameters:
+    #   prefix: the prefix of the zip name
+    #   src_dir: the directory to upload
+    # Return:
+    #   the name of the blob
+    def put_data_zip(self, prefix, src_dir):
+        blob_name = DATA_PREFIX + prefix + hash_dir(src_dir)
+        if self.azure_blob.touch_blob(self.container_name, blob_name):
+            log.info("Data %s is already uploaded." % blob_name)
+            return blob_name
+
+        # streamed to the blob as it is zipped, compressed as the chunks
+        level = max(1, self.level) if self.compression == 'bzip2' else self.level
+        with ZipStream(src_dir, COMPRESSIONS[self.compression], level) as data:
+            self.azure_blob.upload_blob(self.container_name, blob_name, data)
+        return blob_name
+
+    # Delete a blob unless it was modified after last_modified, e.g. a chunk touched by a put_dir
+    # which started after the manifests were read
+    # Return: True if the blob is deleted
+    def __delete_unmodified(self, blob_name, last_modified):
+        try:
+            self.azure_blob.delete_blob(self.container_name, blob_name, if_unmodified_since=last_modified)
+            return True
+        except ResourceModifiedError:
+            log.info("Blob %s is used again, it is kept." % blob_name)
+        except ResourceNotFoundError:
+            pass
+        return False
+
+    # Remove the chunks no manifest refers to and the data zips, except those modified in the last grace
+    # seconds. A blob modified after it is listed is kept
+    # Return: the number of removed blobs
+    def collect(self, grace=DEFAULT_GC_GRACE):
+        referenced = set()
+        for manifest_name in self.azure_blob.list_blob(self.container_name, MANIFEST_PREFIX):
+            manifest = json.loads(self.azure_blob.download_blob_bytes(self.container_name, manifest_name))
+            for file in manifest['files']:
+                referenced.update(ArtifactStore.get_chunk_name(digest, manifest['compression'])
+                                  for digest in file['chunks'])
+
+        removed = 0
+        now = datetime.now(timezone.utc)
+        for prefix in [CHUNK_PREFIX, DATA_PREFIX]:
+            for blob_name, last_modified in self.azure_blob.list_blob_times(self.container_name, prefix):
+                if blob_name in referenced or (now - last_modified).total_seconds() < grace:
+                    continue
+                if self.__delete_unmodified(blob_name, last_modified):
+                    removed += 1
+        log.info("Artifact collection removed %d blobs, %d chunks referenced" % (removed, len(referenced)))
+        return removed
+
+
+# Get the artifact store of the service
+# Parameters:
+#   config: a dict object which should include TSANA_APP_NAME, AZ_BLOB_CONNECTION, and optionally
+#           artifact_store (chunk_size), model_package (compression, level)
+def get_artifact_store(config):
+    store_config = getattr(config, 'artifact_store', None) or {}
+    package_config = getattr(config, 'model_package', None) or {}
+    return ArtifactStore(get_azure_blob(config), config.tsana_app_name,
+                         chunk_size=store_config.get('chunk_size', DEFAULT_CHUNK_SIZE),
+                         compression=package_config.get('compression', 'deflated'),
+                         level=package_config.get('level', DEFAULT_LEVEL))
+
+
+# Remove the unreferenced chunks of the artifact store, run periodically by the service
+def collect_artifacts(config):
+    store_config = getattr(config, 'artifact_store', None) or {}
+    try:
+        get_artifact_store(config).collect(store_config.get('gc_grace', DEFAULT_GC_GRACE))
+    except Exception as e:
+        log.error("Artifact collection failed, %s" % str(e))
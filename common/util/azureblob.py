@@ -1,16 +1,73 @@
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
-from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
 from azure.storage.blob import generate_container_sas, generate_blob_sas, BlobSasPermissions 
 
 from datetime import datetime
 from datetime import timedelta
+import os
+import threading
+import time
 
 from telemetry import log
 
+# Parallel connections of a transfer
+DEFAULT_MAX_CONCURRENCY = 4
+# Bytes of a block uploaded, or a range downloaded, by one request
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class TransferStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {direction: dict(transfers=0, failures=0, bytes=0, seconds=0.0)
+                       for direction in ['upload', 'download']}
+
+    def record(self, direction, size, seconds, failed=False):
+        with self.lock:
+            counts = self.counts[direction]
+            counts['transfers'] += 1
+            counts['failures'] += 1 if failed else 0
+            counts['bytes'] += size
+            counts['seconds'] += seconds
+
+    def stats(self):
+        with self.lock:
+            return {direction: dict(counts,
+                                    throughput=counts['bytes'] / counts['seconds'] if counts['seconds'] > 0 else 0.0)
+                    for direction, counts in self.counts.items()}
+
+
+transfer_stats = TransferStats()
+
+
+# Return: bytes left in data, None if it is a stream of unknown length, e.g. a pipe
+def get_size(data):
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    try:
+        return os.fstat(data.fileno()).st_size - data.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def log_transfer(direction, blob_name, size, seconds):
+    log.info("Blob %s %sed, %d bytes in %.2fs, %.1f MB/s" % (blob_name, direction, size, seconds,
+                                                            size / seconds / 1024 / 1024 if seconds > 0 else 0.0))
+
+
 class AzureBlob():
-    def __init__(self, connect_str):        
+    def __init__(self, connect_str, session=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, block_size=DEFAULT_BLOCK_SIZE):
         # Create the BlobServiceClient object which will be used to create a container client
-        self.blob_service_client = BlobServiceClient.from_connection_string(connect_str)    
+        # session: an optional requests.Session, to share its connection pool
+        # max_concurrency: parallel connections of a transfer
+        # block_size: bytes of a block or range, blobs larger than it are transferred in parallel blocks
+        self.max_concurrency = max_concurrency
+        options = dict(max_block_size=block_size, max_single_put_size=block_size,
+                       max_chunk_get_size=block_size, max_single_get_size=block_size)
+        if session is not None:
+            options['transport'] = RequestsTransport(session=session, session_owner=False)
+        self.blob_service_client = BlobServiceClient.from_connection_string(connect_str, **options)
 
     def create_container(self, container_name):
         # Create the container
@@ -19,27 +76,37 @@ class AzureBlob():
         except ResourceExistsError:
             log.info("Container %s already exists!" % container_name)
 
+    # Upload data, a stream or bytes, in parallel blocks read from the stream as they are sent
+    # Parameters:
+    #   replace: overwrite the blob if it exists, otherwise an existing blob is kept
     def upload_blob(self, container_name, blob_name, data, replace = True):
         blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
 
         log.info("\nUploading to Azure Storage as blob:\n\t" + blob_name)
 
-        if blob_name in self.list_blob(container_name):
+        start = time.time()
+        size = get_size(data)
+        try:
+            blob_client.upload_blob(data, overwrite=replace, max_concurrency=self.max_concurrency)
+        except ResourceExistsError:
             log.info("Blob %s in container %s already exists!" % (blob_name, container_name))
-            if replace:
-                self.delete_blob(container_name, blob_name)
-            else:
-                return
-
-        # Upload the created file
-        blob_client.upload_blob(data)
+            return
+        except Exception:
+            transfer_stats.record('upload', 0, time.time() - start, failed=True)
+            raise
+
+        if size is None:
+            size = blob_client.get_blob_properties().size
+        elapsed = time.time() - start
+        transfer_stats.record('upload', size, elapsed)
+        log_transfer('upload', blob_name, size, elapsed)
         log.info("Blob %s in container %s has been uploaded/updated!" % (blob_name, container_name))
             
-    def list_blob(self, container_name):
+    def list_blob(self, container_name, prefix=None):
         log.info("\nListing blobs...")
 
-        # List the blobs in the container
-        blob_list = self.blob_service_client.get_container_client(container_name).list_blobs()
+        # List the blobs in the container, optionally only those named with prefix
+        blob_list = self.blob_service_client.get_container_client(container_name).list_blobs(name_starts_with=prefix)
         blobs = []
         for blob in blob_list:
             log.info("\t" + blob.name)
@@ -47,19 +114,73 @@ class AzureBlob():
 
         return blobs   
 
-    def delete_blob(self, container_name, blob_name):
+    # Return: (name, last modified datetime) of the blobs named with prefix
+    def list_blob_times(self, container_name, prefix):
+        blob_list = self.blob_service_client.get_container_client(container_name).list_blobs(name_starts_with=prefix)
+        return [(blob.name, blob.last_modified) for blob in blob_list]
+
+    def exists_blob(self, container_name, blob_name):
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        try:
+            blob_client.get_blob_properties()
+            return True
+        except ResourceNotFoundError:
+            return False
+
+    # Mark the blob as just used by updating its last modified time, see ArtifactStore.collect
+    # Return: False if the blob does not exist
+    def touch_blob(self, container_name, blob_name):
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        try:
+            blob_client.set_blob_metadata({})
+            return True
+        except ResourceNotFoundError:
+            return False
+
+    # Return: the content of the blob, downloaded in parallel ranges
+    def download_blob_bytes(self, container_name, blob_name):
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+        start = time.time()
+        try:
+            data = blob_client.download_blob(max_concurrency=self.max_concurrency).readall()
+        except Exception:
+            transfer_stats.record('download', 0, time.time() - start, failed=True)
+            raise
+
+        transfer_stats.record('download', len(data), time.time() - start)
+        return data
+
+    # Parameters:
+    #   if_unmodified_since: optional, a datetime, the blob is only deleted if it is not modified since,
+    #                        otherwise ResourceModifiedError is raised
+    def delete_blob(self, container_name, blob_name, if_unmodified_since=None):
         log.info("\nDelete blob...")
 
         blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        blob_client.delete_blob()
+        if if_unmodified_since is not None:
+            blob_client.delete_blob(if_unmodified_since=if_unmodified_since)
+        else:
+            blob_client.delete_blob()
 
+    # Download the blob to a file in parallel ranges, written to the file as they arrive
     def download_blob(self, container_name, blob_name, download_file_path):
         log.info("\nDownloading blob to \n\t" + download_file_path)
 
         blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
 
-        with open(download_file_path, "wb") as download_file:
-            download_file.write(blob_client.download_blob().readall())
+        start = time.time()
+        try:
+            with open(download_file_path, "wb") as download_file:
+                blob_client.download_blob(max_concurrency=self.max_concurrency).readinto(download_file)
+        except Exception:
+            transfer_stats.record('download', 0, time.time() - start, failed=True)
+            raise
+
+        size = os.path.getsize(download_file_path)
+        elapsed = time.time() - start
+        transfer_stats.record('download', size, elapsed)
+        log_transfer('download', blob_name, size, elapsed)
 
     def delete_container(self, container_name):
         log.info("Deleting blob container...")
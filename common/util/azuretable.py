@@ -2,8 +2,9 @@ from azure.cosmosdb.table.tableservice import TableService
 from azure.cosmosdb.table.models import Entity
 
 class AzureTable():
-    def __init__(self, account_name, account_key):
-        self.table_service = TableService(account_name=account_name, account_key=account_key)
+    def __init__(self, account_name, account_key, session=None):
+        # session: an optional requests.Session, to share its connection pool
+        self.table_service = TableService(account_name=account_name, account_key=account_key, request_session=session)
 
     def create_table(self, table_name):
         return self.table_service.create_table(table_name)
@@ -29,8 +30,9 @@ class AzureTable():
     def insert_entity(self, table_name, entity):
         return self.table_service.insert_entity(table_name, entity)
 
-    def update_entity(self, table_name, entity):
-        return self.table_service.update_entity(table_name, entity)
+    # Replace an existing entity, if_match is the etag the entity must still have, '*' for any
+    def update_entity(self, table_name, entity, if_match='*'):
+        return self.table_service.update_entity(table_name, entity, if_match=if_match)
 
     def get_entity(self, table_name, partition_key, row_key):
         return self.table_service.get_entity(table_name, partition_key, row_key)
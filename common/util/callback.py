@@ -0,0 +1,42 @@
+import tensorflow as tf
+import logging
+import time
+
+from .metric import Metric, MetricSender
+
+logger = logging.getLogger(__name__)
+
+
+# Keras callbacks of the training, apart from metric.py so that reporting metrics does not load TensorFlow
+class MetricCollector(tf.keras.callbacks.Callback):
+    def __init__(self, epochs, metric_sender: MetricSender):
+        super().__init__()
+        self.__epochs = epochs
+        self.__sender = metric_sender
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.__sender is None:
+            return
+        metric = Metric(epochs=self.__epochs, epoch_th=epoch, loss=logs['loss'],
+                        valid_loss=logs['val_loss'] if 'val_loss' in logs else None)
+        self.__sender.send(metric)
+
+
+# Logs the fit throughput of every epoch, training samples per second over the whole epoch, its steps
+# and validation, so it does not tell the input pipeline apart from the model
+class FitThroughputCollector(tf.keras.callbacks.Callback):
+    def __init__(self, samples_per_epoch):
+        super().__init__()
+        self.__samples_per_epoch = samples_per_epoch
+        self.__epoch_start = None
+        self.throughputs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.__epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.time() - self.__epoch_start
+        throughput = self.__samples_per_epoch / elapsed if elapsed > 0 else 0.0
+        self.throughputs.append(throughput)
+        logger.info("Epoch {0}: {1} samples in {2:.2f}s, {3:.1f} samples/s".format(epoch, self.__samples_per_epoch,
+                                                                                 elapsed, throughput))
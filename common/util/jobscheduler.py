@@ -0,0 +1,332 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import log
+
+LANE_TRAIN = 'train'
+LANE_INFERENCE = 'inference'
+
+# thread: jobs run on the lane's threads inside the API process
+# process: jobs are pickled to reused worker processes, one per worker of the lane
+MODE_THREAD = 'thread'
+MODE_PROCESS = 'process'
+
+DEFAULT_LANES = {
+    LANE_TRAIN: dict(workers=1, queue_size=8, mode=MODE_THREAD, threads=1),
+    LANE_INFERENCE: dict(workers=4, queue_size=64, mode=MODE_THREAD, threads=1)
+}
+
+# Seconds an idle worker waits for a job before it checks whether the scheduler is stopped
+STOP_POLL_SECONDS = 1.0
+
+# API processes of the pod when served by gunicorn and GUNICORN_WORKER_NUM is not set, see gunicorn_config.py
+DEFAULT_SERVER_WORKERS = 3
+
+THREAD_ENV_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                        'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+
+
+# Cores this process may run on, the affinity mask if the platform has one
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Number of API processes sharing the cores of the pod, the gunicorn workers
+def get_server_workers():
+    if 'gunicorn' not in sys.modules:
+        return 1
+    return max(1, int(os.environ.get('GUNICORN_WORKER_NUM', DEFAULT_SERVER_WORKERS)))
+
+
+# Cores of the jobs of this API process, an equal share of the pod between the API processes
+# Parameters:
+#   pod_cores: cores of the pod, None for the cores available to the process
+def get_process_cores(pod_cores=None):
+    total = pod_cores if pod_cores is not None else available_cores()
+    return max(1, int(total) // get_server_workers())
+
+
+# Native threads of the current job worker process, None outside one
+def worker_threads():
+    return _worker_threads
+
+
+# True inside a worker process started by a process lane
+def in_worker_process():
+    return multiprocessing.current_process().name != 'MainProcess'
+
+
+# Limit the native thread pools (BLAS, OpenMP, TensorFlow) of the current process
+# TensorFlow reads its variables when it is imported, it is only configured here if already imported,
+# so processes which never train a TensorFlow model never load it
+# Parameters:
+#   threads: number of threads to use
+def set_thread_budget(threads):
+    for name in THREAD_ENV_VARIABLES:
+        os.environ[name] = str(threads)
+    tf = sys.modules.get('tensorflow')
+    if tf is None:
+        return
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+    except RuntimeError as e:
+        # TensorFlow is already initialized in this process
+        log.info("Cannot set TensorFlow threads to %d, %s." % (threads, str(e)))
+
+
+class QueueFullException(Exception):
+    pass
+
+
+# Cores shared by the jobs of all lanes, a job starts only when its cores are free. A core is kept free
+# for each lane with no job running, so a lane holding cores (e.g. a long train job) never blocks the
+# first job of another lane. With fewer cores than lanes, each lane still gets one core
+# Parameters:
+#   total: cores of the jobs
+#   lanes: names of the lanes
+class CoreBudget():
+    def __init__(self, total, lanes):
+        self.total = max(1, int(total))
+        self.in_use = {name: 0 for name in lanes}
+        self.capacity = max(self.total, len(self.in_use))
+        # the most cores a job may take, one core is left for each other lane
+        self.limit = max(1, self.capacity - (len(self.in_use) - 1))
+        self.condition = threading.Condition()
+
+    def __can_take(self, lane_name, cores):
+        idle_lanes = sum(1 for name, used in self.in_use.items() if name != lane_name and used == 0)
+        return sum(self.in_use.values()) + cores + idle_lanes <= self.capacity
+
+    # Block until cores are free, a job asking for more than the limit gets the limit
+    # Return: the number of cores taken
+    def acquire(self, lane_name, cores):
+        cores = min(max(1, int(cores)), self.limit)
+        with self.condition:
+            while not self.__can_take(lane_name, cores):
+                self.condition.wait()
+            self.in_use[lane_name] += cores
+        return cores
+
+    def release(self, lane_name, cores):
+        with self.condition:
+            self.in_use[lane_name] -= cores
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return dict(total=self.total, limit=self.limit, in_use=sum(self.in_use.values()),
+                        lanes=dict(self.in_use))
+
+
+class Job():
+    def __init__(self, fn, args, on_error, cores):
+        self.fn = fn
+        self.args = args
+        self.on_error = on_error
+        self.cores = cores
+        self.enqueue_time = time.time()
+
+
+class JobLane():
+    def __init__(self, name, workers, queue_size, mode=MODE_THREAD, threads=1):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.mode = mode
+        self.threads_per_worker = max(1, int(threads))
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        # process lanes: an executor of one process per worker, so a dying process only fails its own job
+        self.pools = []
+
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.crashed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self):
+        with self.lock:
+            started = self.completed + self.failed + self.running
+            return dict(mode=self.mode,
+                        workers=self.workers,
+                        queue_size=self.queue_size,
+                        queue_depth=self.queue.qsize(),
+                        running=self.running,
+                        submitted=self.submitted,
+                        completed=self.completed,
+                        failed=self.failed,
+                        rejected=self.rejected,
+                        crashed=self.crashed,
+                        avg_wait=self.total_wait / started if started > 0 else 0.0,
+                        max_wait=self.max_wait)
+
+
+# A bounded job scheduler with an independent queue and worker pool per lane,
+# so a burst of jobs in one lane (e.g. train) cannot starve another (e.g. inference).
+# Besides the workers of its lane, a job waits for its cores in a budget shared by all lanes,
+# so concurrent jobs never ask for more threads than the machine has, see CoreBudget.
+# Parameters:
+#   lanes: a dict of lane name -> dict(workers=..., queue_size=..., mode=..., threads=...)
+#   initializer: for process lanes, called as initializer(*initargs) once in every worker process
+#   cores: total cores of the jobs of this process, None for its share of the pod, see get_process_cores
+class JobScheduler():
+    def __init__(self, lanes=None, initializer=None, initargs=(), cores=None):
+        self.lanes = {}
+        lanes = lanes or DEFAULT_LANES
+        self.cores = CoreBudget(cores if cores is not None else get_process_cores(), lanes.keys())
+        self.stopped = threading.Event()
+        self.initializer = initializer
+        self.initargs = initargs
+        for name, lane_config in lanes.items():
+            lane = JobLane(name, lane_config['workers'], lane_config['queue_size'],
+                           lane_config.get('mode', MODE_THREAD), lane_config.get('threads', 1))
+            self.lanes[name] = lane
+            for idx in range(lane.workers):
+                if lane.mode == MODE_PROCESS:
+                    lane.pools.append(self._create_pool(lane))
+                thread = threading.Thread(target=self._work, args=(lane, idx), name='%s-worker-%d' % (name, idx))
+                thread.daemon = True
+                thread.start()
+                lane.threads.append(thread)
+
+    def _create_pool(self, lane):
+        # spawn instead of fork, the API process may hold gevent hubs, locks or an initialized TensorFlow
+        return ProcessPoolExecutor(max_workers=1,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(min(lane.threads_per_worker, self.cores.limit),
+                                             self.initializer, self.initargs))
+
+    def get_mode(self, lane_name):
+        return self.lanes[lane_name].mode
+
+    # Queue a job on a lane without blocking the caller
+    # Parameters:
+    #   lane_name: name of the lane, LANE_TRAIN / LANE_INFERENCE
+    #   fn: the callable to run, fn(*args). For process lanes, fn and args must be picklable
+    #   on_error: optional, called as on_error(exception) if the job raises or its worker process dies
+    #   cores: optional, cores the job uses, the threads of the lane by default
+    # Return:
+    #   None, raise QueueFullException if the lane is full or the scheduler is stopped
+    def submit(self, lane_name, fn, *args, on_error=None, cores=None):
+        lane = self.lanes[lane_name]
+        if self.stopped.is_set():
+            raise QueueFullException('Scheduler is shutting down.')
+
+        try:
+            lane.queue.put_nowait(Job(fn, args, on_error, cores if cores is not None else lane.threads_per_worker))
+        except queue.Full:
+            with lane.lock:
+                lane.rejected += 1
+            raise QueueFullException('Too many %s jobs in queue, limit is %d.' % (lane_name, lane.queue_size))
+
+        with lane.lock:
+            lane.submitted += 1
+
+    def _work(self, lane, slot):
+        while not self.stopped.is_set():
+            try:
+                job = lane.queue.get(timeout=STOP_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if job is None or self.stopped.is_set():
+                # stopped while the job was queued, it is dropped
+                if job is not None:
+                    log.info("Scheduler is stopped, a queued job in lane %s is dropped." % lane.name)
+                lane.queue.task_done()
+                return
+
+            cores = self.cores.acquire(lane.name, job.cores)
+            wait = time.time() - job.enqueue_time
+            with lane.lock:
+                lane.running += 1
+                lane.total_wait += wait
+                lane.max_wait = max(lane.max_wait, wait)
+
+            failed = False
+            try:
+                if lane.mode == MODE_PROCESS:
+                    self._run_in_pool(lane, slot, job)
+                else:
+                    job.fn(*job.args)
+            except Exception as e:
+                failed = True
+                log.error("Job in lane %s failed, exception: %s." % (lane.name, str(e)))
+                if job.on_error is not None:
+                    try:
+                        job.on_error(e)
+                    except Exception as callback_error:
+                        log.error("Error callback in lane %s failed, exception: %s." % (lane.name, str(callback_error)))
+            finally:
+                self.cores.release(lane.name, cores)
+                with lane.lock:
+                    lane.running -= 1
+                    if failed:
+                        lane.failed += 1
+                    else:
+                        lane.completed += 1
+                lane.queue.task_done()
+
+    # Run the job in the worker process of the slot, only this worker thread submits to it
+    def _run_in_pool(self, lane, slot, job):
+        try:
+            return lane.pools[slot].submit(job.fn, *job.args).result()
+        except BrokenProcessPool as e:
+            # The worker process died (crash / OOM kill) while running this job, jobs of the other
+            # slots run in their own processes. Replace it so later jobs of the slot can still run
+            with lane.lock:
+                lane.crashed += 1
+            log.error("Worker process %d in lane %s died, restarting it." % (slot, lane.name))
+            lane.pools[slot].shutdown(wait=False)
+            lane.pools[slot] = self._create_pool(lane)
+            raise Exception('Worker process of the job died.') from e
+
+    def stats(self):
+        stats = {name: lane.stats() for name, lane in self.lanes.items()}
+        stats['cores'] = self.cores.stats()
+        return stats
+
+    # Stop accepting jobs and wait for the running jobs, jobs still queued are dropped
+    # Parameters:
+    #   timeout: max seconds to wait for the workers, None to wait until the running jobs finish
+    def shutdown(self, timeout=None):
+        self.stopped.set()
+        for lane in self.lanes.values():
+            for _ in lane.threads:
+                # wakes an idle worker, a full lane has no idle worker to wake
+                try:
+                    lane.queue.put_nowait(None)
+                except queue.Full:
+                    pass
+        deadline = time.time() + timeout if timeout is not None else None
+        for lane in self.lanes.values():
+            for thread in lane.threads:
+                thread.join(max(0, deadline - time.time()) if deadline is not None else None)
+            for pool in lane.pools:
+                pool.shutdown(wait=False)
+
+
+_worker_threads = None
+
+
+# Set up a process lane worker, native thread pools are limited here only, never in the API process
+def _init_worker(threads, initializer, initargs):
+    global _worker_threads
+    _worker_threads = threads
+    set_thread_budget(threads)
+    if initializer is not None:
+        initializer(*initargs)
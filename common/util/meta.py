@@ -1,29 +1,45 @@
+import copy
 import time
 
-from .azureblob import AzureBlob
-from .azuretable import AzureTable
+from azure.common import AzureHttpError
+
+from .storage import get_azure_table
 from .constant import STATUS_SUCCESS, STATUS_FAIL
 from .constant import ModelState
+from .ttlcache import TTLCache, NOT_FOUND
 
 from telemetry import log
 
 from .monitor import thumbprint
 
+# Seconds a cached meta entity is trusted before it is read again, other processes
+# may update the same entity, our own writes refresh the cache immediately
+META_CACHE_TTL = 5
+UPDATE_RETRY_COUNT = 3
+
+# Read-through cache of model entities keyed by (subscription, model_key)
+meta_cache = TTLCache(META_CACHE_TTL)
+
+def cache_meta(config, subscription, model_key, entity):
+    meta_cache.put((subscription, model_key), entity, getattr(config, 'meta_cache_ttl', META_CACHE_TTL))
+
 def insert_meta(config, subscription, model_key, meta):
-    azure_table = AzureTable(config.az_storage_account, config.az_storage_account_key)
-    if not azure_table.exists_table(config.az_tsana_meta_table):
-        azure_table.create_table(config.az_tsana_meta_table)
-    azure_table.insert_or_replace_entity(config.az_tsana_meta_table, subscription, 
-            model_key, 
-            group_id=meta['groupId'], 
-            app_id=meta['instance']['appId'], 
-            app_name=meta['instance']['appName'], 
-            series_set=str(meta['seriesSets']), 
-            inst_name=meta['instance']['instanceName'], 
-            inst_id=meta['instance']['instanceId'], 
-            para=str(meta['instance']['params']),
-            state=ModelState.Training.name,
-            timekey=time.time())
+    azure_table = get_azure_table(config)
+    entity = {
+        'PartitionKey': subscription,
+        'RowKey': model_key,
+        'group_id': meta['groupId'],
+        'app_id': meta['instance']['appId'],
+        'app_name': meta['instance']['appName'],
+        'series_set': str(meta['seriesSets']),
+        'inst_name': meta['instance']['instanceName'],
+        'inst_id': meta['instance']['instanceId'],
+        'para': str(meta['instance']['params']),
+        'state': ModelState.Training.name,
+        'timekey': time.time()
+    }
+    entity['etag'] = azure_table.insert_or_replace_entity2(config.az_tsana_meta_table, entity)
+    cache_meta(config, subscription, model_key, entity)
 
 # Get a model entity from meta
 # Parameters: 
@@ -31,15 +47,17 @@ def insert_meta(config, subscription, model_key, meta):
 #   subscription: a subscription is a name to differenciate a user, could be used for Authorization
 #   model_key: The UUID for the model created
 # Return: 
-#   meta: a Dict object which includes all the column of an model entity
+#   meta: a Dict object which includes all the column of an model entity, a copy which callers may modify
 def get_meta(config, subscription, model_key):
     try: 
-        azure_table = AzureTable(config.az_storage_account, config.az_storage_account_key)
-        if not azure_table.exists_table(config.az_tsana_meta_table):
-            raise Exception('Meta table not exists')
+        entity = meta_cache.get((subscription, model_key))
+        if entity is not NOT_FOUND:
+            return copy.copy(entity)
 
+        azure_table = get_azure_table(config)
         entity = azure_table.get_entity(config.az_tsana_meta_table, subscription, model_key)
-        return entity
+        cache_meta(config, subscription, model_key, entity)
+        return copy.copy(entity)
     except Exception as e: 
         log.error("Get entity error from %s with model_key %s and subscription %s, exception: %s." % (config.az_tsana_meta_table, model_key, subscription, str(e)))
         return None  
@@ -50,37 +68,56 @@ def get_meta(config, subscription, model_key):
 #   subscription: a subscription is a name to differenciate a user, could be used for Authorization
 #   model_key: The UUID for the model created
 #   state: model state
+#   model_timekey: optional, the timekey of the stored model files. timekey changes on every update,
+#                  model_timekey only when a newly trained model is stored
 # Return:
-#   result: STATUS_SUCCESS / STATUS_FAIL
+#   result: STATUS_SUCCESS / STATUS_FAIL, STATUS_FAIL if the entity keeps changing concurrently
+#           for UPDATE_RETRY_COUNT reads, nothing is written then
 #   message: description for the result 
-def update_state(config, subscription, model_key, state:ModelState=None, context:str=None, last_error:str=None): 
-    azure_table = AzureTable(config.az_storage_account, config.az_storage_account_key)
-    meta = get_meta(config, subscription, model_key)
-    if meta == None or meta['state'] == ModelState.Deleted.name:
-        return STATUS_FAIL, 'Model is not found!'
+def update_state(config, subscription, model_key, state:ModelState=None, context:str=None, last_error:str=None, model_timekey=None): 
+    azure_table = get_azure_table(config)
+    for retry in range(UPDATE_RETRY_COUNT - 1, -1, -1):
+        meta = get_meta(config, subscription, model_key)
+        if meta == None or meta['state'] == ModelState.Deleted.name:
+            return STATUS_FAIL, 'Model is not found!'
 
-    if state is not None:
-        meta['state'] = state.name
+        if state is not None:
+            meta['state'] = state.name
 
-    if context is not None:
-        meta['context'] = context
+        if context is not None:
+            meta['context'] = context
 
-    if last_error is not None:
-        meta['last_error'] = last_error
+        if last_error is not None:
+            meta['last_error'] = last_error
 
-    meta['timekey'] = time.time()
-    etag = azure_table.insert_or_replace_entity2(config.az_tsana_meta_table, meta)
+        if model_timekey is not None:
+            meta['model_timekey'] = str(model_timekey)
 
+        meta['timekey'] = time.time()
+        try:
+            # Only replace the version we have read, so a concurrent change is never overwritten
+            etag = azure_table.update_entity(config.az_tsana_meta_table, meta, if_match=meta.get('etag', '*'))
+            break
+        except AzureHttpError as e:
+            # 412: changed by someone else since we read it, read it again and retry, 404: not there any more
+            meta_cache.invalidate((subscription, model_key))
+            if e.status_code == 404:
+                return STATUS_FAIL, 'Model is not found!'
+            if e.status_code != 412:
+                raise e
+            if retry == 0:
+                log.error("Update %s in table %s conflicts with concurrent changes %d times, it is not updated." % (model_key, config.az_tsana_meta_table, UPDATE_RETRY_COUNT))
+                return STATUS_FAIL, 'Model is changed concurrently!'
+
+    meta['etag'] = etag
+    cache_meta(config, subscription, model_key, meta)
     log.info("Insert or replace %s to table %s, result: %s." % (model_key, config.az_tsana_meta_table, etag))
 
     return STATUS_SUCCESS, ''
 
 def get_model_list(config, subscription):
     models = []
-    azure_table = AzureTable(config.az_storage_account, config.az_storage_account_key)
-    if not azure_table.exists_table(config.az_tsana_meta_table):
-        return models
-        
+    azure_table = get_azure_table(config)
     entities = azure_table.get_entities(config.az_tsana_meta_table, subscription)
     
     for entity in entities.items:
@@ -100,10 +137,8 @@ def get_model_list(config, subscription):
 #   entity: a entity with a correct state
 def clear_state_when_necessary(config, subscription, model_key, entity):
     if entity['state'] == ModelState.Training.name:
-        azure_table = AzureTable(config.az_storage_account, config.az_storage_account_key)
-        if not azure_table.exists_table(config.az_tsana_moniter_table):
-            return entity
-        
+        azure_table = get_azure_table(config)
+
         # Find the training owner in the monitor table and make sure it is alive
         try: 
             monitor_entity = azure_table.get_entity(config.az_tsana_moniter_table, config.tsana_app_name, thumbprint)
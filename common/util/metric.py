@@ -1,4 +1,3 @@
-import tensorflow as tf
 import json
 import logging
 
@@ -42,14 +41,3 @@ class MetricSender:
         update_state(self.__config, self.__subscription, self.__model_key, None, None, txt)
         info = {'epochs': metric.epochs, 'epoch': metric.epoch, 'loss': metric.loss, 'val_loss': metric.valid_loss}
         # logger.info("Current metric : {0}".format(json.dumps(info)))
-
-class MetricCollector(tf.keras.callbacks.Callback):
-    def __init__(self, epochs, metric_sender: MetricSender):
-        super().__init__()
-        self.__epochs = epochs
-        self.__sender = metric_sender
-
-    def on_epoch_end(self, epoch, logs=None):
-        metric = Metric(epochs=self.__epochs, epoch_th=epoch, loss=logs['loss'],
-                        valid_loss=logs['val_loss'] if 'val_loss' in logs else None)
-        self.__sender.send(metric)
@@ -11,132 +11,124 @@ import shutil
 import zipfile
 import json
 
-from .azureblob import AzureBlob
-from .azuretable import AzureTable
+from azure.core.exceptions import ResourceNotFoundError
+
+from .modelcache import get_model_cache
+from .storage import get_azure_blob
+from .artifactstore import get_artifact_store
 from .timeutil import get_time_offset, str_to_dt, dt_to_str
 from .constant import TIMESTAMP, VALUE
 from .constant import STATUS_SUCCESS, STATUS_FAIL
 
 logger = logging.getLogger(__name__)
-# Copy the model file to local prd directory, zip and upload to AzureBlob
-# The training output and prd directory is calculated by config with subscription/model_key
+# Upload the training output to the artifact store, then move it to the local model cache
+# The training output directory is calculated by config with subscription/model_key/timekey
 # Parameters:
-#   config: a dict object which should include MODEL_TMP_DIR, TSANA_APP_NAME, AZ_BLOB_CONNECTION
+#   config: a dict object which should include MODEL_TMP_DIR, TSANA_APP_NAME, AZ_BLOB_CONNECTION,
+#           and optionally artifact_store (chunk_size), model_package (compression, level)
 #   subscription: the name of the user
 #   model_key: UUID for the model
+#   timekey: the timekey of the training
 # Return:
 #   result: STATE_SUCCESS / STATE_FAIL
 #   message: description of the result
 def copy_tree_and_zip_and_update_remote(config, subscription, model_key, timekey):
     try:
         src = os.path.join(config.model_temp_dir, subscription + '_' + model_key + '_' + str(timekey))
-        dest = model_dir = os.path.join(config.model_temp_dir, subscription + '_' + model_key)
-        os.makedirs(dest, exist_ok=True)
-        
-        zip_file = os.path.join(dest, "model.zip")
-        with zipfile.ZipFile(zip_file, "w") as zf:
-            src_files = os.listdir(src)
-            tkfile = os.path.join(dest, "timekey.txt")
-            with open(tkfile, 'w') as timekey_file:
-                timekey_file.write(str(timekey))
-
-            file_exist = False
-            for file_name in src_files:
-                full_file_name = os.path.join(src, file_name)
-                if os.path.isfile(full_file_name):
-                    shutil.copy(full_file_name, dest)
-                    full_dest_name = os.path.join(dest, file_name)
-                    zf.write(full_dest_name, basename(full_dest_name))
-                else: 
-                    dest_full = os.path.join(dest, file_name)
-                    shutil.rmtree(dest_full, ignore_errors = True)
-                    shutil.copytree(full_file_name, dest_full)
-                    for root, dirs, files in os.walk(dest_full):
-                        #NOTE: ignore empty directories
-                        for fn in files:
-                            absfn = os.path.join(root, fn)
-                            print(absfn)
-                            zfn = absfn[len(dest)+len(os.sep):]
-                            zf.write(absfn, zfn)
-                    # zf.write(full_file_name, basename(full_file_name))
-
-            file_exist = True
-            zf.write(tkfile, basename(tkfile))
-            zf.close()
-
-        if file_exist is True: 
-            # Write timekey file
-
-            container_name = config.tsana_app_name
-            azure_blob = AzureBlob(config.az_tsana_model_blob_connection)
-            print("------")
-            print(zip_file)
-            print(container_name)
-            print(subscription + '_' + model_key)
-            azure_blob.create_container(container_name)
-
-            with open(zip_file, "rb") as data:
-                azure_blob.upload_blob(container_name, subscription + '_' + model_key, data)
-            return STATUS_SUCCESS, ''
-        else:
-            shutil.rmtree(tkfile, ignore_errors = True)
-            shutil.rmtree(zip_file, ignore_errors = True)
+        if not os.path.isdir(src) or len(os.listdir(src)) == 0:
             return STATUS_FAIL, 'No model file is found! '
+
+        with open(os.path.join(src, "timekey.txt"), 'w') as timekey_file:
+            timekey_file.write(str(timekey))
+
+        # only the chunks not stored by an earlier training, or another model, are uploaded
+        model_name = subscription + '_' + model_key
+        get_artifact_store(config).put_dir(model_name, src, properties=dict(timekey=str(timekey)))
+        delete_legacy_model(config, model_name)
     except Exception as e:
         logger.exception("-----Exception-----")
-        shutil.rmtree(tkfile, ignore_errors = True)
-        shutil.rmtree(zip_file, ignore_errors = True)
-        
         return STATUS_FAIL, str(e)
 
+    # the uploaded files are the cached model of timekey, moved instead of copied
+    def move(model_dir):
+        for file_name in os.listdir(src):
+            os.rename(os.path.join(src, file_name), os.path.join(model_dir, file_name))
+        return str(timekey)
+
+    try:
+        get_model_cache(config).put(subscription, model_key, move)
+    except Exception:
+        logger.exception("Failed to cache model %s, it is downloaded on the first inference." % model_key)
+    return STATUS_SUCCESS, ''
+
 
-# Check if local prd directory contains up-to-date model, otherwise, try to download from blob
+# Get the model files of timekey from the local model cache, downloaded from blob on a miss.
+# A cached model is never downloaded again, unless force is set
 # Parameters:
 #   config: a dict object which should include MODEL_TMP_DIR, TSANA_APP_NAME, AZ_BLOB_CONNECTION
 #   subscription: the name of the user
 #   model_key: UUID for the model
+#   timekey: the timekey of the trained model
+#   force: download the model even if it is cached
 # Return:
 #   result: STATE_SUCCESS / STATE_FAIL
 #   message: description of the result
+#   model_dir: the directory of the model files, None on failure
 
 def prepare_model(config, subscription, model_key, timekey, force = False): 
-    prd_dir = os.path.join(config.model_temp_dir, subscription + '_' + model_key)
-    tkfile = os.path.join(prd_dir, "timekey.txt")
-    tk = ''
+    model_cache = get_model_cache(config)
     try: 
-        try: 
-            with open(tkfile, 'r') as tk_file: 
-                tk = tk_file.read()
-        except:
-            logger.info("No timekey file is found.")
-            pass
-
-        if tk == str(timekey) and force is not True: 
-            # up to data
-            return STATUS_SUCCESS, ''
-        else: 
-            # download from blob
+        if not force:
+            model_dir = model_cache.get(subscription, model_key, timekey)
+            if model_dir is not None:
+                return STATUS_SUCCESS, '', model_dir
+
+        def download(model_dir):
             container_name = config.tsana_app_name
-            azure_blob = AzureBlob(config.az_tsana_model_blob_connection)
-            azure_blob.create_container(container_name)
+            azure_blob = get_azure_blob(config)
             model_name = subscription + '_' + model_key
+            logger.info("Download model %s from Azure." % model_key)
+            artifact_store = get_artifact_store(config)
+            manifest = artifact_store.get_manifest(model_name)
+            if manifest is not None:
+                artifact_store.get_dir(manifest, model_dir)
+                return manifest['properties'].get('timekey', str(timekey))
+
+            # a model zip uploaded before the artifact store
+            zip_file = os.path.join(model_dir, "model.zip")
+            azure_blob.download_blob(container_name, model_name, zip_file)
+            with zipfile.ZipFile(zip_file) as zf:
+                zf.extractall(path = model_dir)
+            os.remove(zip_file)
+            # the blob is the previous training until a new one is uploaded
             try:
-                shutil.rmtree(prd_dir)
-            except: 
-                pass
-            os.makedirs(prd_dir, exist_ok=True)
-            namelist = azure_blob.list_blob(container_name)
-            if model_name in azure_blob.list_blob(container_name):
-                logger.info("Download model %s from Azure." % model_key)
-                zip_file = os.path.join(prd_dir, "model.zip")
-                azure_blob.download_blob(container_name, model_name, zip_file)
-                with zipfile.ZipFile(zip_file) as zf:
-                    zf.extractall(path = prd_dir)
-                    zf.close()
-                return STATUS_SUCCESS, ''
-            else:
-                return STATUS_FAIL, 'There is no valid model'         
+                with open(os.path.join(model_dir, "timekey.txt"), 'r') as tk_file:
+                    return tk_file.read()
+            except OSError:
+                return str(timekey)
+
+        if force:
+            model_cache.invalidate(subscription, model_key)
+        return STATUS_SUCCESS, '', model_cache.put(subscription, model_key, download)
+    except ResourceNotFoundError:
+        return STATUS_FAIL, 'There is no valid model', None
     except Exception as e: 
         logger.exception("-----Exception-----")
-        return STATUS_FAIL, str(e)
+        return STATUS_FAIL, str(e), None
 
+
+# Remove the model zip of a model uploaded before the artifact store
+def delete_legacy_model(config, model_name):
+    azure_blob = get_azure_blob(config)
+    if azure_blob.exists_blob(config.tsana_app_name, model_name):
+        azure_blob.delete_blob(config.tsana_app_name, model_name)
+
+
+# Remove the stored files of a model, its chunks are removed by the next artifact collection
+def delete_model(config, subscription, model_key):
+    model_name = subscription + '_' + model_key
+    try:
+        get_artifact_store(config).delete_manifest(model_name)
+        delete_legacy_model(config, model_name)
+    except Exception:
+        logger.exception("Failed to delete the stored files of model %s." % model_key)
@@ -0,0 +1,171 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from telemetry import log
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+CACHE_DIR = 'model_cache'
+TEMP_PREFIX = '.tmp-'
+# Temporary directories older than this are left by crashed jobs
+STALE_TEMP_SECONDS = 3600
+
+lock = threading.Lock()
+model_caches = {}
+
+
+def get_dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+# A disk cache of downloaded model files, a directory for each (subscription, model_key, timekey).
+# Directories are filled under a temporary name and renamed in place, so a cached directory is always
+# complete, and it is shared by all processes of the service. Directories beyond max_bytes are
+# evicted least recently used first, by the mtime touched on each hit
+# Parameters:
+#   root: the directory of the cache
+#   max_bytes: max bytes of the cached model files
+class ModelCache():
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def get_model_prefix(subscription, model_key):
+        return subscription + '_' + model_key + '_'
+
+    def get_path(self, subscription, model_key, timekey):
+        return os.path.join(self.root, ModelCache.get_model_prefix(subscription, model_key) + str(timekey))
+
+    # Return: the directory of the model, None if it is not cached
+    def get(self, subscription, model_key, timekey):
+        path = self.get_path(subscription, model_key, timekey)
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return path
+
+    # Cache the model, fill writes the model files to the directory it is given
+    # Parameters:
+    #   fill: a function of a directory, returns the timekey of the files it wrote, and raises if the
+    #         model could not be written. The files are cached under that timekey, so files of an older
+    #         training are never cached as a newer one
+    # Return:
+    #   the directory of the model
+    def put(self, subscription, model_key, fill):
+        temp = os.path.join(self.root, TEMP_PREFIX + uuid.uuid4().hex)
+        os.makedirs(temp)
+        try:
+            path = self.get_path(subscription, model_key, fill(temp))
+            try:
+                os.rename(temp, path)
+            except OSError:
+                # filled by another job meanwhile, keep that one
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+        with self.lock:
+            self.fills += 1
+        self.invalidate(subscription, model_key, keep=path)
+        self.evict(keep=path)
+        return path
+
+    # Remove the cached directories of the model
+    # Parameters:
+    #   keep: optional, a directory not to remove
+    def invalidate(self, subscription, model_key, keep=None):
+        prefix = ModelCache.get_model_prefix(subscription, model_key)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(prefix) and path != keep:
+                self.remove(path)
+
+    def remove(self, path):
+        # renamed first, so no job finds a directory which is partially removed
+        trash = os.path.join(self.root, TEMP_PREFIX + uuid.uuid4().hex)
+        try:
+            os.rename(path, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    # Return: (path, mtime, bytes) of the cached directories, least recently used first
+    def list_entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(TEMP_PREFIX):
+                continue
+            try:
+                entries.append((path, os.path.getmtime(path), get_dir_size(path)))
+            except OSError:
+                pass
+        return sorted(entries, key=lambda x: x[1])
+
+    def evict(self, keep=None):
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name.startswith(TEMP_PREFIX) and time.time() - os.path.getmtime(path) > STALE_TEMP_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+        entries = self.list_entries()
+        total = sum(x[2] for x in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self.remove(path)
+            total -= size
+            with self.lock:
+                self.evictions += 1
+            log.info("Evicted model %s from cache, %d bytes cached" % (path, total))
+
+    def stats(self):
+        entries = self.list_entries()
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(entries=len(entries), bytes=sum(x[2] for x in entries), max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses, fills=self.fills, evictions=self.evictions,
+                        hit_rate=self.hits / total if total > 0 else 0.0)
+
+
+# Get the process-wide model cache of the service
+# Parameters:
+#   config: a dict object which should include MODEL_TMP_DIR, and optionally model_cache
+#           (dir, max_bytes)
+def get_model_cache(config):
+    cache_config = getattr(config, 'model_cache', None) or {}
+    root = cache_config.get('dir', None) or os.path.join(config.model_temp_dir, CACHE_DIR)
+    with lock:
+        cache = model_caches.get(root, None)
+        if cache is None:
+            cache = ModelCache(root, cache_config.get('max_bytes', DEFAULT_MAX_BYTES))
+            model_caches[root] = cache
+        return cache
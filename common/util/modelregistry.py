@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+from .modelcache import get_dir_size
+
+from telemetry import log
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Loaded models of this process, one per (subscription, model_key), so a hot model answers an inference
+# without loading its files again. A model is loaded again when its version changes, e.g. the model
+# dir of a new timekey, and the least recently used models are dropped beyond max_bytes
+# Parameters:
+#   max_bytes: max bytes of the loaded models, estimated by the size of their files
+class ModelRegistry():
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    # Get the loaded model, or load it
+    # Parameters:
+    #   version: the version of the model, e.g. its timekey or model dir
+    #   model_dir: the directory of the model files
+    #   load: a function of model_dir, returns the loaded model
+    # Return:
+    #   the loaded model
+    def get(self, subscription, model_key, version, model_dir, load):
+        key = (subscription, model_key)
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # loaded outside the lock, models of other keys are served meanwhile
+        model = load(model_dir)
+        size = get_dir_size(model_dir)
+        with self.lock:
+            self.loads += 1
+            self.__remove(key)
+            self.entries[key] = (version, model, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                evicted, _ = next(iter(self.entries.items()))
+                self.__remove(evicted)
+                self.evictions += 1
+                log.info("Evicted model %s from registry, %d bytes loaded" % (str(evicted), self.bytes))
+        return model
+
+    def __remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def invalidate(self, subscription, model_key):
+        with self.lock:
+            self.__remove((subscription, model_key))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(models=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses, loads=self.loads, evictions=self.evictions,
+                        hit_rate=self.hits / total if total > 0 else 0.0)
+
+
+def create_model_registry(config):
+    registry_config = getattr(config, 'model_registry', None) or {}
+    return ModelRegistry(registry_config.get('max_bytes', DEFAULT_MAX_BYTES))
@@ -1,75 +1,214 @@
 import requests
+import random
+import threading
 import time
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from telemetry import log
 
+# Keep-alive connections per endpoint
+POOL_SIZE = 32
+# Upper bound of a single backoff, in mille seconds
+MAX_INTERVAL = 30000
+# Consecutive failures which open the circuit, and seconds before a probe request is let through
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+# Every request earns RETRY_RATIO retry, up to MAX_RETRY_TOKENS, so retries stay a fraction of the traffic
+RETRY_RATIO = 0.2
+MAX_RETRY_TOKENS = 10
+
 class CommonException(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        # the http status of the failed response, None if no response was received
+        self.status_code = status_code
+
+class CircuitOpenException(CommonException):
     pass
 
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    # Closed: all requests pass. Open: fail fast until reset_timeout has passed,
+    # then let one probe request through, its result closes or re-opens the circuit
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.time() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.probing = False
+
+    # End a request which neither succeeded nor failed on the endpoint, e.g. it raised before or while
+    # it was sent. A probe is let through again, the state of the circuit is not changed
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if self.probing else 'open'
+
+
+class RetryBudget(object):
+    def __init__(self, ratio=RETRY_RATIO, max_tokens=MAX_RETRY_TOKENS):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def available(self):
+        with self.lock:
+            return self.tokens
+
+
+class Endpoint(object):
+    def __init__(self, name, pool_size):
+        self.name = name
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.breaker = CircuitBreaker()
+        self.budget = RetryBudget()
+        # counters are updated by the concurrent requests of the fan-out threads
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(requests=self.requests, retries=self.retries, failures=self.failures,
+                            rejected=self.rejected)
+        return dict(circuit=self.breaker.state(), retry_tokens=self.budget.available(), **counters)
+
+
+endpoints_lock = threading.Lock()
+endpoints = {}
+
+# Get the shared session, circuit breaker and retry budget of the host serving url
+def get_endpoint(url, pool_size=POOL_SIZE):
+    parsed = urlparse(url)
+    name = parsed.scheme + '://' + parsed.netloc
+    with endpoints_lock:
+        endpoint = endpoints.get(name, None)
+        if endpoint is None:
+            endpoint = Endpoint(name, pool_size)
+            endpoints[name] = endpoint
+        return endpoint
+
+def endpoint_stats():
+    with endpoints_lock:
+        return {name: endpoint.stats() for name, endpoint in endpoints.items()}
+
+# Client errors will not succeed on retry, except timeout and throttling
+def is_retriable(status_code):
+    return not 400 <= status_code < 500 or status_code in (408, 429)
+
+
 class RetryRequests(object):
-    def __init__(self, count, interval):
+    def __init__(self, count, interval, max_interval=MAX_INTERVAL):
         '''
         @param count: int, max retry count
-        @param interval: int, retry interval in mille seconds
+        @param interval: int, base retry interval in mille seconds, doubled on every retry
+        @param max_interval: int, max retry interval in mille seconds
         '''
         self.count = count
         self.interval = interval
+        self.max_interval = max_interval
 
-    def get(self, *args, **kwargs):
-        for n in range(self.count - 1, -1, -1):
-            try:
-                session = requests.Session()
-                r = session.get(*args, **kwargs)
-                if not 100 <= r.status_code < 300:
-                    raise CommonException('statuscode: {}, message: {}'.format(r.status_code, r.content))
-                return r
-            except (CommonException, requests.exceptions.RequestException) as e:
-                session.close()
-                if n > 0:
-                    time.sleep(self.interval * 0.001)
-                else:
-                    raise e
+    def backoff(self, attempt):
+        # exponential backoff with full jitter, spreads the retries of concurrent callers
+        return random.uniform(0, min(self.max_interval, self.interval * (2 ** attempt))) * 0.001
 
-    def post(self, *args, **kwargs):
+    def request(self, method, url, **kwargs):
+        endpoint = get_endpoint(url)
+        endpoint.budget.deposit()
         for n in range(self.count - 1, -1, -1):
+            if not endpoint.breaker.allow():
+                endpoint.count('rejected')
+                raise CircuitOpenException('circuit of {} is open, request is not sent'.format(endpoint.name))
+
+            endpoint.count('requests')
+            retriable = True
+            recorded = False
             try:
-                session = requests.Session()
-                r = session.post(*args, **kwargs)
+                r = endpoint.session.request(method, url, **kwargs)
                 if not 100 <= r.status_code < 300:
-                    raise CommonException('statuscode: {}, message: {}'.format(r.status_code, r.content))
+                    retriable = is_retriable(r.status_code)
+                    raise CommonException('statuscode: {}, message: {}'.format(r.status_code, r.content), r.status_code)
+                endpoint.breaker.record_success()
+                recorded = True
                 return r
             except (CommonException, requests.exceptions.RequestException) as e:
-                session.close()
-                if n > 0:
-                    time.sleep(self.interval * 0.001)
+                endpoint.count('failures')
+                if retriable:
+                    endpoint.breaker.record_failure()
                 else:
-                    raise e
+                    # the endpoint is healthy, the request is not
+                    endpoint.breaker.record_success()
+                recorded = True
 
-    def put(self, *args, **kwargs):
-        for n in range(self.count - 1, -1, -1):
-            try:
-                session = requests.Session()
-                r = session.put(*args, **kwargs)
-                if not 100 <= r.status_code < 300:
-                    raise CommonException('statuscode: {}, message: {}'.format(r.status_code, r.content))
-                return r
-            except (CommonException, requests.exceptions.RequestException) as e:
-                session.close()
-                if n > 0:
-                    time.sleep(self.interval * 0.001)
+                if n > 0 and retriable and endpoint.budget.withdraw():
+                    endpoint.count('retries')
+                    delay = self.backoff(self.count - 1 - n)
+                    log.info("Retry %s %s in %.3f seconds, %s" % (method, url, delay, str(e)))
+                    time.sleep(delay)
                 else:
                     raise e
+            finally:
+                # any other exception, a probe must not keep the circuit half-open forever
+                if not recorded:
+                    endpoint.breaker.release()
 
-    def delete(self, *args, **kwargs):
-        for n in range(self.count - 1, -1, -1):
-            try:
-                session = requests.Session()
-                r = session.delete(*args, **kwargs)
-                if not 100 <= r.status_code < 300:
-                    raise CommonException('statuscode: {}, message: {}'.format(r.status_code, r.content))
-                return r
-            except (CommonException, requests.exceptions.RequestException) as e:
-                session.close()
-                if n > 0:
-                    time.sleep(self.interval * 0.001)
-                else:
-                    raise e
\ No newline at end of file
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
@@ -1,6 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from .constant import TIMESTAMP, VALUE
+from .timeutil import to_epoch_array, epoch_to_str_array
+
+
+# A time series held as two columns: int64 UTC epoch nanoseconds and float64 values (NaN for missing)
+# Parameters:
+#   metric_id: metric id
+#   series_id: series id
+#   dim: dimensions of the series
+#   value: optional, an array of {'timestamp': ..., 'value': ...} dicts, timestamps are strings or datetimes
 class Series:
-    def __init__(self, metric_id, series_id, dim, value):
+    __slots__ = ['metric_id', 'series_id', 'dim', 'timestamps', 'values']
+
+    def __init__(self, metric_id, series_id, dim, value=None):
         self.metric_id = metric_id
         self.series_id = series_id
         self.dim = dim
-        self.value = value
\ No newline at end of file
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+        if value is not None:
+            self.value = value
+
+    @staticmethod
+    def from_arrays(metric_id, series_id, dim, timestamps, values):
+        series = Series(metric_id, series_id, dim)
+        series.timestamps = np.asarray(timestamps, dtype=np.int64)
+        series.values = np.asarray(values, dtype=np.float64)
+        return series
+
+    # The list-of-dicts layout for plugins using it, e.g. to build a DataFrame or a JSON body.
+    # A new list is built on each access, keep it instead of indexing value in a loop
+    @property
+    def value(self):
+        timestamps = epoch_to_str_array(self.timestamps)
+        return [{TIMESTAMP: timestamp, VALUE: None if np.isnan(value) else float(value)}
+                for timestamp, value in zip(timestamps, self.values)]
+
+    @value.setter
+    def value(self, value):
+        self.timestamps = to_epoch_array([item[TIMESTAMP] for item in value])
+        self.values = np.array([item[VALUE] for item in value], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Return: a pandas Series of the values indexed by naive UTC timestamps, sharing the arrays
+    def to_pandas(self):
+        index = pd.DatetimeIndex(self.timestamps.view('datetime64[ns]'))
+        return pd.Series(self.values, index=index, copy=False)
+
+    # Return: a DataFrame with TIMESTAMP (naive UTC) and VALUE columns
+    def to_frame(self):
+        return pd.DataFrame({TIMESTAMP: self.timestamps.view('datetime64[ns]'), VALUE: self.values},
+                            columns=[TIMESTAMP, VALUE])
+
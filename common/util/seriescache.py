@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from telemetry import log
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class SeriesCacheEntry():
+    __slots__ = ['scope', 'series_id', 'id', 'start', 'end', 'timestamps', 'values']
+
+    # Parameters:
+    #   scope: the api key which fetched the points, an entry is only served to the same api key
+    #   series_id: TSANA series id
+    #   id: the id object of the series returned by TSANA, metricId and dimension
+    #   start, end: the fetched range [start, end) in UTC epoch nanoseconds
+    #   timestamps, values: the points in the range, int64 epoch nanoseconds and float64
+    def __init__(self, scope, series_id, id, start, end, timestamps, values):
+        self.scope = scope
+        self.series_id = series_id
+        self.id = id
+        self.start = start
+        self.end = end
+        self.timestamps = timestamps
+        self.values = values
+
+    @property
+    def key(self):
+        return (self.scope, self.series_id)
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+    # Return: copies of the points in [start, end)
+    def slice(self, start, end):
+        lo, hi = np.searchsorted(self.timestamps, [start, end])
+        return self.timestamps[lo:hi].copy(), self.values[lo:hi].copy()
+
+
+# An LRU cache of fetched series ranges keyed by (api key, series id) and bounded by max_bytes, evicted
+# entries are written to spill_dir (if any) and read back on the next miss. Spilled files are named by a
+# hash of the key, the api key is not written to disk
+# Parameters:
+#   max_bytes: max bytes of points held in memory
+#   spill_dir: optional, a directory to spill evicted entries to
+#   spill_max_bytes: max bytes of spilled entries written by this process
+class SeriesCache():
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_dir=None, spill_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes if spill_max_bytes is not None else max_bytes * 4
+        self.entries = OrderedDict()
+        self.spilled = OrderedDict()
+        self.bytes = 0
+        self.spill_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.spill_loads = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, scope, series_id):
+        key = (scope, series_id)
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        entry = self._load_spilled(scope, series_id)
+        if entry is not None:
+            self.put(entry)
+        return entry
+
+    def put(self, entry):
+        with self.lock:
+            old = self.entries.pop(entry.key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self.entries[entry.key] = entry
+            self.bytes += entry.nbytes
+
+            evicted = []
+            while self.bytes > self.max_bytes and len(self.entries) > 0:
+                _, victim = self.entries.popitem(last=False)
+                self.bytes -= victim.nbytes
+                evicted.append(victim)
+
+        for victim in evicted:
+            self._spill(victim)
+
+    def record(self, hit=False, partial=False):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            elif partial:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries),
+                        bytes=self.bytes,
+                        max_bytes=self.max_bytes,
+                        spilled=len(self.spilled),
+                        spill_bytes=self.spill_bytes,
+                        hits=self.hits,
+                        partial_hits=self.partial_hits,
+                        misses=self.misses,
+                        spill_loads=self.spill_loads)
+
+    def _spill_path(self, key):
+        scope, series_id = key
+        digest = hashlib.sha256((str(scope) + '\0' + series_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, digest + '.npz')
+
+    def _spill(self, entry):
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(entry.key)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, timestamps=entry.timestamps, values=entry.values,
+                         meta=np.array([entry.series_id, json.dumps(entry.id)]),
+                         range=np.array([entry.start, entry.end], dtype=np.int64))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.error("Spill series %s failed, %s." % (entry.series_id, str(e)))
+            return
+
+        removed = []
+        with self.lock:
+            old_size = self.spilled.pop(entry.key, 0)
+            self.spilled[entry.key] = os.path.getsize(path)
+            self.spill_bytes += self.spilled[entry.key] - old_size
+            while self.spill_bytes > self.spill_max_bytes and len(self.spilled) > 0:
+                key, size = self.spilled.popitem(last=False)
+                self.spill_bytes -= size
+                removed.append(key)
+
+        for key in removed:
+            try:
+                os.remove(self._spill_path(key))
+            except OSError:
+                pass
+
+    def _load_spilled(self, scope, series_id):
+        if self.spill_dir is None:
+            return None
+        key = (scope, series_id)
+        path = self._spill_path(key)
+        try:
+            with np.load(path) as data:
+                if str(data['meta'][0]) != series_id:
+                    return None
+                start, end = [int(x) for x in data['range']]
+                entry = SeriesCacheEntry(scope, series_id, json.loads(str(data['meta'][1])), start, end,
+                                         data['timestamps'], data['values'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+        with self.lock:
+            self.spill_loads += 1
+            self.spill_bytes -= self.spilled.pop(key, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return entry
+
+
+
+# Create the series cache from the 'series_cache' section of config, max_bytes 0 disables the cache
+# Return:
+#   a SeriesCache, or None if disabled
+def create_series_cache(config):
+    cache_config = getattr(config, 'series_cache', None) or {}
+    max_bytes = cache_config.get('max_bytes', DEFAULT_MAX_BYTES)
+    if max_bytes <= 0:
+        return None
+    return SeriesCache(max_bytes, cache_config.get('spill_dir', None), cache_config.get('spill_max_bytes', None))
@@ -0,0 +1,114 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .azureblob import AzureBlob, DEFAULT_MAX_CONCURRENCY, DEFAULT_BLOCK_SIZE, transfer_stats
+from .azuretable import AzureTable
+
+from telemetry import log
+
+# Max keep-alive connections per storage host
+DEFAULT_POOL_SIZE = 16
+
+lock = threading.Lock()
+table_clients = {}
+blob_clients = {}
+sessions = []
+client_counts = dict(created=0, reused=0)
+
+
+def create_pooled_session(pool_size=DEFAULT_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_pool_size(config):
+    return getattr(config, 'storage_pool_size', DEFAULT_POOL_SIZE)
+
+
+def get_client(clients, key, create):
+    with lock:
+        client = clients.get(key, None)
+        if client is not None:
+            client_counts['reused'] += 1
+            return client
+
+        client = create()
+        clients[key] = client
+        client_counts['created'] += 1
+        return client
+
+
+# Get the process-wide AzureTable client of the configured storage account
+# Parameters:
+#   config: a dict object which should include AZ_STORAGE_ACCOUNT, AZ_STORAGE_ACCOUNT_KEY
+# Return:
+#   azure_table: an AzureTable sharing one keep-alive connection pool
+def get_azure_table(config):
+    def create():
+        session = create_pooled_session(get_pool_size(config))
+        sessions.append(session)
+        return AzureTable(config.az_storage_account, config.az_storage_account_key, session=session)
+
+    return get_client(table_clients, (config.az_storage_account, config.az_storage_account_key), create)
+
+
+# Get the process-wide AzureBlob client of the configured blob connection
+# Parameters:
+#   config: a dict object which should include AZ_BLOB_CONNECTION, and optionally blob_max_concurrency,
+#           blob_block_size
+# Return:
+#   azure_blob: an AzureBlob sharing one keep-alive connection pool
+def get_azure_blob(config):
+    def create():
+        max_concurrency = getattr(config, 'blob_max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        # a connection for each parallel block of a transfer
+        session = create_pooled_session(max(get_pool_size(config), max_concurrency))
+        sessions.append(session)
+        return AzureBlob(config.az_tsana_model_blob_connection, session=session, max_concurrency=max_concurrency,
+                         block_size=getattr(config, 'blob_block_size', DEFAULT_BLOCK_SIZE))
+
+    return get_client(blob_clients, config.az_tsana_model_blob_connection, create)
+
+
+# Create the tables and the blob container used by the plugin, once at startup,
+# so the request path never probes for them
+# Parameters:
+#   config: a dict object which should include AZ_STORAGE_ACCOUNT, AZ_STORAGE_ACCOUNT_KEY, AZ_META_TABLE,
+#           AZ_MONITOR_TABLE, AZ_BLOB_CONNECTION, TSANA_APP_NAME
+def init_storage(config):
+    azure_table = get_azure_table(config)
+    for table_name in [config.az_tsana_meta_table, config.az_tsana_moniter_table]:
+        if not azure_table.exists_table(table_name):
+            azure_table.create_table(table_name)
+
+    if config.az_tsana_model_blob_connection:
+        get_azure_blob(config).create_container(config.tsana_app_name)
+
+    log.info("Storage is initialized for %s." % config.tsana_app_name)
+
+
+def storage_stats():
+    connections = 0
+    requests_count = 0
+    with lock:
+        for session in sessions:
+            # the same adapter is mounted for http and https
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        connections += pool.num_connections
+                        requests_count += pool.num_requests
+
+        return dict(clients_created=client_counts['created'],
+                    clients_reused=client_counts['reused'],
+                    connections_opened=connections,
+                    requests=requests_count,
+                    requests_per_connection=requests_count / connections if connections > 0 else 0.0,
+                    blob_transfers=transfer_stats.stats())
@@ -1,12 +1,15 @@
 from dateutil import parser, tz
 import datetime
 import dateutil
+import numpy as np
+import pandas as pd
 
 from .constant import MINT_IN_SECONDS, HOUR_IN_SECONDS, DAY_IN_SECONDS
 from .gran import Gran
 
 DT_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 DT_FILENAME_FORMAT = '%Y-%m-%dT_%H_%M_%SZ'
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=tz.UTC)
 
 def convert_freq(gran, custom_in_seconds):
     if gran == Gran.Yearly:
@@ -34,6 +37,55 @@ def str_to_dt(s):
 def dt_to_str(dt):
     return dt.strftime(DT_FORMAT)
 
+# Convert timestamps (strings or datetimes) to an int64 array of UTC epoch nanoseconds
+def to_epoch_array(timestamps):
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=np.int64)
+    if isinstance(timestamps[0], str):
+        return str_to_epoch_array(timestamps)
+    index = pd.to_datetime(timestamps, utc=True).tz_convert(None)
+    return np.asarray(index.values, dtype='datetime64[ns]').view(np.int64)
+
+# Convert an int64 array of UTC epoch nanoseconds to a list of DT_FORMAT strings
+def epoch_to_str_array(epochs):
+    strings = np.datetime_as_string(np.asarray(epochs, dtype=np.int64).view('datetime64[ns]'), unit='s')
+    return [s + 'Z' for s in strings.tolist()]
+
+# UTC epoch nanoseconds of a datetime, a naive datetime is taken as UTC
+def dt_to_epoch(dt):
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz.UTC)
+    delta = dt - EPOCH
+    return (delta.days * DAY_IN_SECONDS + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+def epoch_to_dt(epoch):
+    return EPOCH + datetime.timedelta(microseconds=int(epoch) // 1000)
+
+# Array version of str_to_dt, returns an int64 array of UTC epoch nanoseconds.
+# Strings in DT_FORMAT are parsed with array arithmetic, any other format falls back to str_to_dt
+def str_to_epoch_array(strings):
+    if len(strings) == 0:
+        return np.empty(0, dtype=np.int64)
+    try:
+        raw = np.array(strings, dtype=np.bytes_)
+    except UnicodeEncodeError:
+        raw = None
+
+    if raw is not None and raw.dtype.itemsize == len('YYYY-MM-DDTHH:MM:SSZ'):
+        chars = raw.reshape(-1).view(np.uint8).reshape(len(raw), -1)
+        digits = chars[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]].astype(np.int64) - ord('0')
+        if ((digits >= 0) & (digits <= 9)).all() \
+                and (chars[:, [4, 7]] == ord('-')).all() and (chars[:, 10] == ord('T')).all() \
+                and (chars[:, [13, 16]] == ord(':')).all() and (chars[:, 19] == ord('Z')).all():
+            number = lambda first, width: digits[:, first: first + width].dot(10 ** np.arange(width - 1, -1, -1))
+            year, month, day = number(0, 4), number(4, 2), number(6, 2)
+            seconds = number(8, 2) * HOUR_IN_SECONDS + number(10, 2) * MINT_IN_SECONDS + number(12, 2)
+            days = (np.datetime64('1970', 'Y') + (year - 1970)).astype('datetime64[M]') + (month - 1)
+            days = days.astype('datetime64[D]') + (day - 1)
+            return (days.astype(np.int64) * DAY_IN_SECONDS + seconds) * 1000000000
+
+    return np.array([dt_to_epoch(str_to_dt(s)) for s in strings], dtype=np.int64)
+
 def dt_to_str_file_name(dt):
     return dt.strftime(DT_FILENAME_FORMAT)
 
@@ -62,6 +114,29 @@ def get_diff(start, graninfo, end):
     return int(diff)
 
 
+# Approximate seconds of one granularity, Monthly / Yearly use the average length
+def get_gran_in_seconds(graninfo):
+    (gran_str, custom_in_seconds) = graninfo
+
+    if gran_str == 'Daily':
+        return DAY_IN_SECONDS
+    elif gran_str == 'Weekly':
+        return DAY_IN_SECONDS * 7
+    elif gran_str == 'Monthly':
+        return DAY_IN_SECONDS * 30
+    elif gran_str == 'Yearly':
+        return DAY_IN_SECONDS * 365
+    elif gran_str == 'Hourly':
+        return HOUR_IN_SECONDS
+    elif gran_str == 'Minutely':
+        return MINT_IN_SECONDS
+    elif gran_str == 'Secondly':
+        return 1
+    elif gran_str == 'Custom':
+        return custom_in_seconds
+    else:
+        raise Exception('Granularity not supported: {}|{}'.format(*graninfo))
+
 def get_time_offset(timestamp, graninfo, offset):
     (gran_str, custom_in_seconds) = graninfo
 
@@ -84,6 +159,78 @@ def get_time_offset(timestamp, graninfo, offset):
     else:
         raise Exception('Granularity not supported: {}|{}'.format(*graninfo))
 
+# Nanoseconds of a fixed length granularity, None for Monthly / Yearly
+def get_gran_in_nanoseconds(graninfo):
+    (gran_str, custom_in_seconds) = graninfo
+    if gran_str in ('Monthly', 'Yearly'):
+        return None
+    return int(get_gran_in_seconds(graninfo)) * 1000000000
+
+# Add months to epochs like relativedelta, the day is clipped to the end of the target month
+# Parameters:
+#   epochs: int64 array of UTC epoch nanoseconds
+#   months: int or int64 array of months to add
+#   day_limit: optional, int64 array of 0-based max day, applied before clipping
+def add_months_array(epochs, months, day_limit=None):
+    dt = np.asarray(epochs, dtype=np.int64).view('datetime64[ns]')
+    dt_day = dt.astype('datetime64[D]')
+    dt_month = dt.astype('datetime64[M]')
+    day = (dt_day - dt_month.astype('datetime64[D]')).astype(np.int64)
+    time_of_day = (dt - dt_day).astype(np.int64)
+
+    new_month = dt_month + months
+    month_len = ((new_month + 1).astype('datetime64[D]') - new_month.astype('datetime64[D]')).astype(np.int64)
+    if day_limit is not None:
+        day = np.minimum(day, day_limit)
+    day = np.minimum(day, month_len - 1)
+    new_day = new_month.astype('datetime64[D]') + day
+    return new_day.astype('datetime64[ns]').astype(np.int64) + time_of_day
+
+# Array version of get_time_offset
+# Parameters:
+#   epochs: int64 array of UTC epoch nanoseconds
+#   graninfo: (granularityName, granularityAmount)
+#   offset: number of granularities to add
+# Return:
+#   int64 array of UTC epoch nanoseconds
+def get_time_offset_array(epochs, graninfo, offset):
+    (gran_str, custom_in_seconds) = graninfo
+    epochs = np.asarray(epochs, dtype=np.int64)
+    if gran_str == 'Monthly':
+        return add_months_array(epochs, offset)
+    elif gran_str == 'Yearly':
+        return add_months_array(epochs, offset * 12)
+    return epochs + get_gran_in_nanoseconds(graninfo) * offset
+
+# Array version of get_time_list
+# Parameters:
+#   start_time: inclusive, a datetime
+#   end_time: exclusive, a datetime
+#   graninfo: (granularityName, granularityAmount)
+# Return:
+#   int64 array of UTC epoch nanoseconds
+def get_time_list_array(start_time, end_time, graninfo):
+    (gran_str, custom_in_seconds) = graninfo
+    start = dt_to_epoch(start_time)
+    end = dt_to_epoch(end_time)
+    if start >= end:
+        return np.empty(0, dtype=np.int64)
+
+    step = get_gran_in_nanoseconds(graninfo)
+    if step is not None:
+        return np.arange(start, end, step, dtype=np.int64)
+
+    months_per_step = 12 if gran_str == 'Yearly' else 1
+    delta = dateutil.relativedelta.relativedelta(end_time, start_time)
+    count = (delta.years * 12 + delta.months) // months_per_step + 2
+    months = np.arange(count, dtype=np.int64) * months_per_step
+    # get_time_list adds one granularity at a time, so a clipped day stays clipped for the following months
+    month_start = np.asarray([start], dtype=np.int64).view('datetime64[ns]').astype('datetime64[M]') + months
+    month_len = ((month_start + 1).astype('datetime64[D]') - month_start.astype('datetime64[D]')).astype(np.int64)
+    day_limit = np.minimum.accumulate(month_len - 1)
+    epochs = add_months_array(np.full(count, start, dtype=np.int64), months, day_limit)
+    return epochs[epochs < end]
+
 def get_time_list(start_time, end_time, graninfo):
     time_list = []
     
@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by TTLCache.get when the key is not cached, so None can be cached as a value
+NOT_FOUND = object()
+
+
+# A thread-safe in-process cache, entries expire after ttl seconds and the least recently
+# used entries are dropped beyond max_size
+# Parameters:
+#   ttl: default time to live of an entry in seconds
+#   max_size: max number of entries
+class TTLCache():
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=NOT_FOUND):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl=None):
+        expire = time.time() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expire, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(size=len(self.entries),
+                        hits=self.hits,
+                        misses=self.misses,
+                        hit_rate=self.hits / total if total > 0 else 0.0)
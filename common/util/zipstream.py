@@ -0,0 +1,60 @@
+import os
+import threading
+import zipfile
+
+# The zipfile compressions, named as the model_package compressions
+COMPRESSIONS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA
+}
+
+
+# A zip of the files in src_dir as a readable stream. The zip is written by a thread into a pipe while
+# it is read, so it is never held in memory nor written to disk. A failure of the writer is raised by
+# read instead of ending the stream, so a partial zip is never taken as a complete one
+# Parameters:
+#   src_dir: the directory to zip, files are named by their path relative to it
+#   compression: a zipfile compression
+#   compresslevel: the compression level, None for the default of the compression
+class ZipStream():
+    def __init__(self, src_dir, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'rb')
+        self.error = None
+        self.thread = threading.Thread(target=self.__write,
+                                       args=(os.fdopen(write_fd, 'wb'), src_dir, compression, compresslevel),
+                                       daemon=True)
+        self.thread.start()
+
+    def __write(self, stream, src_dir, compression, compresslevel):
+        try:
+            with stream, zipfile.ZipFile(stream, 'w', compression=compression, compresslevel=compresslevel) as zf:
+                for root, dirs, files in os.walk(src_dir):
+                    dirs.sort()
+                    for file_name in sorted(files):
+                        full_file_name = os.path.join(root, file_name)
+                        zf.write(full_file_name, os.path.relpath(full_file_name, src_dir))
+        except Exception as e:
+            self.error = e
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if size is None or size < 0 or len(data) < size:
+            # the end of the pipe, the zip is complete unless the writer failed
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+        return data
+
+    def close(self):
+        # a writer blocked on the pipe fails once the reader is closed
+        self.reader.close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
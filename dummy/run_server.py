@@ -8,7 +8,7 @@ environ['SERVICE_CONFIG_FILE'] = 'dummy/config/service_config.yaml'
 
 from dummy.dummy_plugin_service import DummyPluginService
 from common.plugin_model_api import api, PluginModelAPI, PluginModelListAPI, PluginModelTrainAPI, \
-    PluginModelInferenceAPI, app, PluginModelParameterAPI
+    PluginModelInferenceAPI, app, PluginModelParameterAPI, PluginModelStatsAPI
 
 dummy = DummyPluginService()
 
@@ -17,6 +17,7 @@ api.add_resource(PluginModelAPI, '/dummy/models/<model_id>', resource_class_kwar
 api.add_resource(PluginModelTrainAPI, '/dummy/models/train', resource_class_kwargs={'plugin_service': dummy})
 api.add_resource(PluginModelInferenceAPI, '/dummy/models/<model_id>/inference', resource_class_kwargs={'plugin_service': dummy})
 api.add_resource(PluginModelParameterAPI, '/dummy/parameters', resource_class_kwargs={'plugin_service': dummy})
+api.add_resource(PluginModelStatsAPI, '/dummy/stats', resource_class_kwargs={'plugin_service': dummy})
 
 if __name__ == '__main__':
     HOST = environ.get('SERVER_HOST', '0.0.0.0')
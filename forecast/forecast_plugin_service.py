@@ -1,24 +1,33 @@
+import datetime
 import json
 import shutil
 import os
+import numpy as np
 from telemetry import log
 
 from common.plugin_service import PluginService
 from common.util.constant import STATUS_SUCCESS, STATUS_FAIL
 from common.util.timeutil import get_time_offset, str_to_dt, dt_to_str
+from common.util.timeutil import get_time_list_array, get_time_offset_array, epoch_to_dt, epoch_to_str_array
 from common.util.csv import save_to_csv
 from common.util.metric import MetricSender
 from common.util.fill_type import Fill
 from common.util.gran import Gran
+from common.util.modelcache import get_model_cache
 
-from forecast.model.inference import inference, load_inference_model, load_inference_input_data
+from forecast.model.inference import batch_inference, load_inference_model, load_inference_input_data
 from forecast.model.training import train
+from forecast.model.candidates import DEFAULT_TIME_BUDGET, UNIVARIATE_MODELS
 
 class ForecastPluginService(PluginService):
 
     def __init__(self):
         super().__init__()
 
+    # The factors and the target of the instance
+    def get_metric_ids(self, parameters):
+        return super().get_metric_ids(parameters) + [parameters['instance']['params']['target']['metricId']]
+
     # Verify if the data could be used for this application
     # Parameters: 
     #   series_sets: a array of series set
@@ -99,7 +108,7 @@ class ForecastPluginService(PluginService):
                                             future_target_size=parameters['instance']['params']['step'],
                                             gran=Gran[meta['granularityName']],
                                             custom_in_seconds=meta['granularityAmount'],
-                                            max_cores=2,
+                                            max_cores=self.train_cores,
                                             metric_sender=MetricSender(self.config, subscription, model_id),
                                             epoc=parameters['instance']['params']['epoc'] if 'epoc' in
                                                                                                         parameters[
@@ -132,7 +141,8 @@ class ForecastPluginService(PluginService):
                                             fill_value=parameters['instance']['params']['fillValue'] if 'fillValue' in
                                                                                                         parameters[
                                                                                                             'instance'][
-                                                                                                            'params'] else 0
+                                                                                                            'params'] else 0,
+                                            time_budget=self.config.lstm.get('train_time_budget', DEFAULT_TIME_BUDGET)
                                             )
         # Need to call callback
         return STATUS_SUCCESS, ''
@@ -148,24 +158,15 @@ class ForecastPluginService(PluginService):
             start_time  = str_to_dt(parameters['startTime'])
         else: 
             start_time = end_time
-        cur_time = start_time
 
         data_end_time = get_time_offset(end_time, (meta['granularityName'], meta['granularityAmount']),
                                                     + 1)
 
-        data_start_time = get_time_offset(start_time, (meta['granularityName'], meta['granularityAmount']),
-                                                    - inference_window * 2)
-
-
-        factor_def = parameters['seriesSets']
-        factors_data = self.tsanaclient.get_timeseries(parameters['apiKey'], factor_def, data_start_time, data_end_time)
-
-        target_def = [parameters['instance']['params']['target']]
-        target_data = self.tsanaclient.get_timeseries(parameters['apiKey'], target_def, data_start_time, data_end_time)
-
-        model, window = load_inference_model(model_dir=model_dir, target_size=parameters['instance']['params']['step'],
+        def load(model_dir):
+            try:
+                return load_inference_model(model_dir=model_dir, target_size=parameters['instance']['params']['step'],
                             window=inference_window, 
-                            metric_sender=MetricSender(self.config, subscription, model_id), 
+                            metric_sender=None, 
                             epoc=parameters['instance']['params']['epoc'] if 'epoc' in
                                                                                                 parameters[
                                                                                                     'instance'][
@@ -178,6 +179,29 @@ class ForecastPluginService(PluginService):
                                                                                                 parameters[
                                                                                                     'instance'][
                                                                                                     'params'] else self.config.lstm['validation_ratio'])
+            except Exception:
+                # the cached model files may be broken, the next inference downloads them again
+                get_model_cache(self.config).invalidate(subscription, model_id)
+                raise
+
+        # A hot model is served by the registry, the model dir of each timekey is another version of the model
+        model, window = self.model_registry.get(subscription, model_id, model_dir, model_dir, load)
+
+        # univariate models forecast from the history of the target, two seasons of it at least
+        history = inference_window * 2
+        if model.get_model_type().name in UNIVARIATE_MODELS:
+            history = max(history, model.get_season() * 2)
+        data_start_time = get_time_offset(start_time, (meta['granularityName'], meta['granularityAmount']),
+                                                    - history)
+
+        factor_def = parameters['seriesSets']
+        factors_data = self.tsanaclient.get_timeseries(parameters['apiKey'], factor_def, data_start_time, data_end_time)
+
+        # the target is shifted by target_offset as in training, the forecasts are shifted back below
+        target_def = [parameters['instance']['params']['target']]
+        offset = int(parameters['instance']['params']['target_offset']) if 'target_offset' in parameters['instance']['params'] else None
+        target_data = self.tsanaclient.get_timeseries(parameters['apiKey'], target_def, data_start_time, data_end_time,
+                                                      offset or 0, meta['granularityName'], meta['granularityAmount'])
 
         input_data = load_inference_input_data(target_series=target_data[0],factor_series=factors_data, 
                                             model=model, gran=Gran[meta['granularityName']], 
@@ -190,30 +214,28 @@ class ForecastPluginService(PluginService):
                                                                                                         parameters[
                                                                                                             'instance'][
                                                                                                             'params'] else 0)
-        while cur_time <= end_time: 
-            try: 
-                result = inference(input_data=input_data, window=window, timestamp=cur_time, 
-                                            target_size=parameters['instance']['params']['step'], model=model)
-                    
-                if len(result) > 0: 
-                    # offset back
-                    if 'target_offset' in parameters['instance']['params']:
-                        offset = int(parameters['instance']['params']['target_offset'])
-                        for idx in range(len(result)): 
-                            result[idx]['timestamp'] = dt_to_str(get_time_offset(cur_time, (meta['granularityName'], meta['granularityAmount']),
-                                                                                        - offset + idx))
-                            # print(result[idx]['timestamp'])
-                    self.tsanaclient.save_inference_result(parameters, result)
-                else:
-                    log.error("No result for this inference %s, key %s" % (dt_to_str(cur_time), model_dir))
-                # process = psutil.Process(os.getpid())
-                # print(process.memory_info().rss)
-            except Exception as e: 
-                log.error("-------Inference exception-------")
-            
-            cur_time = get_time_offset(cur_time, (meta['granularityName'], meta['granularityAmount']),
-                                                            + 1)
-        return STATUS_SUCCESS, ''
+        # every granularity from start_time to end_time, inclusive
+        graninfo = (meta['granularityName'], meta['granularityAmount'])
+        epochs = get_time_list_array(start_time, end_time + datetime.timedelta(microseconds=1), graninfo)
+        timestamps = [epoch_to_dt(epoch) for epoch in epochs]
+
+        # Forecast all timestamps in one batch, and save them in one request
+        results = batch_inference(input_data=input_data, window=window, timestamps=timestamps,
+                                  target_size=parameters['instance']['params']['step'], model=model)
+        all_results = []
+        for epoch, cur_time, result in zip(epochs, timestamps, results):
+            if len(result) > 0:
+                # offset back
+                if offset is not None:
+                    result_epochs = get_time_offset_array(np.full(len(result), epoch, dtype=np.int64), graninfo,
+                                                          np.arange(len(result), dtype=np.int64) - offset)
+                    for item, timestamp in zip(result, epoch_to_str_array(result_epochs)):
+                        item['timestamp'] = timestamp
+                all_results.extend(result)
+            else:
+                log.error("No result for this inference %s, key %s" % (dt_to_str(cur_time), model_dir))
+
+        return self.tsanaclient.save_inference_result(parameters, all_results)
 
     def get_inference_time_range(self, parameters):
         return []
\ No newline at end of file
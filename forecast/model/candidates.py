@@ -0,0 +1,231 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+
+import numpy as np
+
+from common.util.jobscheduler import set_thread_budget
+from forecast.util.exponential_smoothing import ExponentialSmoothingModel
+from forecast.util.forecast_factor import ForecastFactor
+from forecast.util.model_type import ModelType
+from forecast.util.multivariate import MultivariateData
+from forecast.util.seasonal_naive import SeasonalNaiveModel
+
+from telemetry import log
+
+# The manifest of a trained model, names the model type its files belong to
+MANIFEST_FILE = 'model.json'
+CANDIDATE_DIR = 'candidates'
+RESULT_FILE = 'result.json'
+# Seconds all candidates of a training may take
+DEFAULT_TIME_BUDGET = 3600
+POLL_SECONDS = 0.5
+
+
+# The candidate models of a training, the first one is the configured LSTM
+# Parameters:
+#   num_hidden, window: the configured LSTM
+# Return:
+#   an array of candidates, dict(name, model_type, window, ...), model_type is a ModelType name
+def get_candidates(num_hidden, window):
+    candidates = [dict(name='lstm', model_type=ModelType.LSTM.name, num_hidden=num_hidden, window=window),
+                  dict(name='lstm-wide', model_type=ModelType.LSTM.name, num_hidden=num_hidden * 2, window=window)]
+    if window // 2 > 1:
+        candidates.append(dict(name='lstm-short', model_type=ModelType.LSTM.name, num_hidden=num_hidden,
+                               window=window // 2))
+    candidates.append(dict(name='seasonal-naive', model_type=ModelType.SeasonalNaive.name, window=window))
+    candidates.append(dict(name='exponential-smoothing', model_type=ModelType.ExponentialSmoothing.name,
+                           window=window))
+    return candidates
+
+
+def requires_factors(candidate):
+    return candidate['model_type'] == ModelType.LSTM.name
+
+
+# Univariate models forecast the target from its own history, in NumPy
+UNIVARIATE_MODELS = {
+    ModelType.SeasonalNaive.name: SeasonalNaiveModel,
+    ModelType.ExponentialSmoothing.name: ExponentialSmoothingModel
+}
+
+
+# Baselines are cheap, they are trained in the training process instead of a worker process
+def is_baseline(candidate):
+    return candidate['model_type'] in UNIVARIATE_MODELS
+
+
+def build_train_data(target_series, factor_series, settings):
+    return MultivariateData(target_series, [ForecastFactor(x) for x in factor_series],
+                            gran=settings['gran'], custom_in_seconds=settings['custom_in_seconds'],
+                            fill_type=settings['fill_type'], fill_value=settings['fill_value'])
+
+
+# Train a candidate and save it to model_dir
+# Return:
+#   the MAPE of every forecast step
+def train_candidate(candidate, train_data, settings, model_dir, metric_sender=None):
+    if candidate['model_type'] == ModelType.LSTM.name:
+        # imported here, so processes training only baselines never load TensorFlow
+        from forecast.util.lstm import LSTMModel
+        model = LSTMModel(num_hidden=candidate['num_hidden'], window=candidate['window'],
+                          end_time=settings['timestamp'], validation_ratio=settings['validation_ratio'],
+                          validation_freq=settings['validation_freq'],
+                          future_target_size=settings['future_target_size'],
+                          effective_factor=train_data.get_effective_factor(), metric_sender=metric_sender,
+                          epoc=settings['epoc'])
+        model.train(input_data=train_data, batch_size=settings['batch_size'],
+                    steps_per_epoc=settings['steps_per_epoc'], validation_start=settings.get('validation_start'))
+    elif candidate['model_type'] in UNIVARIATE_MODELS:
+        model = UNIVARIATE_MODELS[candidate['model_type']].create(
+            window=candidate['window'], end_time=settings['timestamp'],
+            future_target_size=settings['future_target_size'], validation_ratio=settings['validation_ratio'],
+            gran=settings['gran'], custom_in_seconds=settings['custom_in_seconds'])
+        model.train(input_data=train_data, validation_start=settings.get('validation_start'))
+    else:
+        raise Exception('Model type {} is not supported.'.format(candidate['model_type']))
+
+    os.makedirs(model_dir, exist_ok=True)
+    model.save_model(model_dir)
+    return [float(x) for x in model.get_mean_absolute_percentage_error()]
+
+
+# Entry of a candidate worker process, the result is written to RESULT_FILE in model_dir
+def run_candidate_process(candidate, target_series, factor_series, settings, model_dir, threads):
+    set_thread_budget(threads)
+    try:
+        train_data = build_train_data(target_series, factor_series, settings)
+        result = dict(mape=train_candidate(candidate, train_data, settings, model_dir))
+    except Exception as e:
+        traceback.print_exc()
+        result = dict(error=str(e))
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, RESULT_FILE), 'w') as f:
+        json.dump(result, f)
+
+
+# Lower is better, a candidate without a valid MAPE is never picked over one with it
+def score(mape):
+    mape = np.asarray(mape, dtype=np.float64)
+    if len(mape) == 0 or np.all(np.isnan(mape)):
+        return float('inf')
+    return float(np.nanmean(mape))
+
+
+# Train the candidates, baselines in this process and the others in parallel worker processes,
+# each with an equal share of max_cores. No more of the others than max_cores are trained, and
+# candidates still running when time_budget is spent are stopped
+# Return:
+#   a dict of candidate name -> MAPE of every forecast step, for the candidates which finished
+def train_candidates(candidates, target_series, factor_series, train_data, settings, model_dir, max_cores,
+                     time_budget, metric_sender=None):
+    deadline = time.time() + time_budget
+    results = {}
+    errors = {}
+    candidate_root = os.path.join(model_dir, CANDIDATE_DIR)
+
+    for candidate in [c for c in candidates if is_baseline(c)]:
+        try:
+            results[candidate['name']] = train_candidate(candidate, train_data, settings,
+                                                         os.path.join(candidate_root, candidate['name']))
+        except Exception as e:
+            errors[candidate['name']] = str(e)
+
+    # one round of the others on the cores, each round more would add a whole training to the time,
+    # so the first ones are kept, the configured LSTM is always trained
+    heavy = [c for c in candidates if not is_baseline(c)]
+    parallelism = max(1, min(int(max_cores), len(heavy)))
+    for candidate in heavy[parallelism:]:
+        log.info("Candidate %s is skipped, %d cores for %d candidates" % (candidate['name'], max_cores, len(heavy)))
+    heavy = heavy[:parallelism]
+    if parallelism == 1:
+        # in this process, it reports the epochs of its training
+        for candidate in heavy:
+            if time.time() >= deadline:
+                errors[candidate['name']] = 'Time budget is spent.'
+                continue
+            try:
+                results[candidate['name']] = train_candidate(candidate, train_data, settings,
+                                                             os.path.join(candidate_root, candidate['name']),
+                                                             metric_sender)
+            except Exception as e:
+                errors[candidate['name']] = str(e)
+    else:
+        threads = max(1, int(max_cores) // parallelism)
+        context = multiprocessing.get_context('spawn')
+        pending = list(heavy)
+        running = []
+        while pending or running:
+            while pending and len(running) < parallelism:
+                candidate = pending.pop(0)
+                process = context.Process(target=run_candidate_process,
+                                          args=(candidate, target_series, factor_series, settings,
+                                                os.path.join(candidate_root, candidate['name']), threads))
+                process.start()
+                running.append((candidate, process))
+
+            time.sleep(POLL_SECONDS)
+            timeout = time.time() >= deadline
+            for candidate, process in list(running):
+                if process.is_alive() and not timeout:
+                    continue
+                if process.is_alive():
+                    process.terminate()
+                    errors[candidate['name']] = 'Time budget is spent.'
+                process.join()
+                running.remove((candidate, process))
+                if candidate['name'] not in errors:
+                    result = read_result(os.path.join(candidate_root, candidate['name']))
+                    if 'mape' in result:
+                        results[candidate['name']] = result['mape']
+                    else:
+                        errors[candidate['name']] = result.get('error', 'Exit code {}'.format(process.exitcode))
+            if timeout:
+                for candidate in pending:
+                    errors[candidate['name']] = 'Time budget is spent.'
+                pending = []
+
+    for name, error in errors.items():
+        log.error("Candidate %s failed, %s" % (name, error))
+    return results
+
+
+def read_result(candidate_dir):
+    try:
+        with open(os.path.join(candidate_dir, RESULT_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Move the files of the chosen candidate to model_dir, drop the others, and write the manifest
+# Return:
+#   the manifest
+def publish_candidate(candidate, results, model_dir):
+    candidate_root = os.path.join(model_dir, CANDIDATE_DIR)
+    candidate_dir = os.path.join(candidate_root, candidate['name'])
+    for name in os.listdir(candidate_dir):
+        if name != RESULT_FILE:
+            shutil.move(os.path.join(candidate_dir, name), os.path.join(model_dir, name))
+    shutil.rmtree(candidate_root, ignore_errors=True)
+
+    manifest = dict(model_type=candidate['model_type'],
+                    candidate=candidate['name'],
+                    window=candidate['window'],
+                    mean_absolute_percentage_error=results[candidate['name']],
+                    candidates={name: score(mape) for name, mape in results.items()})
+    with open(os.path.join(model_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+# Return: the manifest of the model in model_dir, a LSTM manifest for models trained before manifests
+def load_manifest(model_dir):
+    try:
+        with open(os.path.join(model_dir, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict(model_type=ModelType.LSTM.name)
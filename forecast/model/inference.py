@@ -3,12 +3,24 @@ from common.util.fill_type import Fill
 # from Algorithms.forecast.models.automl import AutoML
 from forecast.util.forecast_factor import ForecastFactor
 from forecast.util.lstm import LSTMModel
+from forecast.model.candidates import load_manifest, UNIVARIATE_MODELS
 from forecast.util.model_type import ModelType
 from forecast.util.multivariate import MultivariateData
 # from Algorithms.forecast.models.prophet import ProphetModel
 
+from telemetry import log
+
+# Load the trained model, the model type comes from the manifest in model_dir
+# Return:
+#   model: the model
+#   window: the input window of the model
 def load_inference_model(model_dir, target_size,
               window, metric_sender, epoc, validation_freq, validation_ratio):
+    manifest = load_manifest(model_dir)
+    if manifest['model_type'] in UNIVARIATE_MODELS:
+        model = UNIVARIATE_MODELS[manifest['model_type']].load_model(model_dir)
+        return model, manifest['window']
+
     meta = LSTMModel.load_model_meta(model_dir)
     window = meta['window']
     model = LSTMModel(num_hidden=meta['num_hidden'], window=meta['window'],
@@ -32,3 +44,22 @@ def load_inference_input_data(target_series, factor_series, model, gran, custom_
 
 def inference(input_data: MultivariateData, window, timestamp, target_size, model):
     return model.inference(input_data=input_data, window=window, timestamp=timestamp, target_size=target_size)
+
+# Forecast at all timestamps with one predict call. If the batch fails, e.g. on a bad window, the
+# timestamps are forecasted one by one, so only the timestamps which fail on their own are lost
+# Return:
+#   an array of forecast items for each timestamp, empty for a timestamp which failed
+def batch_inference(input_data: MultivariateData, window, timestamps, target_size, model):
+    try:
+        return model.batch_inference(input_data=input_data, window=window, timestamps=timestamps, target_size=target_size)
+    except Exception as e:
+        log.error("Batch inference of %d timestamps failed, inference one by one, exception: %s" % (len(timestamps), str(e)))
+
+    results = []
+    for timestamp in timestamps:
+        try:
+            results.append(inference(input_data=input_data, window=window, timestamp=timestamp, target_size=target_size, model=model))
+        except Exception as e:
+            log.error("-------Inference exception------- at %s, %s" % (str(timestamp), str(e)))
+            results.append([])
+    return results
@@ -1,45 +1,37 @@
 from common.util.fill_type import Fill
-from forecast.util.forecast_factor import ForecastFactor
-from forecast.util.lstm import LSTMModel
-from forecast.util.model_type import ModelType
-from forecast.util.multivariate import MultivariateData
-from forecast.util.univariate import UnivariateData
-from forecast.util.util import get_max_horizon, get_max_lag
+from forecast.model.candidates import get_candidates, requires_factors, build_train_data, train_candidates
+from forecast.model.candidates import publish_candidate, score, DEFAULT_TIME_BUDGET
+from forecast.util.validation import get_validation_start
 
+from telemetry import log
+
+# Train the candidate models of the instance within max_cores and time_budget, and keep the best one
+# by validation MAPE in model_dir
+# Return:
+#   window: the input window of the chosen model
+#   manifest: the manifest of the chosen model, see candidates.publish_candidate
 def train(target_series, factor_series, window, model_dir, timestamp, future_target_size,
-          gran, custom_in_seconds, max_cores, metric_sender, epoc, batch_size, steps_per_epoc, validation_freq, validation_ratio, num_hidden, fill_type: Fill, fill_value):
-    train_data = MultivariateData(target_series, [ForecastFactor(x) for x in factor_series],
-                                  gran=gran, custom_in_seconds=custom_in_seconds, fill_type=fill_type,
-                                  fill_value=fill_value)
-    if len(train_data.get_effective_factor()) == 0:
-        models = [ModelType.AutoMLNoLags]
-    else:
-        models = [ModelType.LSTM]
+          gran, custom_in_seconds, max_cores, metric_sender, epoc, batch_size, steps_per_epoc, validation_freq, validation_ratio, num_hidden, fill_type: Fill, fill_value,
+          time_budget=DEFAULT_TIME_BUDGET):
+    settings = dict(timestamp=timestamp, future_target_size=future_target_size, gran=gran,
+                    custom_in_seconds=custom_in_seconds, epoc=epoc, batch_size=batch_size,
+                    steps_per_epoc=steps_per_epoc, validation_freq=validation_freq,
+                    validation_ratio=validation_ratio, fill_type=fill_type, fill_value=fill_value)
+    train_data = build_train_data(target_series, factor_series, settings)
+    # every candidate validates the forecasts from the same timestamp, so their MAPE are compared
+    settings['validation_start'] = get_validation_start(train_data, future_target_size, validation_ratio)
 
-    trained_models = {}
-    for model_type in models:
-        model = None
-        if model_type == ModelType.LSTM:
-            model = LSTMModel(num_hidden=num_hidden,
-                              window=window, end_time=timestamp, validation_ratio=validation_ratio,
-                              validation_freq=validation_freq, future_target_size=future_target_size,
-                              effective_factor=train_data.get_effective_factor(), metric_sender=metric_sender, epoc=epoc)
-            model.train(input_data=train_data, batch_size=batch_size,
-                        steps_per_epoc=steps_per_epoc)
-        model.save_model(model_dir)
-        trained_models[model_type] = model
+    candidates = get_candidates(num_hidden, window)
+    if len(train_data.get_effective_factor()) == 0:
+        candidates = [c for c in candidates if not requires_factors(c)]
 
-    best_model_type = None
-    best_mean_absolute_percentage_error = None
-    for model_type in trained_models.keys():
-        mean_absolute_percentage_error = trained_models[model_type].get_mean_absolute_percentage_error()
-        if best_model_type is None:
-            best_model_type = model_type
-            best_mean_absolute_percentage_error = mean_absolute_percentage_error
-        elif best_mean_absolute_percentage_error > mean_absolute_percentage_error:
-            best_mean_absolute_percentage_error = mean_absolute_percentage_error
-            best_model_type = model_type
+    results = train_candidates(candidates, target_series, factor_series, train_data, settings, model_dir,
+                               max_cores, time_budget, metric_sender)
+    if len(results) == 0:
+        raise Exception('No candidate model is trained.')
 
-    best_model = trained_models[best_model_type]
+    best_model = min([c for c in candidates if c['name'] in results], key=lambda c: score(results[c['name']]))
+    manifest = publish_candidate(best_model, results, model_dir)
+    log.info("Candidate %s is chosen, %s" % (best_model['name'], manifest['candidates']))
 
-    return window, best_model
+    return best_model['window'], manifest
@@ -8,7 +8,7 @@ environ['SERVICE_CONFIG_FILE'] = 'forecast/config/service_config.yaml'
 
 from forecast.forecast_plugin_service import ForecastPluginService
 from common.plugin_model_api import api, PluginModelAPI, PluginModelListAPI, PluginModelTrainAPI, \
-    PluginModelInferenceAPI, app, PluginModelParameterAPI
+    PluginModelInferenceAPI, app, PluginModelParameterAPI, PluginModelStatsAPI
 
 forecast = ForecastPluginService()
 
@@ -17,6 +17,7 @@ api.add_resource(PluginModelAPI, '/forecast/models/<model_id>', resource_class_k
 api.add_resource(PluginModelTrainAPI, '/forecast/models/train', resource_class_kwargs={'plugin_service': forecast})
 api.add_resource(PluginModelInferenceAPI, '/forecast/models/<model_id>/inference', resource_class_kwargs={'plugin_service': forecast})
 api.add_resource(PluginModelParameterAPI, '/forecast/parameters', resource_class_kwargs={'plugin_service': forecast})
+api.add_resource(PluginModelStatsAPI, '/forecast/stats', resource_class_kwargs={'plugin_service': forecast})
 
 if __name__ == '__main__':
     HOST = environ.get('SERVER_HOST', '0.0.0.0')
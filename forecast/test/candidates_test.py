@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from common.util.fill_type import Fill
+from common.util.gran import Gran
+from common.util.series import Series
+from forecast.model.candidates import get_candidates, train_candidates, publish_candidate, load_manifest
+from forecast.model.candidates import build_train_data, CANDIDATE_DIR, MANIFEST_FILE
+from forecast.model.training import train
+from forecast.util.model_type import ModelType
+from forecast.util.validation import get_validation_start
+
+START = np.datetime64('2020-01-01T00:00:00', 'ns')
+DAY = np.timedelta64(1, 'D')
+WINDOW = 6
+TARGET = 3
+
+
+def weekly_series(weeks=20):
+    values = 10 + np.tile(np.arange(7.0), weeks) + np.random.RandomState(0).rand(weeks * 7)
+    return Series.from_arrays('m', 's', {}, (START + np.arange(len(values)) * DAY).view(np.int64), values)
+
+
+def get_settings(target):
+    settings = dict(timestamp=None, future_target_size=TARGET, gran=Gran.Daily, custom_in_seconds=0, epoc=1,
+                    batch_size=8, steps_per_epoc=2, validation_freq=1, validation_ratio=0.2,
+                    fill_type=Fill.Linear, fill_value=0)
+    settings['validation_start'] = get_validation_start(build_train_data(target, [], settings), TARGET, 0.2)
+    return settings
+
+
+class CandidatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.target = weekly_series()
+        self.settings = get_settings(self.target)
+        self.train_data = build_train_data(self.target, [], self.settings)
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir, ignore_errors=True)
+
+    def train_candidates(self, candidates, max_cores, time_budget=60):
+        return train_candidates(candidates, self.target, [], self.train_data, self.settings, self.model_dir,
+                                max_cores, time_budget)
+
+    def test_baselines_are_trained(self):
+        candidates = [c for c in get_candidates(8, WINDOW) if c['model_type'] != ModelType.LSTM.name]
+        results = self.train_candidates(candidates, max_cores=1)
+        self.assertEqual(sorted(results), ['exponential-smoothing', 'seasonal-naive'])
+        for name, mape in results.items():
+            self.assertEqual(len(mape), TARGET)
+            self.assertTrue(os.listdir(os.path.join(self.model_dir, CANDIDATE_DIR, name)))
+
+    def fake_train(self, trained):
+        def train_candidate(candidate, train_data, settings, model_dir, metric_sender=None):
+            trained.append(candidate['name'])
+            os.makedirs(model_dir, exist_ok=True)
+            return [0.1] * TARGET
+        return train_candidate
+
+    def test_one_lstm_on_one_core(self):
+        trained = []
+        with mock.patch('forecast.model.candidates.train_candidate', side_effect=self.fake_train(trained)):
+            results = self.train_candidates(get_candidates(8, WINDOW), max_cores=1)
+        self.assertEqual(trained, ['seasonal-naive', 'exponential-smoothing', 'lstm'])
+        self.assertEqual(sorted(results), ['exponential-smoothing', 'lstm', 'seasonal-naive'])
+
+    def test_spent_budget_stops_the_lstm(self):
+        trained = []
+        with mock.patch('forecast.model.candidates.train_candidate', side_effect=self.fake_train(trained)):
+            results = self.train_candidates(get_candidates(8, WINDOW), max_cores=1, time_budget=0)
+        self.assertNotIn('lstm', trained)
+        self.assertEqual(sorted(results), ['exponential-smoothing', 'seasonal-naive'])
+
+    def test_publish_candidate(self):
+        candidates = [c for c in get_candidates(8, WINDOW) if c['model_type'] != ModelType.LSTM.name]
+        results = self.train_candidates(candidates, max_cores=1)
+        chosen = candidates[1]
+        files = os.listdir(os.path.join(self.model_dir, CANDIDATE_DIR, chosen['name']))
+
+        manifest = publish_candidate(chosen, results, self.model_dir)
+        self.assertEqual(sorted(os.listdir(self.model_dir)), sorted(files + [MANIFEST_FILE]))
+        self.assertEqual((manifest['model_type'], manifest['candidate'], manifest['window']),
+                         (ModelType.ExponentialSmoothing.name, chosen['name'], WINDOW))
+        self.assertEqual(sorted(manifest['candidates']), sorted(results))
+        self.assertEqual(load_manifest(self.model_dir), json.loads(json.dumps(manifest)))
+
+    def test_model_without_manifest_is_lstm(self):
+        self.assertEqual(load_manifest(self.model_dir), dict(model_type=ModelType.LSTM.name))
+
+    def test_train_without_factors(self):
+        window, manifest = train(self.target, [], WINDOW, self.model_dir, None, TARGET, Gran.Daily, 0, 1, None,
+                                 epoc=1, batch_size=8, steps_per_epoc=2, validation_freq=1, validation_ratio=0.2,
+                                 num_hidden=8, fill_type=Fill.Linear, fill_value=0)
+        self.assertEqual(window, WINDOW)
+        self.assertEqual(sorted(manifest['candidates']), ['exponential-smoothing', 'seasonal-naive'])
+        self.assertEqual(manifest['candidate'], min(manifest['candidates'], key=manifest['candidates'].get))
+        self.assertFalse(os.path.exists(os.path.join(self.model_dir, CANDIDATE_DIR)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from common.util.fill_type import Fill
+from common.util.gran import Gran
+from common.util.series import Series
+from forecast.util.exponential_smoothing import ExponentialSmoothingModel, smooth, forecast
+from forecast.util.multivariate import MultivariateData
+from forecast.util.univariate_forecast_item import FORECAST_VALUE
+
+START = np.datetime64('2020-01-01T00:00:00', 'ns')
+DAY = np.timedelta64(1, 'D')
+PATTERN = np.array([3.0, 5.0, 4.0, 6.0, 8.0, 2.0, 1.0])
+TARGET = 3
+
+
+def daily_data(values, first=0):
+    stamps = START + (first + np.arange(len(values))) * DAY
+    target = Series.from_arrays('m', 's', {}, stamps.view(np.int64), values)
+    return MultivariateData(target, [], Gran.Daily, 0, fill_type=Fill.Linear)
+
+
+def to_datetime(day):
+    return pd.Timestamp(START + day * DAY).to_pydatetime()
+
+
+def weekly(first, count, slope=0.0):
+    days = np.arange(first, first + count)
+    return 10 + PATTERN[days % 7] + slope * days
+
+
+def parameters(alpha=0.5, beta=0.1, gamma=0.1, phi=0.98):
+    return [np.array([x]) for x in (alpha, beta, gamma, phi)]
+
+
+class SmoothTest(unittest.TestCase):
+
+    def test_constant(self):
+        level, trend, seasonal = smooth(np.full(20, 5.0), 1, *parameters())
+        np.testing.assert_allclose(level[:, 0], 5.0)
+        np.testing.assert_allclose(trend[:, 0], 0.0)
+        predicted = forecast(level, trend, seasonal, 1, parameters()[3], np.array([5, 19]), TARGET)
+        np.testing.assert_allclose(predicted, 5.0)
+
+    def test_season(self):
+        values = weekly(0, 70)
+        level, trend, seasonal = smooth(values, 7, *parameters())
+        predicted = forecast(level, trend, seasonal, 7, parameters()[3], np.array([40, 59]), 10)[:, :, 0]
+        np.testing.assert_allclose(predicted, [values[41:51], values[60:70]], atol=1e-6)
+
+    def test_missing_points_keep_the_state(self):
+        values = np.full(10, 5.0)
+        values[4:7] = np.nan
+        level, trend, _ = smooth(values, 1, *parameters())
+        np.testing.assert_allclose(level[:, 0], 5.0)
+
+    def test_continue_from_state(self):
+        values = weekly(0, 70, slope=0.1)
+        level, trend, seasonal = smooth(values, 7, *parameters())
+        state = dict(level=level[49, 0], trend=trend[49, 0], seasonal=seasonal[50: 57, 0])
+        continued = smooth(values[50:], 7, *parameters(), state=state)
+        np.testing.assert_allclose(continued[0], level[50:])
+        np.testing.assert_allclose(continued[1], trend[50:])
+        np.testing.assert_allclose(continued[2], seasonal[50:])
+
+
+class ExponentialSmoothingModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir, ignore_errors=True)
+
+    def trained(self, values):
+        model = ExponentialSmoothingModel.create(14, None, TARGET, 0.2, Gran.Daily, 0)
+        model.train(daily_data(values))
+        model.save_model(self.model_dir)
+        return ExponentialSmoothingModel.load_model(self.model_dir)
+
+    def test_train(self):
+        model = self.trained(weekly(0, 140))
+        self.assertEqual(model.get_season(), 7)
+        np.testing.assert_allclose(model.get_mean_absolute_percentage_error(), 0.0, atol=1e-6)
+        self.assertEqual(os.listdir(self.model_dir), ['ExponentialSmoothing-Meta.pkl'])
+
+    def test_short_data_has_no_season(self):
+        self.assertEqual(self.trained(weekly(0, 10)).get_season(), 1)
+
+    def test_inference_continues_from_the_training(self):
+        model = self.trained(weekly(0, 140))
+        # a few points after a gap, less than a season, the season is still forecasted
+        data = daily_data(weekly(150, 4), first=150)
+        results = model.batch_inference(data, 14, [to_datetime(153), to_datetime(160)])
+        np.testing.assert_allclose([[item[FORECAST_VALUE] for item in result] for result in results],
+                                   [weekly(154, TARGET), weekly(161, TARGET)], atol=1e-6)
+
+    def test_inference_before_the_training_end(self):
+        model = self.trained(weekly(0, 140))
+        data = daily_data(weekly(100, 30), first=100)
+        results = model.batch_inference(data, 14, [to_datetime(120), to_datetime(150)])
+        np.testing.assert_allclose([[item[FORECAST_VALUE] for item in result] for result in results],
+                                   [weekly(121, TARGET), weekly(151, TARGET)], atol=1e-6)
+
+    def test_model_without_state(self):
+        model = ExponentialSmoothingModel(7, 14, None, TARGET, 0.2, dict(alpha=0.5, beta=0.0, gamma=0.0, phi=0.98),
+                                          [0.1] * TARGET)
+        results = model.batch_inference(daily_data(weekly(100, 30), first=100), 14, [to_datetime(120)])
+        np.testing.assert_allclose([item[FORECAST_VALUE] for item in results[0]], weekly(121, TARGET), atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from common.util.constant import STATUS_SUCCESS, TIMESTAMP
+from common.util.modelregistry import ModelRegistry
+from common.util.series import Series
+from forecast.forecast_plugin_service import ForecastPluginService
+from forecast.model.candidates import MANIFEST_FILE
+from forecast.util.model_type import ModelType
+from forecast.util.seasonal_naive import SeasonalNaiveModel
+from forecast.util.univariate_forecast_item import FORECAST_VALUE
+
+START = np.datetime64('2020-01-01T00:00:00', 'ns')
+DAY = np.timedelta64(1, 'D')
+PATTERN = np.array([3.0, 5.0, 4.0, 6.0, 8.0, 2.0, 1.0])
+TARGET = 3
+
+
+def weekly(days):
+    return 10 + PATTERN[np.asarray(days) % 7]
+
+
+def to_day(timestamp):
+    return int((np.datetime64(pd.Timestamp(timestamp).tz_localize(None), 'ns') - START) // DAY)
+
+
+# Daily points of a weekly pattern, the target is shifted by offset as the TSANA client does
+class FakeTSANAClient():
+    def __init__(self):
+        self.calls = []
+        self.saved = None
+
+    def get_metric_meta(self, api_key, metric_id):
+        return dict(granularityName='Daily', granularityAmount=0)
+
+    def get_timeseries(self, api_key, series_sets, start_time, end_time, offset=0, granularityName=None,
+                       granularityAmount=0):
+        self.calls.append((series_sets[0].get('metricId'), offset, granularityName))
+        if series_sets[0].get('metricId') != 'target':
+            return []
+        days = np.arange(to_day(start_time), to_day(end_time))
+        stamps = START + (days + offset) * DAY
+        return [Series.from_arrays('target', 's', {}, stamps.view(np.int64), weekly(days))]
+
+    def save_inference_result(self, parameters, result):
+        self.saved = result
+        return STATUS_SUCCESS, ''
+
+
+class DoInferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        SeasonalNaiveModel(7, 6, None, TARGET, 0.2, [0.1] * TARGET).save_model(self.model_dir)
+        with open(os.path.join(self.model_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(dict(model_type=ModelType.SeasonalNaive.name, window=6), f)
+
+        self.service = ForecastPluginService.__new__(ForecastPluginService)
+        self.service.tsanaclient = FakeTSANAClient()
+        self.service.config = SimpleNamespace(lstm=dict(epoc=1, validation_freq=1, validation_ratio=0.2))
+        self.service.model_registry = ModelRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir, ignore_errors=True)
+
+    def inference(self, **params):
+        params = dict(dict(windowSize=6, target=dict(metricId='target'), step=TARGET, fill='Linear'), **params)
+        parameters = dict(apiKey='key', endTime='2020-05-01T00:00:00Z', seriesSets=[dict(metricId='factor')],
+                          instance=dict(params=params))
+        self.assertEqual(self.service.do_inference('sub', 'model', self.model_dir, parameters)[0], STATUS_SUCCESS)
+        return self.service.tsanaclient.saved
+
+    def assert_forecast(self, result):
+        self.assertEqual(len(result), TARGET)
+        days = [to_day(item[TIMESTAMP]) for item in result]
+        # the value forecasted at a timestamp is the point after it, whatever the offset of the target
+        np.testing.assert_allclose([item[FORECAST_VALUE] for item in result], weekly(np.array(days) + 1))
+
+    def test_without_offset(self):
+        self.assert_forecast(self.inference())
+
+    def test_target_is_fetched_with_the_offset(self):
+        result = self.inference(target_offset=2)
+        self.assertIn(('target', 2, 'Daily'), self.service.tsanaclient.calls)
+        self.assert_forecast(result)
+
+    def test_univariate_model_fetches_two_seasons(self):
+        self.inference(windowSize=2)
+        self.assert_forecast(self.service.tsanaclient.saved)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from forecast.model.inference import batch_inference
+
+
+# A model whose batch fails on a bad window, and whose single inference fails only at that window
+class FakeModel():
+    def __init__(self, bad_timestamp=None):
+        self.bad_timestamp = bad_timestamp
+        self.batches = 0
+
+    def batch_inference(self, input_data, window, timestamps, target_size):
+        self.batches += 1
+        if self.bad_timestamp in timestamps:
+            raise ValueError('bad window')
+        return [self.inference(input_data, window, timestamp, target_size) for timestamp in timestamps]
+
+    def inference(self, input_data, window, timestamp, target_size):
+        if timestamp == self.bad_timestamp:
+            raise ValueError('bad window')
+        return [dict(timestamp=timestamp, value=float(step)) for step in range(target_size)]
+
+
+class BatchInferenceTest(unittest.TestCase):
+
+    def test_one_batch(self):
+        model = FakeModel()
+        results = batch_inference(None, 3, [1, 2, 3], 2, model)
+        self.assertEqual(model.batches, 1)
+        self.assertEqual([len(r) for r in results], [2, 2, 2])
+
+    def test_bad_window_loses_only_its_timestamp(self):
+        model = FakeModel(bad_timestamp=2)
+        results = batch_inference(None, 3, [1, 2, 3], 2, model)
+        self.assertEqual([len(r) for r in results], [2, 0, 2])
+        self.assertEqual([r[0]['timestamp'] for r in results if len(r) > 0], [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from forecast.util.lstm_runtime import LSTMRuntime
+
+WINDOW = 7
+FACTORS = 3
+UNITS = 5
+TARGET = 4
+
+
+def random_runtime(seed, **kwargs):
+    rng = np.random.RandomState(seed)
+    return LSTMRuntime(rng.randn(FACTORS, UNITS * 4), rng.randn(UNITS, UNITS * 4), rng.randn(UNITS * 4),
+                       rng.randn(UNITS, TARGET), rng.randn(TARGET), **kwargs)
+
+
+class LSTMRuntimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.batch = np.random.RandomState(1).randn(6, WINDOW, FACTORS).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir, ignore_errors=True)
+
+    def test_save_and_load(self):
+        runtime = random_runtime(0, recurrent_activation='hard_sigmoid', dense_activation='relu')
+        path = os.path.join(self.model_dir, 'weights.npz')
+        runtime.save(path)
+        np.testing.assert_array_equal(LSTMRuntime.load(path).predict(self.batch), runtime.predict(self.batch))
+
+    def test_unknown_activation_fails_on_load(self):
+        with self.assertRaises(Exception):
+            random_runtime(0, activation='selu')
+
+    @unittest.skipUnless(importlib.util.find_spec('tensorflow') is not None, 'tensorflow is not installed')
+    def test_same_as_keras(self):
+        import tensorflow as tf
+        tf.random.set_seed(0)
+        model = tf.keras.Sequential([
+            tf.keras.Input(shape=(WINDOW, FACTORS)),
+            tf.keras.layers.LSTM(UNITS, recurrent_activation='sigmoid'),
+            tf.keras.layers.Dense(TARGET)
+        ])
+        # non zero biases, so the gate order of the bias is checked too
+        lstm, dense = model.layers
+        lstm.set_weights([w + 0.1 * np.random.RandomState(idx).randn(*w.shape)
+                          for idx, w in enumerate(lstm.get_weights())])
+        dense.set_weights([w + 0.1 for w in dense.get_weights()])
+
+        runtime = LSTMRuntime.from_keras(model)
+        np.testing.assert_allclose(runtime.predict(self.batch), model.predict(self.batch, verbose=0),
+                                   rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
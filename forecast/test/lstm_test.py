@@ -0,0 +1,44 @@
+import importlib.util
+import unittest
+
+import numpy as np
+
+from forecast.util.lstm import window_dataset
+from forecast.util.multivariate import MultivariateData
+
+WINDOW = 6
+TARGET = 3
+
+
+@unittest.skipUnless(importlib.util.find_spec('tensorflow') is not None, 'tensorflow is not installed')
+class WindowDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        import tensorflow as tf
+        rng = np.random.RandomState(0)
+        self.train = rng.rand(40, 2).astype(np.float32)
+        self.label = rng.rand(40).astype(np.float32)
+        self.tensors = (tf.constant(self.train), tf.constant(self.label))
+        self.windows, self.labels = MultivariateData.get_windows(WINDOW, TARGET, self.label, self.train)
+
+    def collect(self, dataset):
+        batches = list(dataset.as_numpy_iterator())
+        return np.concatenate([x for x, _ in batches]), np.concatenate([y for _, y in batches]), batches
+
+    def test_windows_are_get_windows(self):
+        windows, labels, batches = self.collect(window_dataset(*self.tensors, WINDOW, TARGET, 4, 20, 5))
+        self.assertEqual([len(x) for x, _ in batches], [5, 5, 5, 1])
+        np.testing.assert_array_equal(windows, self.windows[4:20])
+        np.testing.assert_array_equal(labels, self.labels[4:20])
+
+    def test_shuffle_keeps_the_windows(self):
+        windows, labels, _ = self.collect(window_dataset(*self.tensors, WINDOW, TARGET, 0, len(self.labels), 8,
+                                                         shuffle=True))
+        order = np.lexsort(windows[:, :, 0].T[::-1])
+        expected = np.lexsort(self.windows[:, :, 0].T[::-1])
+        np.testing.assert_array_equal(windows[order], self.windows[expected])
+        np.testing.assert_array_equal(labels[order], self.labels[expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
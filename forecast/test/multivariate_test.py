@@ -0,0 +1,88 @@
+import unittest
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from common.util.constant import TIMESTAMP
+from forecast.util.multivariate import MultivariateData
+from forecast.util.window import FactorWindows, sliding_window
+
+
+def frame(name, days, seed):
+    rng = np.random.RandomState(seed)
+    timestamps = pd.to_datetime('2020-01-01') + pd.to_timedelta(days, unit='D')
+    return pd.DataFrame({TIMESTAMP: timestamps, name: rng.rand(len(days))})
+
+
+def merged(frames, how):
+    result = reduce(lambda left, right: pd.merge(left, right, on=TIMESTAMP, how=how), frames)
+    return result.sort_values(TIMESTAMP).reset_index(drop=True)
+
+
+class AlignFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        # unsorted, gaps in every frame, and timestamps only some frames have
+        self.frames = [frame('a', [5, 0, 1, 2, 3, 7], 0),
+                       frame('b', [1, 2, 4, 5, 9], 1),
+                       frame('c', [2, 0, 5, 1, 8, 6], 2)]
+
+    def assert_same(self, actual, expected):
+        self.assertEqual(list(actual.columns), list(expected.columns))
+        np.testing.assert_array_equal(actual[TIMESTAMP].values.astype('datetime64[ns]'),
+                                      expected[TIMESTAMP].values.astype('datetime64[ns]'))
+        np.testing.assert_array_equal(actual.drop(columns=[TIMESTAMP]).values.astype(np.float64),
+                                      expected.drop(columns=[TIMESTAMP]).values.astype(np.float64))
+
+    def test_outer_is_merge_outer(self):
+        self.assert_same(MultivariateData.align_frames(self.frames, outer=True), merged(self.frames, 'outer'))
+
+    def test_inner_is_merge_inner(self):
+        self.assert_same(MultivariateData.align_frames(self.frames, outer=False), merged(self.frames, 'inner'))
+
+    def test_single_frame(self):
+        self.assert_same(MultivariateData.align_frames(self.frames[:1], outer=True), merged(self.frames[:1], 'outer'))
+
+    def test_no_frame(self):
+        self.assertEqual(list(MultivariateData.align_frames([], outer=True).columns), [TIMESTAMP])
+
+
+class WindowsTest(unittest.TestCase):
+
+    def test_get_windows_is_the_copied_windows(self):
+        rng = np.random.RandomState(0)
+        for length in [0, 5, 9, 10, 40]:
+            train = rng.rand(length, 3)
+            label = rng.rand(length)
+            batch_train, batch_labels = MultivariateData.get_windows(6, 4, label, train)
+
+            expected_train = [train[i: i + 6] for i in range(0, length - (6 + 4) + 1)]
+            expected_labels = [label[i: i + 4] for i in range(6, length - 4 + 1)]
+            self.assertEqual(len(batch_train), len(expected_train))
+            self.assertEqual(len(batch_labels), len(expected_labels))
+            self.assertEqual(batch_train.shape[1:], (6, 3))
+            for actual, expected in zip(batch_train, expected_train):
+                np.testing.assert_array_equal(actual, expected)
+            for actual, expected in zip(batch_labels, expected_labels):
+                np.testing.assert_array_equal(actual, expected)
+            self.assertFalse(batch_train.flags.writeable)
+
+    def test_factor_windows_take(self):
+        timestamps = (np.datetime64('2020-01-01', 'ns') + np.arange(10) * np.timedelta64(1, 'D'))
+        values = np.arange(20, dtype=np.float64).reshape(10, 2)
+        windows = FactorWindows(timestamps, values, 3, timestamps[0], timestamps[-1])
+
+        # a window ends at the last row not after the timestamp
+        ends = np.array([timestamps[1], timestamps[2], timestamps[5] + np.timedelta64(12, 'h'), timestamps[9]])
+        indices, batch = windows.take(ends)
+        np.testing.assert_array_equal(indices, [1, 2, 3])
+        for idx, window in zip(indices, batch):
+            np.testing.assert_array_equal(window, windows.get(ends[idx]))
+        np.testing.assert_array_equal(batch[1], values[3: 6])
+        self.assertIsNone(windows.get(timestamps[1]))
+        np.testing.assert_array_equal(sliding_window(values, 3)[7], values[7:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from common.util.fill_type import Fill
+from common.util.gran import Gran
+from common.util.series import Series
+from forecast.util.multivariate import MultivariateData
+from forecast.util.seasonal_naive import SeasonalNaiveModel
+from forecast.util.univariate_forecast_item import FORECAST_VALUE
+
+START = np.datetime64('2020-01-01T00:00:00', 'ns')
+DAY = np.timedelta64(1, 'D')
+PATTERN = np.array([3.0, 5.0, 4.0, 6.0, 8.0, 2.0, 1.0])
+TARGET = 3
+
+
+def daily_data(values, first=0):
+    stamps = START + (first + np.arange(len(values))) * DAY
+    target = Series.from_arrays('m', 's', {}, stamps.view(np.int64), values)
+    return MultivariateData(target, [], Gran.Daily, 0, fill_type=Fill.Linear)
+
+
+def to_datetime(day):
+    return pd.Timestamp(START + day * DAY).to_pydatetime()
+
+
+def weekly(first, count):
+    return 10 + PATTERN[np.arange(first, first + count) % 7]
+
+
+class SeasonalNaiveModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir, ignore_errors=True)
+
+    def trained(self, values):
+        model = SeasonalNaiveModel.create(14, None, TARGET, 0.2, Gran.Daily, 0)
+        model.train(daily_data(values))
+        model.save_model(self.model_dir)
+        return SeasonalNaiveModel.load_model(self.model_dir)
+
+    def test_train(self):
+        model = self.trained(weekly(0, 70))
+        self.assertEqual(model.get_season(), 7)
+        np.testing.assert_allclose(model.get_mean_absolute_percentage_error(), 0.0)
+        self.assertEqual(os.listdir(self.model_dir), ['SeasonalNaive-Meta.pkl'])
+
+    def test_train_error(self):
+        values = weekly(0, 70)
+        values[-5:] *= 2
+        mape = self.trained(values).get_mean_absolute_percentage_error()
+        self.assertTrue(np.all(np.asarray(mape) > 0))
+
+    def test_not_enough_data(self):
+        with self.assertRaises(Exception):
+            self.trained(weekly(0, 8))
+
+    def test_batch_inference(self):
+        model = self.trained(weekly(0, 70))
+        results = model.batch_inference(daily_data(weekly(100, 20), first=100), 14,
+                                        [to_datetime(105), to_datetime(110), to_datetime(119)])
+        # a season of data is needed before the timestamp
+        self.assertEqual(results[0], [])
+        np.testing.assert_allclose([[item[FORECAST_VALUE] for item in result] for result in results[1:]],
+                                   [weekly(111, TARGET), weekly(120, TARGET)])
+        self.assertEqual(len(model.inference(daily_data(weekly(100, 20), first=100), 14, None)), TARGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+
+from common.util.fill_type import Fill
+from common.util.gran import Gran
+from common.util.series import Series
+from forecast.util.multivariate import MultivariateData
+from forecast.util.validation import get_validation_start, get_validation_ends, get_mean_absolute_percentage_error
+from forecast.util.validation import MAX_VALIDATION_POINTS
+
+START = np.datetime64('2020-01-01T00:00:00', 'ns')
+DAY = np.timedelta64(1, 'D')
+
+
+def daily_data(values):
+    stamps = START + np.arange(len(values)) * DAY
+    target = Series.from_arrays('m', 's', {}, stamps.view(np.int64), values)
+    return MultivariateData(target, [], Gran.Daily, 0, fill_type=Fill.Linear)
+
+
+class ValidationTest(unittest.TestCase):
+
+    def test_validation_start(self):
+        # 97 points have 3 points after them, the forecasts from the last 9 of them are validated
+        self.assertEqual(get_validation_start(daily_data(np.arange(100.0)), 3, 0.1), START + 89 * DAY)
+
+    def test_validation_start_is_bounded(self):
+        start = get_validation_start(daily_data(np.arange(5000.0)), 3, 0.5)
+        self.assertEqual(start, START + (5000 - 3 - MAX_VALIDATION_POINTS + 1) * DAY)
+
+    def test_missing_points_are_not_counted(self):
+        values = np.arange(100.0)
+        values[90:] = np.nan
+        self.assertEqual(get_validation_start(daily_data(values), 3, 0.1), START + 80 * DAY)
+        with self.assertRaises(Exception):
+            get_validation_start(daily_data(values[:4]), 3, 0.1)
+
+    def test_validation_ends(self):
+        stamps = START + np.arange(100) * DAY
+        ends = get_validation_ends(stamps, 5, 3, START + 89 * DAY)
+        np.testing.assert_array_equal(ends, np.arange(88, 97))
+        # the windows of a longer model cover the same forecasts
+        np.testing.assert_array_equal(get_validation_ends(stamps, 30, 3, START + 89 * DAY), ends)
+        self.assertEqual(len(get_validation_ends(stamps, 5, 3, START + 100 * DAY)), 0)
+
+    def test_mean_absolute_percentage_error(self):
+        predicted = np.array([[1.0, 2.0], [3.0, 4.0]])
+        actual = np.array([[2.0, np.nan], [2.0, 0.0]])
+        np.testing.assert_allclose(get_mean_absolute_percentage_error(predicted, actual), [0.5, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+import itertools
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from forecast.util.model_type import ModelType
+from forecast.util.multivariate import MultivariateData
+from forecast.util.univariate_model import get_filled_values, get_filled_target, to_forecast_items
+from forecast.util.validation import get_validation_start, get_validation_ends, get_mean_absolute_percentage_error
+from forecast.util.util import get_season_length
+
+from common.util.constant import TIMESTAMP
+
+# The smoothing parameters searched in training, every combination is smoothed at once as a column
+ALPHAS = (0.1, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.0, 0.1, 0.3)
+GAMMAS = (0.0, 0.1, 0.3)
+PHIS = (0.8, 0.98)
+
+
+# Additive Holt-Winters smoothing with a damped trend, for a number of parameters at once
+# Parameters:
+#   values: the series, NaN points keep the states of the previous point
+#   season: points in one season, the seasonal states are all 0 when it is 1
+#   alpha, beta, gamma, phi: arrays of the parameters, one column of states for each
+#   state: optional, dict(level, trend, seasonal) of one parameter set after the point before values,
+#       seasonal is the states of the last season, the smoothing continues from it
+# Return:
+#   level, trend: arrays of shape (len(values), parameters), the states after each point
+#   seasonal: an array of shape (len(values) + season, parameters), seasonal[t + season] is the state
+#       after point t, and seasonal[:season] are the initial states
+def smooth(values, season, alpha, beta, gamma, phi, state=None):
+    count = len(values)
+    seasonal = np.zeros((count + season, len(alpha)))
+    level = np.empty((count, len(alpha)))
+    trend = np.empty((count, len(alpha)))
+
+    observed = values[~np.isnan(values)]
+    if state is not None:
+        seasonal[:season] = np.asarray(state['seasonal'])[:, np.newaxis]
+        last_level = np.full(len(alpha), state['level'])
+        last_trend = np.full(len(alpha), state['trend'])
+    elif season > 1 and len(observed) >= season * 2:
+        first = np.nanmean(values[:season]) if np.any(~np.isnan(values[:season])) else observed[0]
+        second = np.nanmean(values[season: season * 2]) if np.any(~np.isnan(values[season: season * 2])) else first
+        seasonal[:season] = np.nan_to_num(values[:season] - first)[:, np.newaxis]
+        last_level = np.full(len(alpha), first - (second - first) / 2)
+        last_trend = np.full(len(alpha), (second - first) / season)
+    else:
+        last_level = np.full(len(alpha), observed[0] if len(observed) > 0 else 0.0)
+        last_trend = np.zeros(len(alpha))
+
+    for t in range(count):
+        last_seasonal = seasonal[t]
+        expected_level = last_level + phi * last_trend
+        if np.isnan(values[t]):
+            level[t] = expected_level
+            trend[t] = phi * last_trend
+            seasonal[t + season] = last_seasonal
+        else:
+            level[t] = alpha * (values[t] - last_seasonal) + (1 - alpha) * expected_level
+            trend[t] = beta * (level[t] - last_level) + (1 - beta) * phi * last_trend
+            seasonal[t + season] = gamma * (values[t] - level[t]) + (1 - gamma) * last_seasonal
+        last_level = level[t]
+        last_trend = trend[t]
+
+    return level, trend, seasonal
+
+
+# Forecast future_target points after each of ends from the smoothed states
+# Return:
+#   an array of shape (len(ends), future_target, parameters)
+def forecast(level, trend, seasonal, season, phi, ends, future_target):
+    steps = np.arange(1, future_target + 1)
+    # phi + phi^2 + ... + phi^h for each step h
+    damping = np.cumsum(np.power(phi[np.newaxis, :], steps[:, np.newaxis]), axis=0)
+    # the latest seasonal state of the phase of each step, observed at or before the end
+    sources = ends[:, np.newaxis] + steps - season * ((steps - 1) // season + 1) + season
+    return level[ends][:, np.newaxis, :] + damping[np.newaxis, :, :] * trend[ends][:, np.newaxis, :] \
+        + seasonal[sources]
+
+
+# Damped additive Holt-Winters forecast of the target, in NumPy. The parameters are picked from a grid
+# by the backtest MAPE of the validated forecasts, all combinations are smoothed in one pass. A model is
+# a handful of numbers: the parameters and the states after the last point of the training, which
+# inference continues to smooth from. It needs no factors, and error bands come from the MAPE of every
+# step as for LSTMModel
+class ExponentialSmoothingModel:
+    def __init__(self, season, window, end_time, future_target_size, validation_ratio, parameters=None,
+                 mean_absolute_percentage_error=None, state=None):
+        self.__season = max(1, season)
+        self.__window = window
+        self.__end_time = end_time
+        self.__future_target = future_target_size
+        self.__validation_ratio = validation_ratio
+        self.__parameters = parameters
+        self.__mean_absolute_percentage_error = mean_absolute_percentage_error
+        self.__state = state
+        self.__fit_model = ModelType.ExponentialSmoothing
+
+    @staticmethod
+    def create(window, end_time, future_target_size, validation_ratio, gran, custom_in_seconds):
+        return ExponentialSmoothingModel(get_season_length(gran, custom_in_seconds), window, end_time,
+                                         future_target_size, validation_ratio)
+
+    # Parameters:
+    #   validation_start: optional, the timestamp the validated forecasts start at, see get_validation_start
+    def train(self, input_data: MultivariateData, validation_start=None, **kwargs):
+        if validation_start is None:
+            validation_start = get_validation_start(input_data, self.__future_target, self.__validation_ratio)
+        stamps, values, actual = get_filled_values(input_data)
+        # without two seasons of data the seasonal states could not be initialized
+        season = self.__season if len(values) >= self.__season * 2 else 1
+        gammas = GAMMAS if season > 1 else (0.0,)
+        grid = np.array(list(itertools.product(ALPHAS, BETAS, gammas, PHIS)), dtype=np.float64)
+        alpha, beta, gamma, phi = grid.T
+
+        ends = get_validation_ends(stamps, 1, self.__future_target, validation_start)
+        if len(ends) == 0:
+            raise Exception('Not enough data to train, {} points for target {}.'.format(len(values),
+                                                                                        self.__future_target))
+
+        level, trend, seasonal = smooth(values, season, alpha, beta, gamma, phi)
+        predicted = forecast(level, trend, seasonal, season, phi, ends, self.__future_target)
+        actual = actual[ends[:, np.newaxis] + 1 + np.arange(self.__future_target)]
+        mean_absolute_percentage_error = get_mean_absolute_percentage_error(predicted, actual[:, :, np.newaxis])
+
+        best = int(np.argmin(mean_absolute_percentage_error.mean(axis=0)))
+        self.__season = season
+        self.__parameters = dict(alpha=alpha[best], beta=beta[best], gamma=gamma[best], phi=phi[best])
+        self.__mean_absolute_percentage_error = mean_absolute_percentage_error[:, best]
+        self.__state = dict(timestamp=stamps[-1], level=level[-1, best], trend=trend[-1, best],
+                            seasonal=seasonal[-season:, best])
+
+    def get_mean_absolute_percentage_error(self):
+        return list(self.__mean_absolute_percentage_error)
+
+    def get_effective_factor(self):
+        return []
+
+    def get_model_type(self):
+        return self.__fit_model
+
+    def get_end_time(self):
+        return self.__end_time
+
+    def get_season(self):
+        return self.__season
+
+    def save_model(self, model_dir):
+        with open(os.path.join(model_dir, 'ExponentialSmoothing-Meta.pkl'), "wb") as f:
+            meta = {
+                'mean_absolute_percentage_error': self.__mean_absolute_percentage_error,
+                'end_time': self.__end_time,
+                'future_target': self.__future_target,
+                'window': self.__window,
+                'season': self.__season,
+                'parameters': self.__parameters,
+                'state': self.__state,
+                'validation_ratio': self.__validation_ratio
+            }
+            pickle.dump(meta, f)
+
+    @staticmethod
+    def load_model(model_dir):
+        with open(os.path.join(model_dir, 'ExponentialSmoothing-Meta.pkl'), "rb") as f:
+            meta = pickle.load(f)
+        return ExponentialSmoothingModel(meta['season'], meta['window'], meta['end_time'], meta['future_target'],
+                                         meta['validation_ratio'], meta['parameters'],
+                                         meta['mean_absolute_percentage_error'], meta.get('state'))
+
+    def inference(self, input_data: MultivariateData, window, timestamp, **kwargs):
+        if timestamp is None:
+            timestamp = pd.Timestamp(input_data.get_target()[TIMESTAMP].max())
+        return self.batch_inference(input_data, window, [timestamp])[0]
+
+    # Forecast at a number of timestamps, the target is smoothed once over the range of all of them.
+    # Timestamps from the end of the training on continue from the states of the training, the points
+    # between are unknown. Earlier ones are smoothed from the data alone
+    # Return:
+    #   an array of forecast items for each timestamp, empty if there is no data before it
+    def batch_inference(self, input_data: MultivariateData, window, timestamps, **kwargs):
+        results = [[] for _ in timestamps]
+        if len(timestamps) == 0 or len(input_data.get_target()) == 0:
+            return results
+
+        state_end = None if self.__state is None else self.__state['timestamp']
+        stamps, values, positions, freq = get_filled_target(input_data, timestamps, state_end)
+        parameters = [np.array([self.__parameters[name]]) for name in ['alpha', 'beta', 'gamma', 'phi']]
+        predicted = np.full((len(timestamps), self.__future_target), np.nan)
+
+        start = len(stamps) if state_end is None else int(np.searchsorted(stamps, state_end))
+        if start < len(stamps) and stamps[start] == state_end:
+            warm = np.nonzero(positions >= start)[0]
+            predicted[warm] = self.__continue(stamps[start + 1:], values[start + 1:], positions[warm] - start,
+                                              input_data, parameters)
+        else:
+            warm = np.empty(0, dtype=np.int64)
+
+        cold = np.setdiff1d(np.nonzero(positions >= 0)[0], warm)
+        if len(cold) > 0:
+            # the seasonal states need two seasons of data, otherwise the level and the trend forecast alone
+            season = self.__season if len(values) >= self.__season * 2 else 1
+            level, trend, seasonal = smooth(values, season, *parameters)
+            predicted[cold] = forecast(level, trend, seasonal, season, parameters[3], positions[cold],
+                                       self.__future_target)[:, :, 0]
+
+        for idx in np.concatenate([warm, cold]):
+            results[idx] = to_forecast_items(timestamps[idx], predicted[idx], self.__mean_absolute_percentage_error,
+                                             freq)
+        return results
+
+    # Forecast from the states of the training
+    # Parameters:
+    #   stamps, values: the filled points after the end of the training
+    #   ends: the last point of each forecast, 0 for the end of the training, i for stamps[i - 1]
+    # Return:
+    #   an array of shape (len(ends), future_target)
+    def __continue(self, stamps, values, ends, input_data, parameters):
+        # the filled values out of the observed range are not known
+        observed = input_data.get_target()[TIMESTAMP].values.astype('datetime64[ns]')
+        values = np.where((stamps >= observed.min()) & (stamps <= observed.max()), values, np.nan)
+        level, trend, seasonal = smooth(values, self.__season, *parameters, state=self.__state)
+        # the states of the end of the training come first, seasonal[i + season] is the state after ends i
+        level = np.concatenate([[[self.__state['level']]], level])
+        trend = np.concatenate([[[self.__state['trend']]], trend])
+        seasonal = np.concatenate([[[np.nan]], seasonal])
+        return forecast(level, trend, seasonal, self.__season, parameters[3], ends, self.__future_target)[:, :, 0]
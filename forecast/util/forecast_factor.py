@@ -8,8 +8,5 @@ class ForecastFactor:
         self.name = series.series_id
         self.metrics = series.metric_id
         self.tags = series.dim
-        self.values = pd.DataFrame(series.value)
-        self.values = self.values[[TIMESTAMP, VALUE]]
-        self.values[TIMESTAMP] = pd.to_datetime(self.values[TIMESTAMP])
-        self.values[TIMESTAMP] = self.values[TIMESTAMP].dt.tz_localize(None)
+        self.values = series.to_frame()
         self.values = self.values.rename(columns={VALUE:  self.name})
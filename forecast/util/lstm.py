@@ -1,23 +1,48 @@
+import math
 import os
 import pickle
 
-from tensorflow import data
-from tensorflow_core.python.keras.layers.core import Dense
-from tensorflow_core.python.keras.layers.recurrent import LSTM
-from tensorflow_core.python.keras.models import Sequential
 import numpy as np
 
 import pandas as pd
 
+from forecast.util.lstm_runtime import LSTMRuntime, WEIGHTS_FILE
 from forecast.util.model_type import ModelType
 from forecast.util.multivariate import MultivariateData
 from forecast.util.univariate_forecast_item import UnivariateForecastItem
+from forecast.util.validation import get_validation_start, get_validation_ends, get_mean_absolute_percentage_error
 
 from common.util.timeutil import get_time_offset, str_to_dt, dt_to_str
 from common.util.timeutil import convert_freq
-from common.util.metric import MetricCollector
 from common.util.constant import TIMESTAMP, VALUE
 
+# Max window start indices held by the shuffle buffer of the training dataset
+SHUFFLE_BUFFER_SIZE = 10000
+
+# A dataset of (windows, labels) batches for the windows starting in [start, end), built on the fly
+# from the matrix, so its memory does not grow with the number of windows. The window starting at i
+# is train[i: i + window], its labels label[i + window: i + window + future_target], as get_windows
+# Parameters:
+#   train, label: tensors of the factor matrix and the target column
+def window_dataset(train, label, window, future_target, start, end, batch_size, shuffle=False):
+    import tensorflow as tf
+    from tensorflow import data
+    window_offsets = tf.range(window, dtype=tf.int64)
+    label_offsets = tf.range(future_target, dtype=tf.int64) + window
+
+    def gather_windows(starts):
+        starts = starts[:, tf.newaxis]
+        return tf.gather(train, starts + window_offsets), tf.gather(label, starts + label_offsets)
+
+    dataset = data.Dataset.range(start, end)
+    if shuffle:
+        dataset = dataset.shuffle(min(end - start, SHUFFLE_BUFFER_SIZE))
+    return dataset.batch(batch_size).map(gather_windows, num_parallel_calls=data.experimental.AUTOTUNE) \
+        .prefetch(data.experimental.AUTOTUNE)
+
+
+# TensorFlow is only imported to train, or to load a model trained before the weights were exported,
+# inference of exported models runs on LSTMRuntime in NumPy
 class LSTMModel:
     def __init__(self, num_hidden, window, end_time, future_target_size, validation_ratio, validation_freq,
                  effective_factor, mean_absolute_percentage_error=None, describe=None, epoc=10, metric_sender=None):
@@ -28,19 +53,37 @@ class LSTMModel:
         self.__mean_absolute_percentage_error = mean_absolute_percentage_error
         self.__end_time = end_time
         self.__effective_factor = effective_factor
-        self.__model = Sequential([
-            LSTM(num_hidden, input_shape=np.zeros((window, len(effective_factor))).shape),
-            Dense(self.__future_target)
-        ])
-        self.__model.compile(optimizer='adam', loss='mean_squared_error')
+        self.__model = None
+        self.__runtime = None
         self.__validation_ratio = validation_ratio
         self.__validation_freq = validation_freq
         self.__fit_model = ModelType.LSTM
         self.__describe = describe
-        self.__metric_collector = MetricCollector(epochs=self.__epochs, metric_sender=metric_sender)
-
-
-    def train(self, input_data: MultivariateData, batch_size, steps_per_epoc):
+        self.__metric_sender = metric_sender
+
+    # The Keras model, built on first use
+    def __get_model(self):
+        if self.__model is None:
+            from tensorflow_core.python.keras.layers.core import Dense
+            from tensorflow_core.python.keras.layers.recurrent import LSTM
+            from tensorflow_core.python.keras.models import Sequential
+            self.__model = Sequential([
+                LSTM(self.__num_hidden, input_shape=(self.__window, len(self.__effective_factor))),
+                Dense(self.__future_target)
+            ])
+            self.__model.compile(optimizer='adam', loss='mean_squared_error')
+        return self.__model
+
+    def __predict(self, batch):
+        if self.__runtime is not None:
+            return self.__runtime.predict(batch)
+        return self.__get_model().predict(batch)
+
+    # Parameters:
+    #   validation_start: optional, the timestamp the validated forecasts start at, see get_validation_start
+    def train(self, input_data: MultivariateData, batch_size, steps_per_epoc, validation_start=None):
+        if validation_start is None:
+            validation_start = get_validation_start(input_data, self.__future_target, self.__validation_ratio)
         input_factors = input_data.generate_outer_join_factors()
         input_factors = MultivariateData.generate_filled_missing_frame(input_factors,
                                                                        input_data.get_gran(),
@@ -55,35 +98,46 @@ class LSTMModel:
         input_factors = merged_input.drop([TIMESTAMP, VALUE], axis=1)
         input_factors = input_factors.reindex(columns=self.__effective_factor)
         self.__describe = merged_input.describe().T
-        train, label = input_data.get_normalized_batch(self.__window, self.__future_target, label=input_target,
-                                                       factors=input_factors)
-        batch_size = int(min(batch_size, max(1, len(train) / steps_per_epoc)))
-        train_multi = data.Dataset.from_tensor_slices((train[: -int(len(train) *
-                                                                    self.__validation_ratio)],
-                                                       label[: -int(len(label) *
-                                                                    self.__validation_ratio)]))
-
-        train_multi = train_multi.cache().shuffle(len(train) * 100).batch(batch_size).repeat()
-
-        val_multi = data.Dataset.from_tensor_slices((train[-int(len(train) *
-                                                                self.__validation_ratio):],
-                                                     label[-int(len(label) *
-                                                                self.__validation_ratio):]))
-        val_multi = val_multi.cache().batch(batch_size).repeat()
-
-        self.__model.fit(train_multi, epochs=self.__epochs, shuffle=False,
+        train, label = input_data.get_normalized_matrix(label=input_target, factors=input_factors)
+        # the window starting at i forecasts from point i + window - 1, windows forecasting from
+        # validation_start on are validated, the ones before are trained on
+        stamps = merged_input[TIMESTAMP].values.astype('datetime64[ns]')
+        ends = get_validation_ends(stamps, self.__window - 1, self.__future_target, validation_start)
+        count = max(0, len(label) - (self.__window + self.__future_target) + 1)
+        validation_count = len(ends)
+        train_count = count - validation_count
+        if train_count < 1 or validation_count < 1:
+            raise Exception('Not enough data to train, {} points for window {} and target {}.'.format(
+                len(label), self.__window, self.__future_target))
+        batch_size = int(min(batch_size, max(1, train_count / steps_per_epoc)))
+        steps_per_epoch = int(math.ceil(train_count / batch_size))
+
+        # Windows are gathered from the matrix batch by batch, only the window start indices are shuffled.
+        # The matrix is copied to TensorFlow once and shared by the datasets
+        import tensorflow as tf
+        train = tf.constant(train, dtype=tf.float32)
+        label = tf.constant(label, dtype=tf.float32)
+        train_multi = window_dataset(train, label, self.__window, self.__future_target, 0, train_count,
+                                     batch_size, shuffle=True).repeat()
+        val_multi = window_dataset(train, label, self.__window, self.__future_target, train_count, count,
+                                   batch_size).repeat()
+
+        from common.util.callback import MetricCollector, FitThroughputCollector
+        metric_collector = MetricCollector(epochs=self.__epochs, metric_sender=self.__metric_sender)
+        self.__get_model().fit(train_multi, epochs=self.__epochs, shuffle=False,
                          validation_data=val_multi,
                          validation_freq=self.__validation_freq,
-                         steps_per_epoch=len(train) * (1 - self.__validation_ratio) / batch_size,
-                         validation_steps=len(train) * self.__validation_ratio / batch_size,
-                         callbacks=[self.__metric_collector]
+                         steps_per_epoch=steps_per_epoch,
+                         validation_steps=int(math.ceil(validation_count / batch_size)),
+                         callbacks=[metric_collector, FitThroughputCollector(steps_per_epoch * batch_size)]
                          )
-        validation_result = self.__model.predict(train[-int(len(train) * self.__validation_ratio):])
-        validation_labels = label[-int(len(label) * self.__validation_ratio):]
-        mean_average_percentage_error = np.abs(validation_result - validation_labels) / np.abs(validation_labels)
-        mean_average_percentage_error[np.isinf(mean_average_percentage_error)] = np.nan
-        mean_average_percentage_error = np.nanmean(mean_average_percentage_error, axis=0)
-        self.__mean_absolute_percentage_error = mean_average_percentage_error
+        # validated on the raw target, as the other candidates of the training
+        validation_result = self.__denormalize(self.__get_model().predict(
+            window_dataset(train, label, self.__window, self.__future_target, train_count, count, batch_size)))
+        target = np.asarray(input_target[VALUE].values, dtype=np.float64)
+        _, validation_labels = MultivariateData.get_windows(self.__window, self.__future_target, target, target)
+        self.__mean_absolute_percentage_error = get_mean_absolute_percentage_error(validation_result,
+                                                                                   validation_labels[train_count:])
 
     def get_mean_absolute_percentage_error(self):
         return list(self.__mean_absolute_percentage_error)
@@ -103,7 +157,8 @@ class LSTMModel:
                 'describe': self.__describe
             }
             pickle.dump(meta, f)
-        self.__model.save_weights(os.path.join(model_dir, self.__fit_model.name))
+        self.__get_model().save_weights(os.path.join(model_dir, self.__fit_model.name))
+        LSTMRuntime.from_keras(self.__get_model()).save(os.path.join(model_dir, WEIGHTS_FILE))
 
     def get_model_type(self):
         return self.__fit_model
@@ -123,53 +178,78 @@ class LSTMModel:
         }
 
     def inference(self, input_data: MultivariateData, window, timestamp, **kwargs):
-        input_factors = input_data.generate_outer_join_factors()
-        if timestamp is None: 
-            ts = input_factors[TIMESTAMP].max() 
-        else:
-            ts = pd.to_datetime(timestamp)
-            ts = ts.tz_localize(None)
-        
-        input_factors = MultivariateData.gen_filled_missing_by_period(input_factors, input_data.get_gran(),
-                                                                      input_data.get_custom_in_seconds(),
-                                                                      end_time=ts,
-                                                                      periods=window,
-                                                                      fill_type=input_data.fill_type,
-                                                                      fill_value=input_data.fill_value
-                                                                      )
-        input_factors = input_factors[self.__effective_factor]
-        input_factors = input_factors.reindex(columns=self.__effective_factor)
-        
-
-        input_factors = input_factors.tail(window)
-        # print(input_factors)
-        for column in self.__effective_factor:
+        ts = None if timestamp is None else pd.to_datetime(timestamp).tz_localize(None)
+        windows = input_data.get_factor_windows(window, ts, ts, normalize=self.__normalize)
+        if ts is None:
+            ts = windows.timestamps[-1]
+            timestamp = pd.Timestamp(ts)
+
+        input_factors = windows.get(ts)
+        if input_factors is None:
+            return []
+        predicted = self.__denormalize(self.__predict(input_factors[np.newaxis]))
+        return self.__to_forecast_items(predicted[0], timestamp, convert_freq(input_data.get_gran(),
+                                                                               input_data.get_custom_in_seconds()))
+
+    # Forecast at a number of timestamps with one predict call. The factors are joined, filled and
+    # normalized once over the range of all windows, and each window is a view into that matrix
+    # Parameters:
+    #   input_data: the factors
+    #   window: number of points in the input window of the model
+    #   timestamps: datetimes to forecast at, the window of a timestamp ends at the last point not after it
+    # Return:
+    #   an array of forecast items for each timestamp, empty if there is no data for its window
+    def batch_inference(self, input_data: MultivariateData, window, timestamps, **kwargs):
+        results = [[] for _ in timestamps]
+        if len(timestamps) == 0:
+            return results
+
+        freq = convert_freq(input_data.get_gran(), input_data.get_custom_in_seconds())
+        ends = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).tz_localize(None)
+        windows = input_data.get_factor_windows(window, ends.min(), ends.max(), normalize=self.__normalize)
+        indices, batch = windows.take(ends.values)
+        if len(indices) == 0:
+            return results
+
+        predicted = self.__denormalize(self.__predict(batch))
+        for idx, row in zip(indices, predicted):
+            results[idx] = self.__to_forecast_items(row, timestamps[idx], freq)
+        return results
+
+    # Scale factor values to [0, 1] by the range seen in training, values out of the range become 0
+    def __normalize(self, values):
+        values = np.array(values, dtype=np.float64)
+        for idx, column in enumerate(self.__effective_factor):
             min_value = self.__describe.loc[column]['min']
             max_value = self.__describe.loc[column]['max']
             if max_value == min_value:
-                input_factors[column] = 0
+                values[:, idx] = 0
             else:
-                input_factors[column] = (input_factors[column] - min_value) / (max_value - min_value)
-        input_factors = input_factors.values
-        input_factors[(input_factors < 0) | (input_factors > 1)] = 0
-        predicted = self.__model.predict(np.array([input_factors]))
-        predicted = predicted.reshape(self.__future_target)
-        predicted = predicted * (self.__describe.loc[VALUE]['max'] -
-                                 self.__describe.loc[VALUE]['min']) + self.__describe.loc[VALUE]['min']
-        target_timestamps = pd.date_range(start=timestamp, periods=self.__future_target,
-                                          freq=convert_freq(input_data.get_gran(),
-                                                            input_data.get_custom_in_seconds()))
-        lower_boundary = [predicted[i] - np.abs(predicted[i]) * self.__mean_absolute_percentage_error[i]
-                          for i in range(0, len(predicted))]
-        upper_boundary = [predicted[i] + np.abs(predicted[i]) * self.__mean_absolute_percentage_error[i]
-                          for i in range(0, len(predicted))]
+                values[:, idx] = (values[:, idx] - min_value) / (max_value - min_value)
+        values[(values < 0) | (values > 1)] = 0
+        return values
+
+    def __denormalize(self, predicted):
+        predicted = predicted.reshape(-1, self.__future_target)
+        return predicted * (self.__describe.loc[VALUE]['max'] -
+                            self.__describe.loc[VALUE]['min']) + self.__describe.loc[VALUE]['min']
+
+    def __to_forecast_items(self, predicted, timestamp, freq):
+        target_timestamps = pd.date_range(start=timestamp, periods=self.__future_target, freq=freq)
+        mean_absolute_percentage_error = np.asarray(self.__mean_absolute_percentage_error)
+        lower_boundary = predicted - np.abs(predicted) * mean_absolute_percentage_error
+        upper_boundary = predicted + np.abs(predicted) * mean_absolute_percentage_error
         return [UnivariateForecastItem(predicted[i], lower_boundary[i], upper_boundary[i],
-                                       (1 - self.__mean_absolute_percentage_error[i]),
+                                       (1 - mean_absolute_percentage_error[i]),
                                        timestamp=target_timestamps[i]).to_dict()
                 for i in range(0, len(predicted))]
 
     def load_model(self, model_dir):
-        self.__model.load_weights(os.path.join(model_dir, self.__fit_model.name))
+        weights_path = os.path.join(model_dir, WEIGHTS_FILE)
+        if os.path.exists(weights_path):
+            self.__runtime = LSTMRuntime.load(weights_path)
+        else:
+            self.__get_model().load_weights(os.path.join(model_dir, self.__fit_model.name))
 
     def get_end_time(self):
         return self.__end_time
@@ -0,0 +1,93 @@
+import numpy as np
+
+# The weights of a trained LSTMModel, exported for inference without TensorFlow
+WEIGHTS_FILE = 'LSTM-Weights.npz'
+
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    # 1 / (1 + exp(-x)) without overflow for large negative x
+    'sigmoid': lambda x: 0.5 * (np.tanh(0.5 * x) + 1),
+    'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0, 1),
+    'relu': lambda x: np.maximum(x, 0),
+    'linear': lambda x: x
+}
+
+
+def get_activation(name):
+    if name not in ACTIVATIONS:
+        raise Exception('Activation {} is not supported.'.format(name))
+    return ACTIVATIONS[name]
+
+
+# Forward pass of the LSTM layer and the Dense layer of LSTMModel in NumPy, the same computation as
+# Keras. Gates are in the Keras order of input, forget, cell and output in the kernels
+class LSTMRuntime:
+    def __init__(self, kernel, recurrent_kernel, bias, dense_kernel, dense_bias, activation='tanh',
+                 recurrent_activation='sigmoid', dense_activation='linear'):
+        self.__kernel = np.asarray(kernel, dtype=np.float32)
+        self.__recurrent_kernel = np.asarray(recurrent_kernel, dtype=np.float32)
+        self.__bias = np.asarray(bias, dtype=np.float32)
+        self.__dense_kernel = np.asarray(dense_kernel, dtype=np.float32)
+        self.__dense_bias = np.asarray(dense_bias, dtype=np.float32)
+        self.__activation = str(activation)
+        self.__recurrent_activation = str(recurrent_activation)
+        self.__dense_activation = str(dense_activation)
+        # fail on load, not on the first forecast
+        for name in [self.__activation, self.__recurrent_activation, self.__dense_activation]:
+            get_activation(name)
+
+    # Export the weights of a Keras Sequential of a LSTM layer and a Dense layer
+    @staticmethod
+    def from_keras(model):
+        lstm, dense = model.layers
+        lstm_config = lstm.get_config()
+        lstm_weights = lstm.get_weights()
+        units = lstm_weights[1].shape[0]
+        bias = lstm_weights[2] if len(lstm_weights) > 2 else np.zeros(units * 4)
+        dense_weights = dense.get_weights()
+        dense_bias = dense_weights[1] if len(dense_weights) > 1 else np.zeros(dense_weights[0].shape[1])
+        return LSTMRuntime(lstm_weights[0], lstm_weights[1], bias, dense_weights[0], dense_bias,
+                           activation=lstm_config['activation'],
+                           recurrent_activation=lstm_config['recurrent_activation'],
+                           dense_activation=dense.get_config()['activation'])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, kernel=self.__kernel, recurrent_kernel=self.__recurrent_kernel, bias=self.__bias,
+                     dense_kernel=self.__dense_kernel, dense_bias=self.__dense_bias,
+                     activation=np.array(self.__activation),
+                     recurrent_activation=np.array(self.__recurrent_activation),
+                     dense_activation=np.array(self.__dense_activation))
+
+    @staticmethod
+    def load(path):
+        with np.load(path, allow_pickle=False) as weights:
+            return LSTMRuntime(weights['kernel'], weights['recurrent_kernel'], weights['bias'],
+                               weights['dense_kernel'], weights['dense_bias'],
+                               activation=weights['activation'].item(),
+                               recurrent_activation=weights['recurrent_activation'].item(),
+                               dense_activation=weights['dense_activation'].item())
+
+    # Parameters:
+    #   batch: an array of shape (samples, window, factors)
+    # Return:
+    #   an array of shape (samples, future target)
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        activation = get_activation(self.__activation)
+        recurrent_activation = get_activation(self.__recurrent_activation)
+        units = self.__recurrent_kernel.shape[0]
+
+        # the input projection of every step at once, only the recurrent part is sequential
+        inputs = np.matmul(batch, self.__kernel) + self.__bias
+        hidden = np.zeros((len(batch), units), dtype=np.float32)
+        cell = np.zeros((len(batch), units), dtype=np.float32)
+        for step in range(batch.shape[1]):
+            z = inputs[:, step] + np.matmul(hidden, self.__recurrent_kernel)
+            input_gate = recurrent_activation(z[:, :units])
+            forget_gate = recurrent_activation(z[:, units: units * 2])
+            output_gate = recurrent_activation(z[:, units * 3:])
+            cell = forget_gate * cell + input_gate * activation(z[:, units * 2: units * 3])
+            hidden = output_gate * activation(cell)
+
+        return get_activation(self.__dense_activation)(np.matmul(hidden, self.__dense_kernel) + self.__dense_bias)
@@ -6,3 +6,5 @@ class ModelType(enum.Enum):
     AutoMLNoLags = 1
     AutoMLLags = 2
     LSTM = 3
+    SeasonalNaive = 4
+    ExponentialSmoothing = 5
@@ -1,4 +1,3 @@
-from functools import reduce
 import json
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
@@ -8,6 +7,7 @@ from common.util.fill_type import Fill
 from common.util.series import Series
 from common.util.timeutil import convert_freq
 from common.util.constant import VALUE, TIMESTAMP
+from forecast.util.window import FactorWindows, sliding_window as window_view
 
 def fill_missing(input_series, fill_type: Fill, fill_value):
     if fill_type == Fill.NotFill:
@@ -29,10 +29,7 @@ def fill_missing(input_series, fill_type: Fill, fill_value):
 class MultivariateData:
     def __init__(self, target: Series, factors, gran, custom_in_seconds, effective_factors=None, fill_type=Fill.Linear,
                  fill_value=0):
-        self.__target = pd.DataFrame(target.value)
-        self.__target = self.__target[[TIMESTAMP, VALUE]]
-        self.__target[TIMESTAMP] = pd.to_datetime(self.__target[TIMESTAMP])
-        self.__target[TIMESTAMP] = self.__target[TIMESTAMP].dt.tz_localize(None)
+        self.__target = target.to_frame()
         self.__factors = {}
         for factor in factors:
             if effective_factors is not None and factor.name not in effective_factors:
@@ -45,6 +42,7 @@ class MultivariateData:
         self.__custom_in_seconds = custom_in_seconds
         self.__fill_type = fill_type
         self.__fill_value = fill_value
+        self.__windows = None
 
     @property
     def fill_type(self):
@@ -72,6 +70,45 @@ class MultivariateData:
     def generate_outer_join_factors(self):
         return MultivariateData.generate_outer_join_frame(self.__factors.values(), self.__fill_type, self.__fill_value)
 
+    # Windows of the effective factors, aligned on the granularity, filled and optionally normalized.
+    # The matrix is built once, over the data and the requested range, and reused while later
+    # requests fall in it, so a window costs the same however many timestamps are queried
+    # Parameters:
+    #   window: number of points in a window
+    #   first_end, last_end: naive UTC timestamps, the range of window ends, None for the last point of the data
+    #   normalize: optional, a function applied once to the 2-D array of factor values
+    # Return:
+    #   a FactorWindows
+    def get_factor_windows(self, window, first_end=None, last_end=None, normalize=None):
+        cached = self.__windows
+        if cached is not None and cached.window == window and cached.normalize == normalize \
+                and first_end is not None and last_end is not None and cached.covers(first_end, last_end):
+            return cached
+
+        input_factors = self.generate_outer_join_factors()
+        data_end = input_factors[TIMESTAMP].max()
+        first_end = data_end if first_end is None else first_end
+        last_end = data_end if last_end is None else max(last_end, data_end)
+        if self.__fill_type == Fill.NotFill:
+            input_factors = input_factors.sort_values(TIMESTAMP)
+        else:
+            freq = convert_freq(self.__gran, self.__custom_in_seconds)
+            start = min(input_factors[TIMESTAMP].min(), first_end)
+            periods = window - 1 + len(pd.date_range(start=start, end=last_end, freq=freq))
+            input_factors = MultivariateData.gen_filled_missing_by_period(input_factors, self.__gran,
+                                                                          self.__custom_in_seconds,
+                                                                          end_time=last_end, periods=periods,
+                                                                          fill_type=self.__fill_type,
+                                                                          fill_value=self.__fill_value)
+
+        values = np.array(input_factors.reindex(columns=self.__effective_factors).values, dtype=np.float64)
+        if normalize is not None:
+            values = normalize(values)
+        windows = FactorWindows(input_factors[TIMESTAMP].values.astype('datetime64[ns]'), values, window,
+                                first_end, last_end, normalize)
+        self.__windows = windows
+        return windows
+
     @staticmethod
     def generate_filled_missing_frame(input_frame, gran, custom_in_seconds, fill_type: Fill, fill_value):
         if fill_type == Fill.NotFill:
@@ -94,36 +131,83 @@ class MultivariateData:
 
     @staticmethod
     def generate_inner_join_frame(input_frames):
-        return reduce(lambda left, right: pd.merge(left, right, on=TIMESTAMP, how='inner'), input_frames)
+        return MultivariateData.align_frames(input_frames, outer=False)
 
     @staticmethod
     def generate_outer_join_frame(input_frames, fill_type: Fill, fill_value):
         if fill_type == Fill.NotFill:
             return MultivariateData.generate_inner_join_frame(input_frames)
-        merged = reduce(lambda left, right: pd.merge(left, right, on=TIMESTAMP, how='outer'), input_frames)
+        merged = MultivariateData.align_frames(input_frames, outer=True)
         return fill_missing(merged, fill_type, fill_value)
 
+    # Join frames on TIMESTAMP in one pass: the union (outer) or intersection (inner) of the timestamps
+    # is built once, then the columns of every frame are scattered into one preallocated array.
+    # Same result as folding pd.merge over the frames when timestamps are unique in each frame
+    # Parameters:
+    #   input_frames: frames with a TIMESTAMP column and value columns
+    #   outer: True for the union of timestamps, missing values are NaN, False for the intersection
+    # Return:
+    #   a frame of TIMESTAMP, sorted, and the value columns of all frames in order
+    @staticmethod
+    def align_frames(input_frames, outer):
+        input_frames = list(input_frames)
+        stamps = [np.unique(frame[TIMESTAMP].values.astype('datetime64[ns]')) for frame in input_frames]
+        if len(stamps) == 0:
+            return pd.DataFrame(columns=[TIMESTAMP])
+
+        if outer:
+            index = np.unique(np.concatenate(stamps))
+        else:
+            index, counts = np.unique(np.concatenate(stamps), return_counts=True)
+            index = index[counts == len(stamps)]
+
+        columns = [[column for column in frame.columns if column != TIMESTAMP] for frame in input_frames]
+        values = np.full((len(index), sum(len(x) for x in columns)), np.nan)
+        start = 0
+        for frame, frame_columns in zip(input_frames, columns):
+            frame_stamps = frame[TIMESTAMP].values.astype('datetime64[ns]')
+            positions = np.searchsorted(index, frame_stamps)
+            found = positions < len(index)
+            found[found] = index[positions[found]] == frame_stamps[found]
+            values[positions[found], start: start + len(frame_columns)] = frame[frame_columns].values[found]
+            start += len(frame_columns)
+
+        merged = pd.DataFrame(values, columns=[column for frame_columns in columns for column in frame_columns])
+        merged.insert(0, TIMESTAMP, index)
+        return merged
+
     @staticmethod
     def get_normalized_batch(sliding_window, future_target_step, label, factors):
+        train, label = MultivariateData.get_normalized_matrix(label, factors)
+        return MultivariateData.get_windows(sliding_window, future_target_step, label, train)
+
+    # Return:
+    #   train: factors scaled to [0, 1] column by column, NaN replaced by 0
+    #   label: the VALUE column of label scaled to [0, 1]
+    @staticmethod
+    def get_normalized_matrix(label, factors):
         scale = MinMaxScaler(feature_range=(0, 1))
         label = np.array(label[VALUE])
         label = scale.fit_transform(label.reshape(-1, 1))
         label = label.reshape(len(label))
         train = scale.fit_transform(factors)
         np.nan_to_num(train, copy=False)
-        batch_train = np.array([train[i: i + sliding_window]
-                                for i in range(0, len(train) - (sliding_window + future_target_step) + 1)])
-        batch_labels = np.array([label[i:i + future_target_step] for i in range(sliding_window,
-                                                                                len(label) - future_target_step + 1)])
-        return batch_train, batch_labels
+        return train, label
 
     @staticmethod
     def get_batch(sliding_window, future_target_step, label, factors):
         label = np.array(label[VALUE])
         label = label.reshape(len(label))
         train = factors.values
-        batch_train = np.array([train[i: i + sliding_window]
-                                for i in range(0, len(train) - (sliding_window + future_target_step) + 1)])
-        batch_labels = np.array([label[i:i + future_target_step] for i in range(sliding_window,
-                                                                                len(label) - future_target_step + 1)])
+        return MultivariateData.get_windows(sliding_window, future_target_step, label, train)
+
+    # Input windows and the label windows following them, as read-only views of train and label
+    # Return:
+    #   batch_train: shape (count, sliding_window, factors), batch_train[i] is train[i: i + sliding_window]
+    #   batch_labels: shape (count, future_target_step), batch_labels[i] is the next future_target_step labels
+    @staticmethod
+    def get_windows(sliding_window, future_target_step, label, train):
+        count = max(0, len(train) - (sliding_window + future_target_step) + 1)
+        batch_train = window_view(train, sliding_window)[:count]
+        batch_labels = window_view(label, future_target_step)[sliding_window: sliding_window + count]
         return batch_train, batch_labels
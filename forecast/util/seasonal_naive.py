@@ -0,0 +1,110 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from forecast.util.model_type import ModelType
+from forecast.util.multivariate import MultivariateData
+from forecast.util.univariate_model import get_filled_values, get_filled_target, to_forecast_items
+from forecast.util.validation import get_validation_start, get_validation_ends, get_mean_absolute_percentage_error
+from forecast.util.util import get_season_length
+
+from common.util.constant import TIMESTAMP
+
+
+# Seasonal naive forecast of the target: the value h points ahead is the value one season before it.
+# A NumPy baseline which needs no factors and trains in milliseconds, error bands come from the
+# validation MAPE of every step as for LSTMModel
+class SeasonalNaiveModel:
+    def __init__(self, season, window, end_time, future_target_size, validation_ratio,
+                 mean_absolute_percentage_error=None):
+        self.__season = max(1, season)
+        self.__window = window
+        self.__end_time = end_time
+        self.__future_target = future_target_size
+        self.__validation_ratio = validation_ratio
+        self.__mean_absolute_percentage_error = mean_absolute_percentage_error
+        self.__fit_model = ModelType.SeasonalNaive
+
+    @staticmethod
+    def create(window, end_time, future_target_size, validation_ratio, gran, custom_in_seconds):
+        return SeasonalNaiveModel(get_season_length(gran, custom_in_seconds), window, end_time, future_target_size,
+                                  validation_ratio)
+
+    # Return: index of the value used to forecast each step from the last observed point `ends`
+    def __source_index(self, ends):
+        steps = np.arange(self.__future_target)
+        return np.asarray(ends)[:, np.newaxis] + 1 + steps - self.__season * (steps // self.__season + 1)
+
+    # Parameters:
+    #   validation_start: optional, the timestamp the validated forecasts start at, see get_validation_start
+    def train(self, input_data: MultivariateData, validation_start=None, **kwargs):
+        if validation_start is None:
+            validation_start = get_validation_start(input_data, self.__future_target, self.__validation_ratio)
+        stamps, values, actual = get_filled_values(input_data)
+
+        ends = get_validation_ends(stamps, self.__season - 1, self.__future_target, validation_start)
+        if len(ends) == 0:
+            raise Exception('Not enough data to train, {} points for season {} and target {}.'.format(
+                len(values), self.__season, self.__future_target))
+
+        actual = actual[ends[:, np.newaxis] + 1 + np.arange(self.__future_target)]
+        self.__mean_absolute_percentage_error = get_mean_absolute_percentage_error(
+            values[self.__source_index(ends)], actual)
+
+    def get_mean_absolute_percentage_error(self):
+        return list(self.__mean_absolute_percentage_error)
+
+    def get_effective_factor(self):
+        return []
+
+    def get_model_type(self):
+        return self.__fit_model
+
+    def get_end_time(self):
+        return self.__end_time
+
+    def get_season(self):
+        return self.__season
+
+    def save_model(self, model_dir):
+        with open(os.path.join(model_dir, 'SeasonalNaive-Meta.pkl'), "wb") as f:
+            meta = {
+                'mean_absolute_percentage_error': self.__mean_absolute_percentage_error,
+                'end_time': self.__end_time,
+                'future_target': self.__future_target,
+                'window': self.__window,
+                'season': self.__season,
+                'validation_ratio': self.__validation_ratio
+            }
+            pickle.dump(meta, f)
+
+    @staticmethod
+    def load_model(model_dir):
+        with open(os.path.join(model_dir, 'SeasonalNaive-Meta.pkl'), "rb") as f:
+            meta = pickle.load(f)
+        return SeasonalNaiveModel(meta['season'], meta['window'], meta['end_time'], meta['future_target'],
+                                  meta['validation_ratio'], meta['mean_absolute_percentage_error'])
+
+    def inference(self, input_data: MultivariateData, window, timestamp, **kwargs):
+        if timestamp is None:
+            timestamp = pd.Timestamp(input_data.get_target()[TIMESTAMP].max())
+        return self.batch_inference(input_data, window, [timestamp])[0]
+
+    # Forecast at a number of timestamps, the target is filled once over the range of all of them
+    # Return:
+    #   an array of forecast items for each timestamp, empty if there is not a season of data before it
+    def batch_inference(self, input_data: MultivariateData, window, timestamps, **kwargs):
+        results = [[] for _ in timestamps]
+        if len(timestamps) == 0 or len(input_data.get_target()) == 0:
+            return results
+
+        _, values, positions, freq = get_filled_target(input_data, timestamps)
+        sources = self.__source_index(positions)
+        valid = np.nonzero((sources.min(axis=1) >= 0) & (positions >= 0))[0]
+        predicted = values[sources[valid]]
+        for row, idx in enumerate(valid):
+            results[idx] = to_forecast_items(timestamps[idx], predicted[row], self.__mean_absolute_percentage_error,
+                                             freq)
+        return results
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from forecast.util.multivariate import MultivariateData
+from forecast.util.univariate_forecast_item import UnivariateForecastItem
+
+from common.util.timeutil import convert_freq
+from common.util.constant import TIMESTAMP, VALUE
+
+# Helpers shared by the univariate models, which forecast the target from its own history only
+
+# The target filled on the granularity over its whole range
+# Return:
+#   stamps: datetime64[ns] of the filled points
+#   values: float64 of the filled points
+#   actual: values of the observed points, NaN for the filled ones, the values forecasts are validated on
+def get_filled_values(input_data: MultivariateData):
+    observed = input_data.get_target()
+    target = MultivariateData.generate_filled_missing_frame(observed, input_data.get_gran(),
+                                                            input_data.get_custom_in_seconds(),
+                                                            fill_type=input_data.fill_type,
+                                                            fill_value=input_data.fill_value)
+    stamps = target[TIMESTAMP].values.astype('datetime64[ns]')
+    values = np.asarray(target[VALUE].values, dtype=np.float64)
+    observed_values = np.asarray(observed[VALUE].values, dtype=np.float64)
+    observed_stamps = observed[TIMESTAMP].values.astype('datetime64[ns]')[~np.isnan(observed_values)]
+    actual = np.where(np.isin(stamps, observed_stamps), values, np.nan)
+    return stamps, values, actual
+
+
+# The target filled on the granularity up to the last of timestamps
+# Parameters:
+#   first: optional, a timestamp on the granularity the filled points start at or before
+# Return:
+#   stamps: datetime64[ns] of the filled points
+#   values: float64 of the filled points
+#   positions: index of the last point at or before each timestamp, -1 if there is none
+#   freq: the frequency of the points
+def get_filled_target(input_data: MultivariateData, timestamps, first=None):
+    target = input_data.get_target()
+    freq = convert_freq(input_data.get_gran(), input_data.get_custom_in_seconds())
+    ends = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).tz_localize(None)
+    last_end = max(ends.max(), target[TIMESTAMP].max())
+    start = min(ends.min(), target[TIMESTAMP].min())
+    if first is not None:
+        start = min(start, pd.Timestamp(first))
+    periods = len(pd.date_range(start=start, end=last_end, freq=freq))
+    target = MultivariateData.gen_filled_missing_by_period(target, input_data.get_gran(),
+                                                           input_data.get_custom_in_seconds(),
+                                                           end_time=last_end, periods=periods,
+                                                           fill_type=input_data.fill_type,
+                                                           fill_value=input_data.fill_value)
+    stamps = target[TIMESTAMP].values.astype('datetime64[ns]')
+    values = np.asarray(target[VALUE].values, dtype=np.float64)
+    positions = np.searchsorted(stamps, ends.values, side='right') - 1
+    return stamps, values, positions, freq
+
+
+# Forecast items of one timestamp, bands are the MAPE of every step around the forecast
+def to_forecast_items(timestamp, predicted, mean_absolute_percentage_error, freq):
+    target_timestamps = pd.date_range(start=timestamp, periods=len(predicted), freq=freq)
+    return [UnivariateForecastItem(predicted[i],
+                                   predicted[i] - abs(predicted[i]) * mean_absolute_percentage_error[i],
+                                   predicted[i] + abs(predicted[i]) * mean_absolute_percentage_error[i],
+                                   (1 - mean_absolute_percentage_error[i]),
+                                   timestamp=target_timestamps[i]).to_dict()
+            for i in range(0, len(predicted))]
@@ -48,3 +48,24 @@ def get_max_lag(gran, window):
         lag = 7
 
     return int(min(lag, MAX_LAG_LENGTH))
+
+# Number of points in one season, the period a seasonal model repeats
+def get_season_length(gran, custom_in_seconds):
+    if gran == Gran.Yearly:
+        season = 1
+    elif gran == Gran.Monthly:
+        season = 12
+    elif gran == Gran.Weekly:
+        season = 52
+    elif gran == Gran.Daily:
+        season = 7
+    elif gran == Gran.Hourly:
+        season = DAY_IN_SECONDS / HOUR_IN_SECONDS
+    elif gran == Gran.Minutely:
+        season = DAY_IN_SECONDS / MINT_IN_SECONDS
+    elif gran == Gran.Secondly:
+        season = MINT_IN_SECONDS
+    else:
+        season = DAY_IN_SECONDS / custom_in_seconds
+
+    return max(1, int(season))
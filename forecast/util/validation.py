@@ -0,0 +1,52 @@
+import numpy as np
+
+from common.util.constant import TIMESTAMP, VALUE
+
+# Forecasts of the last points at most are backtested in training, bounds the memory of the backtest
+MAX_VALIDATION_POINTS = 200
+
+
+# Helpers shared by all models to backtest their forecasts. The candidates of a training are compared by
+# their MAPE, so every model validates the forecasts starting from the same timestamp, on the raw target
+
+# The first timestamp validated forecasts start at: the forecasts from the last validation_ratio of the
+# observed target points with future_target_size points after them, at most MAX_VALIDATION_POINTS
+# Return:
+#   a datetime64[ns]
+def get_validation_start(input_data, future_target_size, validation_ratio):
+    target = input_data.get_target()
+    stamps = np.sort(target[TIMESTAMP].values[~np.isnan(np.asarray(target[VALUE].values, dtype=np.float64))]
+                     .astype('datetime64[ns]'))
+    count = len(stamps) - future_target_size
+    if count < 2:
+        raise Exception('Not enough data to train, {} points for target {}.'.format(len(stamps),
+                                                                                    future_target_size))
+    validation_count = min(MAX_VALIDATION_POINTS, max(1, int(count * validation_ratio)))
+    return stamps[max(1, count - validation_count + 1)]
+
+
+# The points the forecasts are backtested from, the points with future_target_size points after them
+# whose forecast starts at or after validation_start
+# Parameters:
+#   stamps: sorted datetime64[ns] of the points
+#   first: the first point a forecast could start from
+# Return:
+#   an array of indexes of the last observed point of each forecast
+def get_validation_ends(stamps, first, future_target_size, validation_start):
+    ends = np.arange(max(0, first), len(stamps) - future_target_size)
+    return ends[stamps[ends + 1] >= validation_start]
+
+
+# MAPE of every forecast step, steps without any valid error count as 1
+# Parameters:
+#   predicted, actual: arrays of shape (forecasts, steps, ...), NaN actual values are not counted
+# Return:
+#   an array of shape (steps, ...)
+def get_mean_absolute_percentage_error(predicted, actual):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.abs(predicted - actual) / np.abs(actual)
+    error[np.isinf(error)] = np.nan
+    valid = np.any(~np.isnan(error), axis=0)
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(np.where(valid, error, 1.0), axis=0)
+    return np.where(valid, mean, 1.0)
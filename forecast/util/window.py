@@ -0,0 +1,55 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+# All windows of window consecutive rows of array, as a read-only view without copying
+# Parameters:
+#   array: an array with rows on the first axis
+#   window: number of rows in a window
+# Return:
+#   a view of shape (len(array) - window + 1, window, ...), window i is array[i: i + window]
+def sliding_window(array, window):
+    array = np.asarray(array)
+    count = max(0, len(array) - window + 1)
+    return as_strided(array, shape=(count, window) + array.shape[1:], strides=(array.strides[0],) + array.strides,
+                      writeable=False)
+
+
+# Windows over a matrix of timestamped rows, the window of a timestamp ends at the last row not after it
+# Parameters:
+#   timestamps: sorted datetime64[ns] array, one for each row
+#   values: 2-D array of the rows
+#   window: number of rows in a window
+#   first_end, last_end: the range of window ends the matrix was built for
+#   normalize: the function the values were normalized with, if any
+class FactorWindows:
+    def __init__(self, timestamps, values, window, first_end, last_end, normalize=None):
+        self.timestamps = timestamps
+        self.values = values
+        self.window = window
+        self.first_end = first_end
+        self.last_end = last_end
+        self.normalize = normalize
+        self.windows = sliding_window(values, window)
+
+    def covers(self, first_end, last_end):
+        return self.first_end <= first_end and last_end <= self.last_end
+
+    # Return: index of the window ending at each timestamp in windows, -1 if there are not enough rows before it
+    def positions(self, timestamps):
+        positions = np.searchsorted(self.timestamps, timestamps, side='right') - self.window
+        positions[positions < 0] = -1
+        return positions
+
+    # Return: the window ending at timestamp, a view, or None
+    def get(self, timestamp):
+        position = self.positions(np.array([timestamp], dtype='datetime64[ns]'))[0]
+        return self.windows[position] if position >= 0 else None
+
+    # Return:
+    #   indices: indices of the timestamps which have a window
+    #   batch: array of shape (len(indices), window, columns), the windows of those timestamps
+    def take(self, timestamps):
+        positions = self.positions(np.asarray(timestamps, dtype='datetime64[ns]'))
+        indices = np.nonzero(positions >= 0)[0]
+        return indices, self.windows[positions[indices]]
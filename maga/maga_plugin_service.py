@@ -13,19 +13,13 @@ from common.util.constant import InferenceState
 from common.util.timeutil import dt_to_str, dt_to_str_file_name, str_to_dt, get_time_offset
 from common.util.csv import save_to_csv
 from common.util.azureblob import AzureBlob
+from common.util.artifactstore import get_artifact_store
 from common.util.meta import get_meta, update_state, get_model_list, clear_state_when_necessary
 
 from maga.magaclient import MAGAClient
 
-from concurrent.futures import ThreadPoolExecutor
-import asyncio
-
 from telemetry import log
 
-# async infras
-executor = ThreadPoolExecutor()
-loop = asyncio.new_event_loop()
-
 class MagaPluginService(PluginService):
 
     def __init__(self):
@@ -155,6 +149,15 @@ class MagaPluginService(PluginService):
 
         return min_start_time, max_end_time
 
+    # Upload the files of data_dir as a zip named by the hash of the files, so the same data is uploaded
+    # once, and different data of the same time range never overwrite each other. The zip is removed
+    # by the artifact collection once it is not used for gc_grace seconds
+    # Return:
+    #   the name of the blob
+    def upload_data(self, prefix, data_dir):
+        # in the deflated format MAGA reads
+        return get_artifact_store(self.config).put_data_zip(prefix, data_dir)
+
     def prepare_training_data(self, parameters):
         start_time, end_time = self.get_data_time_range(parameters)
 
@@ -176,22 +179,8 @@ class MagaPluginService(PluginService):
                 save_to_csv(csv_data, os.path.join(data_dir, csv_file))
                 variable[factor.series_id] = csv_file
             
-            zip_dir = os.path.abspath(os.path.join(data_dir, os.pardir))
-            zip_file_base = os.path.join(zip_dir, 'training_data')
-            zip_file = zip_file_base + '.zip'
-            if os.path.exists(zip_file):
-                os.remove(zip_file)
-            shutil.make_archive(zip_file_base, 'zip', data_dir)
-
-            azure_blob = AzureBlob(self.config.az_tsana_model_blob_connection)
             container_name = self.config.tsana_app_name
-            azure_blob.create_container(container_name)
-
-            blob_name = 'training_data_' + time_key
-            with open(zip_file, "rb") as data:
-                azure_blob.upload_blob(container_name, blob_name, data)
-
-            os.remove(zip_file)
+            blob_name = self.upload_data('training_data_', data_dir)
             blob_url = AzureBlob.generate_blob_sas(self.config.az_storage_account, self.config.az_storage_account_key, container_name, blob_name)
 
             result = {}
@@ -227,22 +216,8 @@ class MagaPluginService(PluginService):
                 csv_data.extend([(tuple['timestamp'], tuple['value']) for tuple in factor.value])
                 save_to_csv(csv_data, os.path.join(data_dir, csv_file))
             
-            zip_dir = os.path.abspath(os.path.join(data_dir, os.pardir))
-            zip_file_base = os.path.join(zip_dir, 'inference_data')
-            zip_file = zip_file_base + '.zip'
-            if os.path.exists(zip_file):
-                os.remove(zip_file)
-            shutil.make_archive(zip_file_base, 'zip', data_dir)
-
-            azure_blob = AzureBlob(self.config.az_tsana_model_blob_connection)
             container_name = self.config.tsana_app_name
-            azure_blob.create_container(container_name)
-
-            blob_name = 'inference_data_' + time_key
-            with open(zip_file, "rb") as data:
-                azure_blob.upload_blob(container_name, blob_name, data)
-
-            os.remove(zip_file)
+            blob_name = self.upload_data('inference_data_', data_dir)
             blob_url = AzureBlob.generate_blob_sas(self.config.az_storage_account, self.config.az_storage_account_key, container_name, blob_name)
 
             result = {}
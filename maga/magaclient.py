@@ -10,8 +10,7 @@ class MAGAClient(object):
         self.endpoint = endpoint
         self.username = username
         self.password = password
-        self.retrycount = retrycount
-        self.retryinterval = retryinterval
+        self.retryrequests = RetryRequests(retrycount, retryinterval)
 
     def post(self, path, data, subscription):
         url = self.endpoint + path
@@ -20,9 +19,8 @@ class MAGAClient(object):
             auth = (self.username, self.password)
         else:
             auth = None
-        retryrequests = RetryRequests(self.retrycount, self.retryinterval)
         try:
-            r = retryrequests.post(url=url, headers=headers, auth=auth, data=json.dumps(data),
+            r = self.retryrequests.post(url=url, headers=headers, auth=auth, data=json.dumps(data),
                                    timeout=REQUEST_TIMEOUT_SECONDS, verify=False)
             if r.status_code != 204:
                 return r.json()
@@ -36,9 +34,8 @@ class MAGAClient(object):
             auth = (self.username, self.password)
         else:
             auth = None
-        retryrequests = RetryRequests(self.retrycount, self.retryinterval)
         try:
-            r = retryrequests.get(url=url, headers=headers, auth=auth, timeout=REQUEST_TIMEOUT_SECONDS, verify=False)
+            r = self.retryrequests.get(url=url, headers=headers, auth=auth, timeout=REQUEST_TIMEOUT_SECONDS, verify=False)
             return r.json()
         except Exception as e:
             raise Exception('MAGA service api "{}" failed, {}'.format(path, str(e)))
@@ -50,9 +47,8 @@ class MAGAClient(object):
             auth = (self.username, self.password)
         else:
             auth = None
-        retryrequests = RetryRequests(self.retrycount, self.retryinterval)
         try:
-            r = retryrequests.delete(url=url, headers=headers, auth=auth, timeout=REQUEST_TIMEOUT_SECONDS, verify=False)
+            r = self.retryrequests.delete(url=url, headers=headers, auth=auth, timeout=REQUEST_TIMEOUT_SECONDS, verify=False)
             if r.status_code != 204:
                 return r.json()
         except Exception as e:
@@ -7,7 +7,7 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pard
 environ['SERVICE_CONFIG_FILE'] = 'maga/config/service_config.yaml'
 from maga.maga_plugin_service import MagaPluginService
 from common.plugin_model_api import api, PluginModelAPI, PluginModelListAPI, PluginModelTrainAPI, \
-    PluginModelInferenceAPI, app, PluginModelParameterAPI
+    PluginModelInferenceAPI, app, PluginModelParameterAPI, PluginModelStatsAPI
 
 multivariate = MagaPluginService()
 
@@ -16,6 +16,7 @@ api.add_resource(PluginModelAPI, '/multivariate/models/<model_id>', resource_cla
 api.add_resource(PluginModelTrainAPI, '/multivariate/models/train', resource_class_kwargs={'plugin_service': multivariate})
 api.add_resource(PluginModelInferenceAPI, '/multivariate/models/<model_id>/inference', resource_class_kwargs={'plugin_service': multivariate})
 api.add_resource(PluginModelParameterAPI, '/multivariate/parameters', resource_class_kwargs={'plugin_service': multivariate})
+api.add_resource(PluginModelStatsAPI, '/multivariate/stats', resource_class_kwargs={'plugin_service': multivariate})
 
 if __name__ == '__main__':
     HOST = environ.get('SERVER_HOST', '0.0.0.0')
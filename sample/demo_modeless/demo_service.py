@@ -34,7 +34,7 @@ class DemoService(PluginService):
             copied = copy.deepcopy(series)
 
             for data in copied:
-                data.value = data.value * amplifier
+                data.values = data.values * amplifier
 
             self.tsanaclient.save_inference_result(parameters, copied)
 